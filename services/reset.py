@@ -1,5 +1,6 @@
 ﻿# reset_pipeline.py
-# Borra (a elección) Redis (stream + dedup + rev), DB SQLite, cola MT4 y CSV.
+# Borra (a elección) Redis (streams normal y prio + dedup + rev + idem + diccionario de canales),
+# DB SQLite, cola MT4 y CSV.
 # Seguro por defecto: pide confirmación; soporta --dry-run y --force.
 
 import os
@@ -19,10 +20,15 @@ except ImportError:
 # ===== Config por entorno =====
 REDIS_URL     = os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0")
 REDIS_STREAM  = os.getenv("REDIS_STREAM", "pasarela:parse")
+REDIS_STREAM_PRIO = os.getenv("REDIS_STREAM_PRIO", REDIS_STREAM + ":prio")   # comun/prioridad.stream_prio
 REDIS_GROUP   = os.getenv("REDIS_GROUP", "parser")
+REDIS_CANALES = os.getenv("REDIS_CANALES", "pasarela:canales")   # username/título por canal (stream v2)
 DEDUP_PATTERNS = [
-    "tg:dedup:*",
+    "tg:revs:*",     # revisión + dedup por canal (hash) ...
+    "tg:vistos:*",   # ... y su índice de caducidad (zset)
+    "tg:dedup:*",    # esquema antiguo, una clave por mensaje (migrar_dedup.py)
     "tg:rev:*",
+    "tg:idem:*",     # idempotencia de publicación por captura (listener/spool)
 ]
 
 APPDATA       = os.getenv("APPDATA") or ""
@@ -53,39 +59,42 @@ def human_del_list(items):
 # ===== Redis cleanup =====
 def clear_redis(dry_run: bool = False):
     r = redis.Redis.from_url(REDIS_URL, decode_responses=True)
-    report = {"stream_trimmed": False, "groups_destroyed": [], "keys_deleted": 0, "keys_list": []}
-
-    # 1) Destruir consumer group (si existe)
-    try:
-        groups = r.xinfo_groups(REDIS_STREAM)
-        gnames = [g.get("name") for g in groups]
-    except Exception:
-        gnames = []
-
-    if REDIS_GROUP in gnames:
-        if dry_run:
-            report["groups_destroyed"].append(REDIS_GROUP + " (dry-run)")
-        else:
-            try:
-                r.xgroup_destroy(REDIS_STREAM, REDIS_GROUP)
-                report["groups_destroyed"].append(REDIS_GROUP)
-            except Exception as e:
-                report["groups_destroyed"].append(f"{REDIS_GROUP} (err: {e})")
-
-    # 2) Vaciar el stream
-    try:
-        # XTRIM MAXLEN 0 borra todas las entradas
-        if dry_run:
-            report["stream_trimmed"] = "dry-run"
-        else:
-            r.xtrim(REDIS_STREAM, 0, approximate=False)
-            report["stream_trimmed"] = True
-    except Exception as e:
-        report["stream_trimmed"] = f"err: {e}"
-
-    # 3) Borrar claves auxiliares (dedup, rev)
+    report = {"stream_trimmed": {}, "groups_destroyed": [], "keys_deleted": 0, "keys_list": []}
+
+    for stream in (REDIS_STREAM, REDIS_STREAM_PRIO):
+        # 1) Destruir consumer group (si existe)
+        try:
+            groups = r.xinfo_groups(stream)
+            gnames = [g.get("name") for g in groups]
+        except Exception:
+            gnames = []
+
+        if REDIS_GROUP in gnames:
+            if dry_run:
+                report["groups_destroyed"].append(f"{stream}/{REDIS_GROUP} (dry-run)")
+            else:
+                try:
+                    r.xgroup_destroy(stream, REDIS_GROUP)
+                    report["groups_destroyed"].append(f"{stream}/{REDIS_GROUP}")
+                except Exception as e:
+                    report["groups_destroyed"].append(f"{stream}/{REDIS_GROUP} (err: {e})")
+
+        # 2) Vaciar el stream
+        try:
+            # XTRIM MAXLEN 0 borra todas las entradas
+            if dry_run:
+                report["stream_trimmed"][stream] = "dry-run"
+            else:
+                r.xtrim(stream, 0, approximate=False)
+                report["stream_trimmed"][stream] = True
+        except Exception as e:
+            report["stream_trimmed"][stream] = f"err: {e}"
+
+    # 3) Borrar claves auxiliares (dedup, rev, idem, diccionario de canales)
     keys_to_del = []
     try:
+        if r.exists(REDIS_CANALES):
+            keys_to_del.append(REDIS_CANALES)
         for pattern in DEDUP_PATTERNS:
             cursor = 0
             while True:
@@ -161,7 +170,7 @@ def clear_csv(dry_run: bool = False):
 def main():
     ap = argparse.ArgumentParser(description="Reinicia el pipeline a estado limpio (Redis / DB / MT4 / CSV).")
     ap.add_argument("--all", action="store_true", help="Borrar TODO (Redis + DB + MT4 + CSV).")
-    ap.add_argument("--redis", action="store_true", help="Borrar solo Redis (stream + dedup + rev).")
+    ap.add_argument("--redis", action="store_true", help="Borrar solo Redis (streams + dedup + rev + idem + canales).")
     ap.add_argument("--db", action="store_true", help="Borrar solo base de datos SQLite.")
     ap.add_argument("--mt4", action="store_true", help="Borrar solo archivos de la cola MT4 (queue_order/queue_spool).")
     ap.add_argument("--csv", action="store_true", help="Borrar solo CSV.")
@@ -181,11 +190,12 @@ def main():
     if args.all or args.redis:
         print("\n— Redis —")
         rep = clear_redis(dry_run=args.dry_run)
-        print(f"  stream='{REDIS_STREAM}' → trim={rep.get('stream_trimmed')}")
+        for stream, trim in rep["stream_trimmed"].items():
+            print(f"  stream='{stream}' → trim={trim}")
         if rep.get("groups_destroyed"):
             print(f"  groups destruidos: {rep['groups_destroyed']}")
         if rep.get("keys_list") is not None:
-            print(f"  claves auxiliares (patrones {DEDUP_PATTERNS}): {human_del_list(rep['keys_list'])}")
+            print(f"  claves auxiliares (patrones {DEDUP_PATTERNS} + {REDIS_CANALES}): {human_del_list(rep['keys_list'])}")
             print(f"  total borrado: {rep.get('keys_deleted')}")
 
     if args.all or args.db:
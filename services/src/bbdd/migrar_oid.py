@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# migrar_oid.py — pasa los oid antiguos (YYYYMMDD-NNNNN) de Trazas_Unica al formato de comun/oid.py
+# - oid nuevo a partir de ts_redis_ingest/ts_utc, ch_id, msg_id y revisión (1 si no consta).
+# - El oid antiguo queda en oid_legacy; 'comment' NO se toca (las órdenes abiertas en MT4 lo llevan).
+# - Crea columnas revision/oid_legacy e índice (ch_id, msg_id) si faltan.
+# - Por defecto solo simula; con --aplicar hace copia .bak y migra en una única transacción.
+#   Las filas que el esquema antiguo ya había pisado (misma fecha + msg_id de otro canal) no se pueden recuperar.
+#
+# Uso:
+#   python migrar_oid.py                       # simulación sobre PASARELA_DB
+#   python migrar_oid.py --aplicar
+#   python migrar_oid.py --db C:\Pasarela\services\pasarela.db --aplicar
+
+import os, sys, sqlite3, argparse
+
+# --- PATH robusto para imports locales ---
+PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # .../services/src
+if PARENT_DIR not in sys.path:
+    sys.path.insert(0, PARENT_DIR)
+
+from comun.oid import oid_desde_evento, es_legacy
+
+DB_PATH = os.getenv("PASARELA_DB", r"C:\Pasarela\services\pasarela.db")
+TABLE   = os.getenv("PASARELA_TABLE", "Trazas_Unica")
+
+
+def asegurar_esquema(con, tabla):
+    cols = [r[1] for r in con.execute(f"PRAGMA table_info('{tabla}')")]
+    if not cols:
+        raise SystemExit(f"[ERROR] La tabla {tabla} no existe.")
+    for col, tipo in (("revision", "INTEGER"), ("oid_legacy", "TEXT")):
+        if col not in cols:
+            con.execute(f"ALTER TABLE {tabla} ADD COLUMN {col} {tipo}")
+            print(f"[INFO] Añadida columna {col}")
+    con.execute(f"CREATE INDEX IF NOT EXISTS idx_{tabla}_ch_msg ON {tabla}(ch_id, msg_id)")
+
+
+def planificar(con, tabla):
+    """Devuelve (cambios [(oid_viejo, oid_nuevo)], omitidas [(oid, motivo)])."""
+    existentes = {r[0] for r in con.execute(f"SELECT oid FROM {tabla}")}
+    cambios, omitidas, nuevos = [], [], set()
+    filas = con.execute(
+        f"SELECT oid, ts_redis_ingest, ts_utc, ch_id, msg_id, revision FROM {tabla} ORDER BY rowid"
+    ).fetchall()
+    for oid, ts_ing, ts_utc, ch_id, msg_id, rev in filas:
+        if not es_legacy(oid):
+            continue
+        if not ch_id or not msg_id or not (ts_ing or ts_utc):
+            omitidas.append((oid, "sin ch_id/msg_id/fecha"))
+            continue
+        try:
+            nuevo = oid_desde_evento({"ts_redis_ingest": ts_ing, "ts_utc": ts_utc, "ch_id": ch_id,
+                                      "msg_id": msg_id, "revision": rev or 1})
+        except (TypeError, ValueError) as e:
+            omitidas.append((oid, f"datos no numéricos ({e})"))
+            continue
+        if nuevo in existentes or nuevo in nuevos:
+            omitidas.append((oid, f"colisión con {nuevo}"))
+            continue
+        nuevos.add(nuevo)
+        cambios.append((oid, nuevo))
+    return cambios, omitidas
+
+
+def copia_seguridad(db_path):
+    bak = db_path + ".bak"
+    src = sqlite3.connect(db_path)
+    dst = sqlite3.connect(bak)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+    return bak
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Migra oid antiguos de Trazas_Unica al formato ordenable por tiempo.")
+    ap.add_argument("--db", default=DB_PATH)
+    ap.add_argument("--tabla", default=TABLE)
+    ap.add_argument("--aplicar", action="store_true", help="Escribir cambios (por defecto solo simula).")
+    return ap.parse_args()
+
+
+def main():
+    args = parse_args()
+    if not os.path.exists(args.db):
+        raise SystemExit(f"[ERROR] No existe la BBDD: {args.db}")
+
+    if args.aplicar:
+        print(f"[INFO] Copia de seguridad → {copia_seguridad(args.db)}")
+
+    con = sqlite3.connect(args.db, timeout=10.0, isolation_level=None)
+    try:
+        con.execute("BEGIN IMMEDIATE")
+        asegurar_esquema(con, args.tabla)
+        cambios, omitidas = planificar(con, args.tabla)
+        for viejo, nuevo in cambios[:10]:
+            print(f"  {viejo} → {nuevo}")
+        if len(cambios) > 10:
+            print(f"  … {len(cambios) - 10} más")
+        for oid, motivo in omitidas:
+            print(f"[WARN] omitida {oid}: {motivo}")
+
+        if not args.aplicar:
+            con.execute("ROLLBACK")
+            print(f"[SIMULACIÓN] {len(cambios)} filas a migrar, {len(omitidas)} omitidas. Usa --aplicar para escribir.")
+            return
+
+        con.executemany(
+            f"UPDATE {args.tabla} SET oid = ?, oid_legacy = ?, revision = COALESCE(revision, 1) WHERE oid = ?",
+            [(nuevo, viejo, viejo) for viejo, nuevo in cambios],
+        )
+        con.execute("COMMIT")
+        print(f"[OK] {len(cambios)} filas migradas, {len(omitidas)} omitidas.")
+    except Exception:
+        if con.in_transaction:
+            con.execute("ROLLBACK")
+        raise
+    finally:
+        con.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,11 +3,19 @@
 # - Enlaces: /hoy, /ayer, /todo
 # - HOY/AYER filtran por ts_utc (UTC). TODO muestra todo.
 # - F5 recarga y vuelve a consultar.
+# - /latencias[/ayer|/todo]: p50/p95/p99 por etapa y por canal (columna spans).
 
-import os, sqlite3, html
+import os, sys, sqlite3, html
 from datetime import datetime, timedelta, timezone
 from http.server import HTTPServer, BaseHTTPRequestHandler
 
+# --- PATH robusto para imports locales ---
+PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # .../services/src
+if PARENT_DIR not in sys.path:
+    sys.path.insert(0, PARENT_DIR)
+
+from comun.trazado import ETAPAS, duraciones, percentiles
+
 DB_PATH = os.getenv("PASARELA_DB", r"C:\Pasarela\services\pasarela.db")
 TABLE   = os.getenv("PASARELA_TABLE", "Trazas_Unica")
 HOST, PORT = "127.0.0.1", 8080
@@ -108,6 +116,7 @@ def render_table(rows, range_key: str):
         cls = "active" if key == range_key else ""
         href = f"/{key}"
         html_parts.append(f"<a class='{cls}' href='{href}'>{label}</a>")
+    html_parts.append("<a href='/latencias'>LATENCIAS</a>")
     html_parts.append("</div>")
 
     # Tabla
@@ -131,9 +140,82 @@ def render_table(rows, range_key: str):
     html_parts.append(HTML_FOOT)
     return "".join(html_parts).encode("utf-8")
 
+def fetch_latencias(range_key: str):
+    """
+    Devuelve (n_filas, {etapa: [ms...]}, {canal: {etapa: [ms...]}}) a partir de la columna spans.
+    """
+    if not os.path.exists(DB_PATH):
+        raise FileNotFoundError(f"No existe la BBDD: {DB_PATH}")
+    con = sqlite3.connect(DB_PATH, timeout=5.0)
+    cur = con.cursor()
+    cols = {r[1] for r in cur.execute(f"PRAGMA table_info({TABLE})").fetchall()}
+    if "spans" not in cols:
+        con.close()
+        return 0, {}, {}
+    sql = f"SELECT COALESCE(channel_username, channel, ''), spans FROM {TABLE} WHERE spans IS NOT NULL"
+    params = ()
+    if range_key in ("hoy", "ayer"):
+        start_iso, end_iso = day_bounds_utc(range_key)
+        sql += " AND ts_utc >= ? AND ts_utc < ?"
+        params = (start_iso, end_iso)
+    rows = cur.execute(sql, params).fetchall()
+    con.close()
+
+    por_etapa, por_canal = {}, {}
+    for canal, spans in rows:
+        canal = canal or "(sin canal)"
+        for etapa, ms in duraciones(spans).items():
+            por_etapa.setdefault(etapa, []).append(ms)
+            por_canal.setdefault(canal, {}).setdefault(etapa, []).append(ms)
+    return len(rows), por_etapa, por_canal
+
+def _orden_etapas(etapas):
+    conocidas = [e for e in ETAPAS if e in etapas]
+    return conocidas + sorted(e for e in etapas if e not in ETAPAS)
+
+def _filas_percentiles(html_parts, etapas: dict):
+    for etapa in _orden_etapas(etapas):
+        vals = etapas[etapa]
+        pc = percentiles(vals)
+        html_parts.append(
+            f"<tr><td class='mono'>{html.escape(etapa)}</td><td>{len(vals)}</td>"
+            f"<td>{pc[50]:.1f}</td><td>{pc[95]:.1f}</td><td>{pc[99]:.1f}</td><td>{max(vals):.1f}</td></tr>"
+        )
+
+def render_latencias(range_key: str):
+    n, por_etapa, por_canal = fetch_latencias(range_key)
+    title_map = {"hoy": "HOY (UTC)", "ayer": "AYER (UTC)", "todo": "TODO"}
+    html_parts = [HTML_HEAD]
+    html_parts.append(f"<h1>Latencias por etapa — {title_map.get(range_key, 'HOY (UTC)')}</h1>")
+    html_parts.append(f"<p class='meta'>DB: <code>{html.escape(DB_PATH)}</code> — Tabla: <code>{html.escape(TABLE)}</code> — Filas con spans: {n} — valores en ms</p>")
+    html_parts.append("<div class='nav'>")
+    for key, label in (("hoy", "HOY"), ("ayer", "AYER"), ("todo", "TODO")):
+        cls = "active" if key == range_key else ""
+        html_parts.append(f"<a class='{cls}' href='/latencias/{key}'>{label}</a>")
+    html_parts.append("<a href='/hoy'>TRAZAS</a>")
+    html_parts.append("</div>")
+
+    cab = "<table><thead><tr><th>etapa</th><th>n</th><th>p50</th><th>p95</th><th>p99</th><th>max</th></tr></thead><tbody>"
+    html_parts.append("<h2>Global</h2>" + cab)
+    _filas_percentiles(html_parts, por_etapa)
+    html_parts.append("</tbody></table>")
+    for canal in sorted(por_canal):
+        html_parts.append(f"<h2>{html.escape(canal)}</h2>" + cab)
+        _filas_percentiles(html_parts, por_canal[canal])
+        html_parts.append("</tbody></table>")
+    html_parts.append(HTML_FOOT)
+    return "".join(html_parts).encode("utf-8")
+
 class Handler(BaseHTTPRequestHandler):
     def do_GET(self):
         # Rutas soportadas
+        if self.path.startswith("/latencias"):
+            sub = self.path[len("/latencias"):].strip("/") or "hoy"
+            try:
+                self._responder(200, render_latencias(sub if sub in ("hoy", "ayer", "todo") else "hoy"))
+            except Exception as e:
+                self._responder(500, f"<pre>{html.escape(repr(e))}</pre>".encode("utf-8"))
+            return
         if self.path in ("/", "/index.html", "/hoy"):
             key = "hoy"
         elif self.path.startswith("/ayer"):
@@ -163,8 +245,16 @@ class Handler(BaseHTTPRequestHandler):
             self.end_headers()
             self.wfile.write(msg)
 
+    def _responder(self, status: int, body: bytes):
+        self.send_response(status)
+        self.send_header("Content-Type","text/html; charset=utf-8")
+        self.send_header("Cache-Control","no-store")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
 def main():
-    print(f"DB: {DB_PATH} | Tabla: {TABLE} | http://{HOST}:{PORT}  (rutas: /hoy /ayer /todo /testing)")
+    print(f"DB: {DB_PATH} | Tabla: {TABLE} | http://{HOST}:{PORT}  (rutas: /hoy /ayer /todo /testing /latencias)")
     HTTPServer((HOST, PORT), Handler).serve_forever()
 
 if __name__ == "__main__":
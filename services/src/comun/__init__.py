@@ -0,0 +1 @@
+# Utilidades compartidas por listener, parseador y herramientas
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+# entidades.py — caché en disco de entidades de Telegram compartida por listener, list_channels,
+# publicador y parseador (envío a Telegram)
+# - Antes cada herramienta recorría iter_dialogs() o llamaba a get_entity al arrancar. Ahora:
+#     id, access_hash, tipo, title, username, linked_chat_id, flags y marcas de tiempo en SQLite (WAL),
+#     más alias (destino tal como se escribe en TELEGRAM_TARGETS -> id).
+# - Con access_hash no hace falta la sesión de Telethon: InputPeerChannel/User se construye desde la caché.
+# - TTL (ENTIDADES_TTL_SEC): una fila fresca no se consulta; una caducada se refresca con UNA llamada
+#   GetChannels por lote (ids + access_hash). Solo lo que no está en la caché ni en la sesión obliga a un
+#   recorrido de diálogos, que guarda todos los canales vistos y no se repite dentro del TTL.
+# - Si Telegram no responde al refrescar, se usan las filas caducadas (mejor que no arrancar).
+# - Varios procesos a la vez: WAL + busy_timeout; cada herramienta abre su propia conexión.
+# - Telethon se importa solo en las funciones async (el módulo se puede usar sin él).
+
+import os
+import sqlite3
+import time
+
+ENTIDADES_DB      = os.getenv("ENTIDADES_DB", r"C:\Pasarela\data\entidades.db")
+ENTIDADES_TTL_SEC = float(os.getenv("ENTIDADES_TTL_SEC", str(24 * 3600)))
+LOTE_CANALES      = 100   # ids por GetChannelsRequest
+
+CANAL, GRUPO, USUARIO = "channel", "chat", "user"
+_COLUMNAS = ("id", "tipo", "access_hash", "title", "username", "linked_chat_id", "broadcast", "megagroup",
+             "left", "ts_visto", "ts_actualizado", "ts_linked")
+
+
+def _ahora_ms() -> int:
+    return int(time.time() * 1000)
+
+
+class Entidad:
+    """Fila de la caché. Mismos nombres de atributo que las entidades de Telethon (title, username, left…)."""
+    __slots__ = _COLUMNAS
+
+    def __init__(self, *valores):
+        for k, v in zip(_COLUMNAS, valores):
+            setattr(self, k, v)
+
+    def fresca(self, ttl_sec: float = None) -> bool:
+        ttl = ENTIDADES_TTL_SEC if ttl_sec is None else ttl_sec
+        return _ahora_ms() - (self.ts_actualizado or 0) < ttl * 1000
+
+    def input_peer(self):
+        """InputPeer para send_message / get_entity sin pasar por la sesión (requiere access_hash)."""
+        from telethon.tl import types
+        if self.tipo == CANAL:
+            return types.InputPeerChannel(self.id, self.access_hash)
+        if self.tipo == USUARIO:
+            return types.InputPeerUser(self.id, self.access_hash)
+        return types.InputPeerChat(self.id)
+
+    def __repr__(self):
+        return f"Entidad({self.tipo} {self.id} {self.title or self.username!r})"
+
+
+def _campos(ent) -> dict:
+    """Columnas a partir de una entidad de Telethon (Channel, ChannelForbidden, Chat, User)."""
+    nombre = type(ent).__name__
+    if nombre.startswith("Channel"):
+        tipo = CANAL
+    elif nombre.startswith("Chat"):
+        tipo = GRUPO
+    else:
+        tipo = USUARIO
+    title = getattr(ent, "title", None)
+    if title is None:   # usuario
+        title = " ".join(x for x in (getattr(ent, "first_name", ""), getattr(ent, "last_name", "")) if x)
+    return {
+        "id": int(ent.id),
+        "tipo": tipo,
+        "access_hash": getattr(ent, "access_hash", None),
+        "title": title or "",
+        "username": getattr(ent, "username", None) or "",
+        "broadcast": int(bool(getattr(ent, "broadcast", False))),
+        "megagroup": int(bool(getattr(ent, "megagroup", False))),
+        # ChannelForbidden / ChatForbidden: sin acceso, como si se hubiera salido
+        "left": int(bool(getattr(ent, "left", False)) or nombre.endswith("Forbidden")),
+    }
+
+
+class CacheEntidades:
+    def __init__(self, ruta: str = None, ttl_sec: float = None):
+        self.ruta = ruta or ENTIDADES_DB
+        self.ttl_sec = ENTIDADES_TTL_SEC if ttl_sec is None else ttl_sec
+        os.makedirs(os.path.dirname(os.path.abspath(self.ruta)), exist_ok=True)
+        self._con = sqlite3.connect(self.ruta, isolation_level=None, timeout=5)
+        self._con.execute("PRAGMA journal_mode=WAL;")
+        self._con.execute("PRAGMA synchronous=NORMAL;")
+        self._con.execute("""
+        CREATE TABLE IF NOT EXISTS Entidades(
+            id INTEGER PRIMARY KEY,
+            tipo TEXT NOT NULL,
+            access_hash INTEGER,
+            title TEXT NOT NULL DEFAULT '',
+            username TEXT NOT NULL DEFAULT '',
+            linked_chat_id INTEGER,            -- NULL: desconocido; 0: sin chat enlazado
+            broadcast INTEGER NOT NULL DEFAULT 0,
+            megagroup INTEGER NOT NULL DEFAULT 0,
+            left INTEGER NOT NULL DEFAULT 0,
+            ts_visto INTEGER NOT NULL,         -- ms: primera vez que se guardó
+            ts_actualizado INTEGER NOT NULL,   -- ms: último dato leído de Telegram
+            ts_linked INTEGER
+        )
+        """)
+        self._con.execute("CREATE TABLE IF NOT EXISTS Alias(alias TEXT PRIMARY KEY, id INTEGER NOT NULL, ts INTEGER NOT NULL)")
+        self._con.execute("CREATE TABLE IF NOT EXISTS Meta(clave TEXT PRIMARY KEY, valor INTEGER NOT NULL)")
+
+    def cerrar(self):
+        self._con.close()
+
+    # ---- lectura ----
+    def _filas(self, where: str = "", args=()) -> list:
+        sql = f"SELECT {', '.join(_COLUMNAS)} FROM Entidades {where}"
+        return [Entidad(*f) for f in self._con.execute(sql, args).fetchall()]
+
+    def obtener(self, id_: int):
+        filas = self._filas("WHERE id = ?", (int(id_),))
+        return filas[0] if filas else None
+
+    def varias(self, ids) -> dict:
+        ids = [int(i) for i in ids]
+        res = {}
+        for i in range(0, len(ids), 500):
+            lote = ids[i:i + 500]
+            for e in self._filas(f"WHERE id IN ({','.join('?' * len(lote))})", lote):
+                res[e.id] = e
+        return res
+
+    def canales(self) -> list:
+        """Canales y megagrupos accesibles, por título."""
+        return self._filas("WHERE tipo = ? AND left = 0 AND (broadcast = 1 OR megagroup = 1) "
+                           "ORDER BY title COLLATE NOCASE", (CANAL,))
+
+    def por_alias(self, alias: str):
+        f = self._con.execute("SELECT id FROM Alias WHERE alias = ?", (alias,)).fetchone()
+        return self.obtener(f[0]) if f else None
+
+    def titulos(self) -> list:
+        """Títulos conocidos (para el mensaje de error de un destino sin resolver)."""
+        return [f[0] for f in self._con.execute("SELECT title FROM Entidades WHERE title != '' ORDER BY title")]
+
+    def fresca(self, e) -> bool:
+        return e is not None and e.fresca(self.ttl_sec)
+
+    # ---- escritura ----
+    def guardar(self, ent, ahora_ms: int = None) -> Entidad:
+        """Upsert desde una entidad de Telethon. Conserva ts_visto y el linked_chat_id ya conocido."""
+        c = _campos(ent)
+        ahora = ahora_ms or _ahora_ms()
+        self._con.execute("""
+        INSERT INTO Entidades(id, tipo, access_hash, title, username, broadcast, megagroup, left, ts_visto, ts_actualizado)
+        VALUES (:id, :tipo, :access_hash, :title, :username, :broadcast, :megagroup, :left, :ahora, :ahora)
+        ON CONFLICT(id) DO UPDATE SET
+            tipo = excluded.tipo,
+            access_hash = COALESCE(excluded.access_hash, Entidades.access_hash),
+            title = excluded.title, username = excluded.username,
+            broadcast = excluded.broadcast, megagroup = excluded.megagroup, left = excluded.left,
+            ts_actualizado = excluded.ts_actualizado
+        """, {**c, "ahora": ahora})
+        return self.obtener(c["id"])
+
+    def guardar_varias(self, ents) -> int:
+        ahora, n = _ahora_ms(), 0
+        self._con.execute("BEGIN")
+        try:
+            for ent in ents:
+                self.guardar(ent, ahora)
+                n += 1
+            self._con.execute("COMMIT")
+        except BaseException:
+            self._con.execute("ROLLBACK")
+            raise
+        return n
+
+    def guardar_linked(self, id_: int, linked_id):
+        self._con.execute("UPDATE Entidades SET linked_chat_id = ?, ts_linked = ? WHERE id = ?",
+                          (int(linked_id or 0), _ahora_ms(), int(id_)))
+
+    def guardar_alias(self, alias: str, id_: int):
+        self._con.execute("INSERT OR REPLACE INTO Alias(alias, id, ts) VALUES (?,?,?)", (alias, int(id_), _ahora_ms()))
+
+    # ---- recorrido de diálogos ----
+    def barrido_reciente(self) -> bool:
+        f = self._con.execute("SELECT valor FROM Meta WHERE clave = 'barrido_dialogos'").fetchone()
+        return bool(f) and _ahora_ms() - f[0] < self.ttl_sec * 1000
+
+    def marcar_barrido(self):
+        self._con.execute("INSERT OR REPLACE INTO Meta(clave, valor) VALUES ('barrido_dialogos', ?)", (_ahora_ms(),))
+
+
+# =================== con un cliente de Telethon ===================
+async def barrer_dialogos(client, cache: CacheEntidades) -> int:
+    """Recorre todos los diálogos y guarda sus entidades. Devuelve cuántas."""
+    ents = [d.entity async for d in client.iter_dialogs()]
+    n = cache.guardar_varias(ents)
+    cache.marcar_barrido()
+    return n
+
+
+async def _refrescar_canales(client, cache: CacheEntidades, filas: list):
+    """Relee de Telegram canales con access_hash (GetChannels por lotes) y actualiza la caché."""
+    from telethon.tl import types
+    from telethon.tl.functions.channels import GetChannelsRequest
+    for i in range(0, len(filas), LOTE_CANALES):
+        lote = filas[i:i + LOTE_CANALES]
+        res = await client(GetChannelsRequest([types.InputChannel(e.id, e.access_hash) for e in lote]))
+        cache.guardar_varias(res.chats)
+
+
+async def resolver_canales(client, cache: CacheEntidades, ids) -> dict:
+    """
+    id -> Entidad para los canales pedidos, con las mínimas llamadas a Telegram:
+      frescos en caché -> ninguna; caducados con access_hash -> GetChannels por lotes;
+      desconocidos -> get_entity por lotes (sesión de Telethon; uno a uno si el lote falla); aún sin resolver -> un recorrido de diálogos
+      (salvo que ya se hiciera dentro del TTL). Los que no aparezcan no están en el resultado.
+    """
+    ids = [int(i) for i in ids]
+    filas = cache.varias(ids)
+    caducados = [e for e in filas.values() if not cache.fresca(e) and e.access_hash is not None]
+    if caducados:
+        try:
+            await _refrescar_canales(client, cache, caducados)
+        except Exception:
+            pass   # Telegram no responde: se sigue con las filas caducadas
+    from telethon.tl import types
+    desconocidos = [i for i in ids if i not in filas or filas[i].access_hash is None]
+    for i in range(0, len(desconocidos), LOTE_CANALES):
+        lote = desconocidos[i:i + LOTE_CANALES]
+        try:
+            cache.guardar_varias(await client.get_entity([types.PeerChannel(c) for c in lote]))
+            continue
+        except Exception:
+            pass
+        for cid in lote:
+            try:
+                cache.guardar(await client.get_entity(types.PeerChannel(cid)))
+            except Exception:
+                pass
+    faltan = [i for i in ids if cache.obtener(i) is None]
+    if faltan and not cache.barrido_reciente():
+        await barrer_dialogos(client, cache)
+    return cache.varias(ids)
+
+
+async def enlazado(client, cache: CacheEntidades, e: Entidad):
+    """linked_chat_id de un canal (GetFullChannel si no se conoce o caducó); None si no tiene."""
+    if e.linked_chat_id is not None and _ahora_ms() - (e.ts_linked or 0) < cache.ttl_sec * 1000:
+        return e.linked_chat_id or None
+    from telethon.tl import types
+    from telethon.tl.functions.channels import GetFullChannelRequest
+    try:
+        full = await client(GetFullChannelRequest(types.InputChannel(e.id, e.access_hash)))
+    except Exception:
+        return e.linked_chat_id or None
+    linked = getattr(full.full_chat, "linked_chat_id", None)
+    cache.guardar_linked(e.id, linked)
+    return linked or None
+
+
+async def resolver_destino(client, cache: CacheEntidades, candidatos: list):
+    """
+    Destino de envío: alias fresco en caché -> InputPeer sin llamadas; si no, como antes:
+    1) link t.me  2) @username  3) título EXACTO de un diálogo (recorrido que además llena la caché).
+    El candidato que resuelve se guarda como alias. None si ninguno.
+    """
+    for c in candidatos:
+        e = cache.por_alias(c)
+        if cache.fresca(e) and (e.access_hash is not None or e.tipo == GRUPO):
+            return e.input_peer()
+
+    def _guardar(c, ent):
+        e = cache.guardar(ent)
+        cache.guardar_alias(c, e.id)
+        return ent
+
+    # 1) Links t.me
+    for c in candidatos:
+        if c.startswith(("http://", "https://")) or "t.me/" in c:
+            try:
+                return _guardar(c, await client.get_entity(c))
+            except Exception:
+                pass
+    # 2) @username
+    for c in candidatos:
+        u = c.lstrip("@")
+        if not u or any(ch.isspace() for ch in u):
+            continue
+        try:
+            return _guardar(c, await client.get_entity(u))
+        except Exception:
+            pass
+    # 3) Título exacto
+    encontrado, ents = None, []
+    async for d in client.iter_dialogs():
+        ents.append(d.entity)
+        if encontrado is None and d.name in candidatos:
+            encontrado = (d.name, d.entity)
+    cache.guardar_varias(ents)
+    cache.marcar_barrido()
+    if encontrado:
+        return _guardar(*encontrado)
+    return None
+
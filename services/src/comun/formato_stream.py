@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+# formato_stream.py — formato de las entradas de pasarela:parse(:prio): v1 (legible) y v2 (compacto)
+#
+# v1 (hasta ahora): type, channel_id, channel_username, channel_title, msg_id, ts_utc (ISO), sender_id,
+#     text/raw, estado_operacion, reply_to, t_cap, d_lst, [dep_id], [recuperado] + revision, ts_redis_ingest (ISO)
+# v2: solo lo que cambia por mensaje, nombres cortos y tiempos en epoch ms:
+#     v=2  c=channel_id  m=msg_id  r=revision  [e=1 si edición]  ts=ts_utc ms  x=texto  [s=sender_id]
+#     [rt=reply_to]  tc=t_cap  [dl=d_lst]  [rc=1 si recuperado]  [dep_id]
+#   - username/título del canal: diccionario hash REDIS_CANALES (channel_id -> JSON {"u","t"}), que el script
+#     de publicación mantiene (HSET solo si cambia) antes del XADD.
+#   - estado_operacion siempre era "0": no viaja. ts_redis_ingest = ms del ID de la entrada (XADD con '*'
+#     usa la hora del servidor, la misma que daba TIME).
+#   - STREAM_MSGPACK=1 (y msgpack instalado): todo salvo r y dep_id en un único campo binario b (msgpack).
+#     Solo para lectores sin decode_responses (parseador, replay, lag_monitor).
+# - decodificar() devuelve siempre el dict v1 (str -> str): el resto del parseador no cambia y durante la
+#   migración conviven entradas de los dos formatos en el mismo stream.
+# - Migración: STREAM_FORMATO=1 por defecto. Primero se actualizan los lectores (parseador, replay,
+#   lag_monitor); después STREAM_FORMATO=2 en el listener. Un parseador anterior leería una entrada v2
+#   como texto vacío ("sin resultados", ACK) y la señal se perdería sin error.
+# - python comun/formato_stream.py --medir [--n 2000]: memoria por entrada (MEMORY USAGE) y tiempo de
+#   decodificación de cada formato contra REDIS_URL (streams temporales pasarela:medir:*).
+
+import os
+import sys
+import json
+import time
+from datetime import datetime
+from functools import lru_cache
+
+FORMATO_STREAM = os.getenv("STREAM_FORMATO", "1").strip()   # 2 solo cuando todos los lectores decodifican v2
+CANALES_KEY    = os.getenv("REDIS_CANALES", "pasarela:canales")
+CANALES_TTL_SEC = 60   # el lector relee el diccionario de un canal como mucho una vez por minuto
+
+try:
+    import msgpack
+except ImportError:   # opcional: sin msgpack, v2 en campos planos
+    msgpack = None
+MSGPACK = os.getenv("STREAM_MSGPACK", "0").strip().lower() in ("1", "true", "yes", "on") and msgpack is not None
+
+# v2 <-> v1 (campos que viajan tal cual salvo el nombre)
+_CORTOS = {"channel_id": "c", "msg_id": "m", "text/raw": "x", "sender_id": "s", "reply_to": "rt",
+           "t_cap": "tc", "d_lst": "dl"}
+_LARGOS = {v: k for k, v in _CORTOS.items()}
+_CONTROL = frozenset(("v", "e", "ts", "rc", "r"))
+_OMITIR = ("type", "channel_username", "channel_title", "ts_utc", "estado_operacion", "recuperado", "dep_id")
+
+
+def _txt(v) -> str:
+    return v.decode() if isinstance(v, bytes) else str(v)
+
+
+@lru_cache(maxsize=4096)
+def _segundo_iso(s: int) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(s))
+
+
+def _iso(ms: int) -> str:
+    """epoch ms -> 'YYYY-MM-DDTHH:MM:SS.mmmZ' (como utc_iso del listener y el TIME del script v1)."""
+    s, m = divmod(ms, 1000)
+    return f"{_segundo_iso(s)}.{m:03d}Z"
+
+
+def _ms(iso: str):
+    try:
+        return int(datetime.fromisoformat(iso.replace("Z", "+00:00")).timestamp() * 1000)
+    except (AttributeError, ValueError):
+        return None
+
+
+def meta_canal(fields: dict) -> str:
+    """Valor del diccionario de canales para estos campos (JSON compacto)."""
+    return json.dumps({"u": fields.get("channel_username", ""), "t": fields.get("channel_title", "")},
+                      ensure_ascii=False, separators=(",", ":"))
+
+
+def codificar(fields: dict, msgpack_: bool = None) -> dict:
+    """Campos v1 (los que arma el listener) -> campos v2 para el XADD (sin r: la revisión la pone el script)."""
+    out = {"v": "2"}
+    for k, v in fields.items():
+        if k in _OMITIR or v in ("", None):
+            continue
+        out[_CORTOS.get(k, k)] = v
+    if fields.get("type") == "edit":
+        out["e"] = 1
+    ts = _ms(fields.get("ts_utc") or "")
+    if ts is not None:
+        out["ts"] = ts
+    elif fields.get("ts_utc"):
+        out["ts_utc"] = fields["ts_utc"]       # no parseable: se conserva tal cual
+    if fields.get("recuperado") == "1":
+        out["rc"] = 1
+    dep = fields.get("dep_id")
+    if msgpack_ if msgpack_ is not None else MSGPACK:
+        cuerpo = {k: v for k, v in out.items() if k != "v"}
+        out = {"v": "2", "b": msgpack.packb(cuerpo, use_bin_type=True)}
+    if dep is not None:
+        out["dep_id"] = dep                    # en claro: el parseador lo mira antes de decodificar
+    return out
+
+
+class DiccionarioCanales:
+    """Lector del diccionario de canales con caché en memoria (cliente Redis síncrono)."""
+
+    def __init__(self, r, clave: str = None):
+        self.r = r
+        self.clave = clave or CANALES_KEY
+        self._cache = {}   # ch_id (str) -> (username, title, t_leido)
+
+    def get(self, ch_id: str, defecto=("", "")) -> tuple:
+        e = self._cache.get(ch_id)
+        if e is not None and time.monotonic() - e[2] < CANALES_TTL_SEC:
+            return e[0], e[1]
+        try:
+            v = self.r.hget(self.clave, ch_id)
+            d = json.loads(_txt(v)) if v else {}
+        except Exception:
+            d = {}
+        if not d and e is not None:
+            return e[0], e[1]
+        self._cache[ch_id] = (d.get("u", ""), d.get("t", ""), time.monotonic())
+        return d.get("u", ""), d.get("t", "")
+
+
+def decodificar(entry_id, fields: dict, canales=None) -> dict:
+    """
+    Entrada del stream (claves/valores bytes o str, v1 o v2) -> dict v1 de str.
+    canales: DiccionarioCanales (o dict ch_id -> (username, title)) para username/título en v2.
+    """
+    version = fields.get(b"v", fields.get("v"))
+    if version is None:
+        return {_txt(k): _txt(v) for k, v in fields.items()}
+
+    d = {}
+    for k, v in fields.items():
+        k = k.decode() if isinstance(k, bytes) else k
+        if k == "b":
+            if msgpack is None:
+                raise ValueError("entrada v2 con cuerpo msgpack y msgpack no instalado")
+            d.update(msgpack.unpackb(v, raw=False))
+        else:
+            d[k] = v
+    data = {_LARGOS.get(k, k): _txt(v) for k, v in d.items() if k not in _CONTROL}
+    data["type"] = "edit" if d.get("e") else "new"
+    data["revision"] = _txt(d.get("r", ""))
+    data["estado_operacion"] = "0"
+    if "ts" in d:
+        data["ts_utc"] = _iso(int(d["ts"]))
+    data["ts_redis_ingest"] = _iso(int(_txt(entry_id).partition("-")[0]))
+    data.setdefault("sender_id", "")
+    data.setdefault("reply_to", "")
+    if d.get("rc"):
+        data["recuperado"] = "1"
+    ch = data.get("channel_id", "")
+    if canales is not None:
+        data["channel_username"], data["channel_title"] = canales.get(ch, ("", ""))
+    return data
+
+
+# =================== MEDIDA ===================
+def _ejemplo(i: int) -> dict:
+    return {
+        "type": "new", "channel_id": 1234567890 + i % 20, "channel_username": f"canal_senales_{i % 20}",
+        "channel_title": f"Canal de Señales Premium {i % 20} | Forex & Gold", "msg_id": 100000 + i,
+        "ts_utc": "2026-03-01T10:00:00.000Z", "sender_id": "", "text/raw": "BUY XAUUSD 2000 SL 1990 TP 2010 TP 2020",
+        "estado_operacion": "0", "reply_to": "", "t_cap": 1772359200123 + i, "d_lst": "0.412",
+    }
+
+
+def medir(r, n: int = 2000) -> dict:
+    """Escribe n entradas por formato en streams temporales; memoria por entrada y µs por decodificación."""
+    formatos = {"v1": None, "v2": False}
+    if msgpack is not None:
+        formatos["v2+msgpack"] = True
+    canales = {str(1234567890 + i): (f"canal_senales_{i}", f"Canal de Señales Premium {i} | Forex & Gold")
+               for i in range(20)}
+    res = {}
+    for nombre, mp in formatos.items():
+        clave = f"pasarela:medir:{nombre}"
+        r.delete(clave)
+        t_iso = "2026-03-01T10:00:00.123Z"
+        for i in range(n):
+            f = _ejemplo(i)
+            campos = ({**f, "revision": 1, "ts_redis_ingest": t_iso} if mp is None
+                      else {**codificar(f, msgpack_=mp), "r": 1})
+            r.xadd(clave, campos)
+        try:
+            memoria = r.memory_usage(clave, samples=0) / n
+        except Exception:
+            memoria = None
+        entradas = r.xrange(clave)
+        payload = sum(len(_txt(k).encode()) + len(v if isinstance(v, bytes) else str(v).encode())
+                      for _, c in entradas for k, v in c.items()) / n
+        t0 = time.perf_counter()
+        for entry_id, c in entradas:
+            decodificar(entry_id, c, canales)
+        us = (time.perf_counter() - t0) / n * 1e6
+        r.delete(clave)
+        res[nombre] = {"memoria_bytes": round(memoria, 1) if memoria else None,
+                       "payload_bytes": round(payload, 1), "decodificar_us": round(us, 2)}
+    return res
+
+
+def main(argv=None):
+    import argparse
+    ap = argparse.ArgumentParser(prog="formato_stream.py", description="Memoria y decodificación por formato de stream.")
+    ap.add_argument("--medir", action="store_true")
+    ap.add_argument("--n", type=int, default=2000)
+    ap.add_argument("--redis", default=os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+    args = ap.parse_args(argv)
+    if not args.medir:
+        ap.print_help()
+        return 2
+    import redis
+    for nombre, m in medir(redis.Redis.from_url(args.redis), args.n).items():
+        mem = f"{m['memoria_bytes']:.0f} B/entrada" if m["memoria_bytes"] else "MEMORY USAGE no disponible"
+        print(f"[formato] {nombre:11s} {mem}  payload {m['payload_bytes']:.0f} B  decodificar {m['decodificar_us']:.1f} µs")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+# logs.py — logging estructurado y no bloqueante para listener/parser
+# - El hilo que loguea solo encola el registro (put_nowait); formateo, consola y disco van en un hilo aparte.
+# - Fichero JSON lines con rotación por tamaño (LOG_DIR/<componente>.jsonl) + consola legible.
+# - Muestreo por componente para los registros < WARNING (p.ej. detalle por mensaje en ráfagas).
+# - Si la cola se llena el registro se descarta (y se cuenta); nunca se bloquea el hot path.
+#
+# .env (todas opcionales):
+#   LOG_LEVEL=INFO              LOG_CONSOLE=1          LOG_CONSOLE_LEVEL=INFO
+#   LOG_DIR=...\services\logs   LOG_FILE_MAX_MB=10     LOG_FILE_BACKUPS=5     (LOG_DIR vacío = sin fichero)
+#   LOG_SAMPLE=parseador.mensaje=0.2,listener.evento=0.1
+#   LOG_QUEUE_MAX=10000
+#
+# Uso:
+#   from comun import logs
+#   log = logs.configurar("parseador")              # una vez por proceso
+#   log_msg = logs.obtener("parseador.mensaje")     # sub-componente (muestreable)
+#   log_msg.info(f"análisis→ msg_id={mid}", extra={"oid": oid})
+
+import os, json, time, queue, atexit, logging, threading
+from pathlib import Path
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from datetime import datetime, timezone
+
+from comun import metricas
+
+RAIZ = "pasarela"
+_DEFAULT_LOG_DIR = str(Path(__file__).resolve().parents[2] / "logs")   # .../services/logs
+
+LOGS_DESCARTADOS = metricas.contador("pasarela_log_descartados_total", "Registros de log descartados", ("motivo",))
+
+# Atributos estándar de LogRecord: el resto (extra=...) va como campos del JSON
+_ATRIBUTOS_BASE = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+def _componente(nombre: str) -> str:
+    return nombre[len(RAIZ) + 1:] if nombre.startswith(RAIZ + ".") else nombre
+
+
+class FormatoJSON(logging.Formatter):
+    """Una línea JSON por registro: ts, nivel, comp, msg, campos extra y exc (si hay)."""
+
+    def format(self, record):
+        d = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z"),
+            "nivel": record.levelname,
+            "comp": _componente(record.name),
+            "msg": record.getMessage(),
+        }
+        for k, v in record.__dict__.items():
+            if k not in _ATRIBUTOS_BASE and not k.startswith("_"):
+                d[k] = v
+        if record.exc_info:
+            d["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            d["exc"] = record.exc_text
+        return json.dumps(d, ensure_ascii=False, default=str)
+
+
+class FormatoConsola(logging.Formatter):
+    """'HH:MM:SS.mmm [comp] msg' (con el nivel delante del mensaje si no es INFO)."""
+
+    def format(self, record):
+        hora = time.strftime("%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}"
+        nivel = "" if record.levelno == logging.INFO else f"{record.levelname} "
+        linea = f"{hora} [{_componente(record.name)}] {nivel}{record.getMessage()}"
+        if record.exc_info:
+            linea += "\n" + self.formatException(record.exc_info)
+        return linea
+
+
+class Muestreo(logging.Filter):
+    """
+    Deja pasar 1 de cada N registros < WARNING por componente (regla de prefijo más largo).
+    reglas: {"parseador.mensaje": 0.2} -> 1 de cada 5. WARNING+ pasa siempre.
+    """
+
+    def __init__(self, reglas: dict):
+        super().__init__()
+        self.reglas = {k: float(v) for k, v in reglas.items()}
+        self._paso = {}        # nombre logger -> N (1 = todo)
+        self._cuenta = {}
+
+    def _n(self, nombre: str) -> int:
+        n = self._paso.get(nombre)
+        if n is None:
+            comp, tasa = _componente(nombre), 1.0
+            mejor = -1
+            for pref, t in self.reglas.items():
+                if (comp == pref or comp.startswith(pref + ".")) and len(pref) > mejor:
+                    mejor, tasa = len(pref), t
+            n = self._paso[nombre] = 0 if tasa <= 0 else max(1, round(1 / min(tasa, 1.0)))
+        return n
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        n = self._n(record.name)
+        if n == 1:
+            return True
+        c = self._cuenta.get(record.name, 0)
+        self._cuenta[record.name] = c + 1
+        if n and c % n == 0:
+            return True
+        LOGS_DESCARTADOS.inc("muestreo")
+        return False
+
+
+class ColaNoBloqueante(QueueHandler):
+    """QueueHandler que descarta (y cuenta) si la cola está llena y difiere el formateo al hilo del listener."""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOGS_DESCARTADOS.inc("cola_llena")
+
+    def prepare(self, record):
+        # Solo fusionar msg % args; el traceback se formatea en el hilo de escritura
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def _reglas_muestreo(txt: str) -> dict:
+    reglas = {}
+    for parte in (txt or "").split(","):
+        comp, sep, tasa = parte.partition("=")
+        if sep and comp.strip():
+            try:
+                reglas[comp.strip()] = float(tasa)
+            except ValueError:
+                pass
+    return reglas
+
+
+_LISTENER = None
+_LOCK = threading.Lock()
+
+
+def obtener(nombre: str) -> logging.Logger:
+    return logging.getLogger(f"{RAIZ}.{nombre}")
+
+
+def configurar(componente: str, nivel: str = None, log_dir: str = None, consola: bool = None,
+               muestreo: dict = None) -> logging.Logger:
+    """Prepara la cola + hilo de escritura (idempotente) y devuelve el logger del componente."""
+    global _LISTENER
+    with _LOCK:
+        if _LISTENER is not None:
+            return obtener(componente)
+
+        nivel = (nivel or os.getenv("LOG_LEVEL", "INFO")).upper()
+        log_dir = os.getenv("LOG_DIR", _DEFAULT_LOG_DIR) if log_dir is None else log_dir
+        if consola is None:
+            consola = os.getenv("LOG_CONSOLE", "1").strip().lower() in ("1", "true", "yes", "on")
+        if muestreo is None:
+            muestreo = _reglas_muestreo(os.getenv("LOG_SAMPLE", ""))
+
+        destinos = []
+        if log_dir:
+            os.makedirs(log_dir, exist_ok=True)
+            fh = RotatingFileHandler(os.path.join(log_dir, f"{componente.split('.')[0]}.jsonl"),
+                                     maxBytes=int(float(os.getenv("LOG_FILE_MAX_MB", "10")) * 1024 * 1024),
+                                     backupCount=int(os.getenv("LOG_FILE_BACKUPS", "5")),
+                                     encoding="utf-8")
+            fh.setFormatter(FormatoJSON())
+            destinos.append(fh)
+        if consola:
+            ch = logging.StreamHandler()
+            ch.setLevel(os.getenv("LOG_CONSOLE_LEVEL", "INFO").upper())
+            ch.setFormatter(FormatoConsola())
+            destinos.append(ch)
+
+        cola = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_MAX", "10000")))
+        qh = ColaNoBloqueante(cola)
+        if muestreo:
+            qh.addFilter(Muestreo(muestreo))
+
+        raiz = logging.getLogger(RAIZ)
+        raiz.setLevel(nivel)
+        raiz.handlers[:] = [qh]
+        raiz.propagate = False
+
+        _LISTENER = QueueListener(cola, *destinos, respect_handler_level=True)
+        _LISTENER.start()
+        atexit.register(detener)
+        return obtener(componente)
+
+
+def detener():
+    """Vacía la cola y para el hilo de escritura (se llama solo al salir)."""
+    global _LISTENER
+    with _LOCK:
+        if _LISTENER is not None:
+            _LISTENER.stop()
+            _LISTENER = None
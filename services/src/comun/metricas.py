@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+# metricas.py — métricas en memoria + endpoint HTTP en formato texto de Prometheus
+# - Contador, Gauge e Histograma con etiquetas posicionales (sin dependencias externas).
+# - Registrar cuesta un dict lookup + suma bajo un lock sin contención: apto para el hot path.
+# - Gauges "calculados": una función que se evalúa solo al hacer scrape (p.ej. clientes socket).
+#
+# Uso:
+#   from comun import metricas
+#   MSG = metricas.contador("pasarela_parser_mensajes_total", "Mensajes leídos", ("channel",))
+#   MSG.inc("JBUNITED")
+#   metricas.servir(9102)      # GET http://127.0.0.1:9102/metrics
+
+import logging
+import threading
+from bisect import bisect_left
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+log = logging.getLogger("pasarela.metricas")   # = logs.obtener("metricas"); logs importa este módulo
+
+# Buckets por defecto para latencias (segundos): 0.5 ms .. 30 s
+BUCKETS_LATENCIA = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _esc(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _etiquetas(nombres, valores, extra: str = "") -> str:
+    partes = [f'{n}="{_esc(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+def _num(v) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return repr(v) if isinstance(v, float) else str(v)
+
+
+class _Metrica:
+    tipo = ""
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._lock = threading.Lock()
+        self._valores = {}
+
+    def _cabecera(self):
+        return [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+
+    def exponer(self) -> list:
+        with self._lock:
+            items = list(self._valores.items())
+        lineas = self._cabecera()
+        for clave, v in sorted(items, key=lambda kv: kv[0]):
+            lineas.append(f"{self.nombre}{_etiquetas(self.etiquetas, clave)} {_num(v)}")
+        return lineas
+
+
+class Contador(_Metrica):
+    tipo = "counter"
+
+    def inc(self, *valores, n: float = 1):
+        with self._lock:
+            self._valores[valores] = self._valores.get(valores, 0) + n
+
+
+class Gauge(_Metrica):
+    tipo = "gauge"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas=(), funcion=None):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.funcion = funcion   # () -> valor | {tupla_etiquetas: valor}; se evalúa en el scrape
+
+    def set(self, *valores, v: float = 0):
+        with self._lock:
+            self._valores[valores] = v
+
+    def inc(self, *valores, n: float = 1):
+        with self._lock:
+            self._valores[valores] = self._valores.get(valores, 0) + n
+
+    def dec(self, *valores, n: float = 1):
+        self.inc(*valores, n=-n)
+
+    def exponer(self) -> list:
+        if self.funcion is None:
+            return super().exponer()
+        try:
+            res = self.funcion()
+        except Exception:
+            res = None
+        lineas = self._cabecera()
+        if isinstance(res, dict):
+            for clave, v in sorted(res.items(), key=lambda kv: kv[0]):
+                clave = clave if isinstance(clave, tuple) else (clave,)
+                lineas.append(f"{self.nombre}{_etiquetas(self.etiquetas, clave)} {_num(v)}")
+        elif res is not None:
+            lineas.append(f"{self.nombre} {_num(res)}")
+        return lineas
+
+
+class Histograma(_Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas=(), buckets=BUCKETS_LATENCIA):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, valor: float, *valores):
+        i = bisect_left(self.buckets, valor)
+        with self._lock:
+            st = self._valores.get(valores)
+            if st is None:
+                st = self._valores[valores] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            st[0][i] += 1
+            st[1] += valor
+            st[2] += 1
+
+    def resumen(self, *valores) -> tuple:
+        """(observaciones, suma) de una serie."""
+        with self._lock:
+            st = self._valores.get(valores)
+            return (st[2], st[1]) if st else (0, 0.0)
+
+    def exponer(self) -> list:
+        with self._lock:
+            items = [(k, (list(v[0]), v[1], v[2])) for k, v in self._valores.items()]
+        lineas = self._cabecera()
+        for clave, (cuentas, suma, total) in sorted(items, key=lambda kv: kv[0]):
+            acumulado = 0
+            for le, c in zip(self.buckets + (float("inf"),), cuentas):
+                acumulado += c
+                le_txt = 'le="' + _num(le) + '"'
+                lineas.append(f"{self.nombre}_bucket{_etiquetas(self.etiquetas, clave, le_txt)} {acumulado}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiquetas, clave)} {_num(suma)}")
+            lineas.append(f"{self.nombre}_count{_etiquetas(self.etiquetas, clave)} {total}")
+        return lineas
+
+
+# =================== REGISTRO GLOBAL ===================
+_REGISTRO = {}
+_REGISTRO_LOCK = threading.Lock()
+
+
+def _registrar(cls, nombre, *args, **kwargs):
+    """Devuelve la métrica existente con ese nombre o la crea (idempotente entre módulos)."""
+    with _REGISTRO_LOCK:
+        m = _REGISTRO.get(nombre)
+        if m is None:
+            m = _REGISTRO[nombre] = cls(nombre, *args, **kwargs)
+        return m
+
+
+def contador(nombre: str, ayuda: str, etiquetas=()) -> Contador:
+    return _registrar(Contador, nombre, ayuda, etiquetas)
+
+
+def gauge(nombre: str, ayuda: str, etiquetas=(), funcion=None) -> Gauge:
+    return _registrar(Gauge, nombre, ayuda, etiquetas, funcion=funcion)
+
+
+def histograma(nombre: str, ayuda: str, etiquetas=(), buckets=BUCKETS_LATENCIA) -> Histograma:
+    return _registrar(Histograma, nombre, ayuda, etiquetas, buckets=buckets)
+
+
+def exponer_todo() -> str:
+    with _REGISTRO_LOCK:
+        metricas = list(_REGISTRO.values())
+    lineas = []
+    for m in metricas:
+        lineas.extend(m.exponer())
+    return "\n".join(lineas) + "\n"
+
+
+# =================== ENDPOINT HTTP ===================
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404, "Not found")
+            return
+        body = exponer_todo().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # sin una línea por scrape en consola
+
+
+def servir(puerto: int, host: str = "127.0.0.1"):
+    """
+    Arranca el endpoint /metrics en un hilo daemon. puerto<=0 -> desactivado (devuelve None).
+    Puerto ocupado (p.ej. otra instancia) -> aviso y None: sin métricas, pero el proceso sigue.
+    """
+    if not puerto or puerto <= 0:
+        return None
+    try:
+        srv = ThreadingHTTPServer((host, puerto), _Handler)
+    except OSError as e:
+        log.warning(f"/metrics no disponible en {host}:{puerto}: {e}")
+        return None
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, name=f"metricas:{puerto}", daemon=True).start()
+    return srv
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# oid.py — identificador de señal compacto, único por (canal, mensaje, revisión) y ordenable por tiempo
+#
+# Formato:  TTTTTTTT-CCCCCCC-MMMM-R   (base36, minúsculas)
+#   T = epoch ms de ts_redis_ingest, ancho fijo 8 (vale hasta 2059) -> el orden lexicográfico es temporal
+#   C = ch_id, M = msg_id, R = revisión (1 = mensaje nuevo, 2.. = ediciones)
+# Típicamente 22-25 caracteres: cabe en el comment de MT4 (31) junto al sufijo "-<código>" del EA.
+#
+# - Determinista: reprocesar la misma entrada del stream da el mismo oid (el UPSERT sigue siendo idempotente).
+# - Escaneos por rango de tiempo sobre la PK:  WHERE oid >= ? AND oid < ?  con rango_oid(desde_ms, hasta_ms).
+# - Los oid antiguos (YYYYMMDD-NNNNN) se reconocen con es_legacy(); ver bbdd/migrar_oid.py.
+
+import re
+import time
+from datetime import datetime, timezone
+
+_ALFABETO = "0123456789abcdefghijklmnopqrstuvwxyz"
+ANCHO_TIEMPO = 8
+_MAX_MS = 36 ** ANCHO_TIEMPO - 1
+_RE_LEGACY = re.compile(r"^\d{8}-\d{5}$")
+
+
+def _b36(n: int) -> str:
+    n = int(n)
+    if n < 0:
+        raise ValueError(f"valor negativo en oid: {n}")
+    if n == 0:
+        return "0"
+    s = []
+    while n:
+        n, d = divmod(n, 36)
+        s.append(_ALFABETO[d])
+    return "".join(reversed(s))
+
+
+def prefijo_tiempo(t_ms: int) -> str:
+    """Parte temporal de ancho fijo (base36, 8 caracteres)."""
+    t_ms = min(max(int(t_ms), 0), _MAX_MS)
+    return _b36(t_ms).rjust(ANCHO_TIEMPO, "0")
+
+
+def generar_oid(t_ms: int, ch_id, msg_id, revision=1) -> str:
+    ch = abs(int(ch_id or 0))          # algunos orígenes traen el id con signo (-100...)
+    return f"{prefijo_tiempo(t_ms)}-{_b36(ch)}-{_b36(int(msg_id or 0))}-{_b36(max(int(revision or 1), 1))}"
+
+
+def _iso_a_ms(ts) -> int:
+    if not ts:
+        return 0
+    try:
+        dt = datetime.fromisoformat(str(ts).strip().replace("Z", "+00:00"))
+    except ValueError:
+        return 0
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+
+def oid_desde_evento(evento: dict) -> str:
+    """
+    oid para un mensaje del stream pasarela:parse.
+    Tiempo: ts_redis_ingest (lo fija Redis al publicar) -> t_cap -> ts_utc -> ahora.
+    """
+    evento = evento or {}
+    t_ms = _iso_a_ms(evento.get("ts_redis_ingest"))
+    if not t_ms:
+        try:
+            t_ms = int(evento.get("t_cap") or 0)
+        except (TypeError, ValueError):
+            t_ms = 0
+    if not t_ms:
+        t_ms = _iso_a_ms(evento.get("ts_utc")) or time.time_ns() // 1_000_000
+    ch_id = (evento.get("ch_id") or evento.get("chat_id")
+             or evento.get("channel_id") or evento.get("ch") or 0)
+    return generar_oid(t_ms, ch_id, evento.get("msg_id") or 0, evento.get("revision") or 1)
+
+
+def es_legacy(oid: str) -> bool:
+    return bool(_RE_LEGACY.match(oid or ""))
+
+
+def descomponer(oid: str) -> dict:
+    """oid -> {t_ms, ch_id, msg_id, revision}. ValueError si no tiene el formato nuevo."""
+    partes = (oid or "").split("-")
+    if len(partes) != 4 or len(partes[0]) != ANCHO_TIEMPO:
+        raise ValueError(f"oid con formato no reconocido: {oid!r}")
+    t, ch, msg, rev = (int(p, 36) for p in partes)
+    return {"t_ms": t, "ch_id": ch, "msg_id": msg, "revision": rev}
+
+
+def clave_mensaje(oid: str) -> str:
+    """Identidad del mensaje sin tiempo ni revisión ('<ch>-<msg>'); oid legacy -> el propio oid."""
+    partes = (oid or "").split("-")
+    if len(partes) == 4:
+        return f"{partes[1]}-{partes[2]}"
+    return oid or ""
+
+
+def rango_oid(desde_ms: int, hasta_ms: int):
+    """Límites [inferior, superior) para  WHERE oid >= ? AND oid < ?  entre dos instantes (epoch ms)."""
+    return prefijo_tiempo(desde_ms), prefijo_tiempo(hasta_ms)
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# prioridad.py — carril prioritario para mensajes de gestión de posiciones
+# - es_gestion(texto): prefiltro barato (una regex) para CLOSE / PARTIAL CLOSE / MOVETO / STOPLOSSESTO / BREAKEVEN.
+#   Falsos positivos/negativos no cambian el resultado: el parser clasifica igual; solo cambia el orden.
+# - El listener publica esos mensajes en <REDIS_STREAM>:prio con dep_id = último ID que ese canal
+#   publicó en el stream normal; el parser no los procesa antes de haber procesado dep_id
+#   (orden por canal respecto a la señal original).
+
+import re
+
+SUFIJO_PRIO = ":prio"
+
+_RE_GESTION = re.compile(
+    r"clos|cerr|cierr|parcial|partial|"
+    r"break[\s-]*even|(?-i:(?<![A-Za-z])(?:BE|B\.E\.)(?![A-Za-z]))|equilibrio|(?:sin|cero)\s+p[eé]rdidas|"
+    r"(?:\bsl|stop[\s-]*loss(?:es)?)\s+(?:to|a)\b|"
+    r"\bmov(?:e|ed|ing|er|emos)\b|\bmueve|\bshift|\bsalir\b|\bsalida\b",
+    re.IGNORECASE,
+)
+
+
+def es_gestion(texto: str) -> bool:
+    return bool(texto) and _RE_GESTION.search(texto) is not None
+
+
+def stream_prio(stream: str) -> str:
+    return stream + SUFIJO_PRIO
+
+
+def _id_tupla(entry_id) -> tuple:
+    s = entry_id.decode() if isinstance(entry_id, bytes) else str(entry_id)
+    ms, _, sq = s.partition("-")
+    return int(ms), int(sq or 0)
+
+
+def id_menor_igual(a, b) -> bool:
+    """a <= b para IDs de stream ('1712345678901-0')."""
+    return _id_tupla(a) <= _id_tupla(b)
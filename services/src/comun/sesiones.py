@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+# sesiones.py — una sesión de Telethon (y una autorización) por proceso (rol)
+# - Antes listener, cliente de alertas del parseador y publicador abrían el mismo telethon_session.session
+#   (SQLite): "database is locked" al arrancar y al enviar mientras otro proceso escribía en él.
+# - Ahora cada rol tiene su propio login (su propia auth_key) en <TELEGRAM_SESSION>_<rol>.session
+#   (o TELEGRAM_SESSION_<ROL>), que solo abre ese rol:
+#     archivo  -> TelegramClient abre el .session del rol (listener, list_channels)
+#     memoria  -> StringSession con la auth_key del .session del rol, leída en solo-lectura: sin archivo
+#                 abierto, nada que bloquear (roles en TELEGRAM_SESSION_MEMORIA; por defecto parser y
+#                 publicador, que solo envían)
+# - Nunca se copia una auth_key a otro rol: la misma clave usada a la vez desde dos conexiones (sobre todo
+#   desde IPs distintas) provoca AUTH_KEY_DUPLICATED y Telegram la revoca para todos, listener incluido.
+#   Todos los roles corren en la misma máquina.
+# - Autorizar (código / 2FA una vez por rol; cada rol aparece como un dispositivo más en Telegram):
+#     python comun/sesiones.py login                  # todos los roles que aún no tienen login
+#     python comun/sesiones.py login listener parser
+#   La sesión base antigua (TELEGRAM_SESSION, por defecto telethon_session), si existe y el listener aún no
+#   tiene la suya, se MUEVE a la del listener (no se copia): su clave sigue teniendo un solo dueño. Lo hace
+#   también el propio listener al arrancar (sesion("listener")): una instalación existente se actualiza sin
+#   pasar por login y sin que Telethon pida el teléfono. Parser y publicador sí necesitan su login.
+# - Sin login previo, cada rol abre su archivo y Telethon pide el login al arrancar, como antes.
+
+import os
+import sys
+import sqlite3
+
+EXTENSION = ".session"
+ROLES = ("listener", "parser", "publicador", "list_channels")
+
+
+def _base(base: str = None) -> str:
+    return (base or os.getenv("TELEGRAM_SESSION", "") or "telethon_session").strip()
+
+
+def _memoria() -> set:
+    return {r.strip().lower() for r in os.getenv("TELEGRAM_SESSION_MEMORIA", "parser,publicador").split(",") if r.strip()}
+
+
+def _archivo(nombre: str) -> str:
+    return nombre if nombre.endswith(EXTENSION) else nombre + EXTENSION
+
+
+def nombre_rol(rol: str, base: str = None) -> str:
+    """Nombre de la sesión de archivo del rol (sin extensión)."""
+    return os.getenv(f"TELEGRAM_SESSION_{rol.upper()}", "").strip() or f"{_base(base)}_{rol}"
+
+
+def leer_clave(nombre: str):
+    """(dc_id, server_address, port, auth_key bytes) de una sesión SQLite de Telethon; None si no hay login."""
+    ruta = _archivo(nombre)
+    if not os.path.exists(ruta):
+        return None
+    try:
+        con = sqlite3.connect(f"file:{ruta}?mode=ro", uri=True, timeout=5)
+        try:
+            fila = con.execute("SELECT dc_id, server_address, port, auth_key FROM sessions").fetchone()
+        finally:
+            con.close()
+    except sqlite3.Error:
+        return None
+    return fila if fila and fila[3] else None
+
+
+def cadena(clave) -> str:
+    """StringSession (texto) a partir de (dc_id, server_address, port, auth_key)."""
+    from telethon.crypto import AuthKey
+    from telethon.sessions import StringSession
+    dc_id, direccion, puerto, auth_key = clave
+    s = StringSession()
+    s.set_dc(dc_id, direccion, puerto)
+    s.auth_key = AuthKey(data=auth_key)
+    return StringSession.save(s)
+
+
+def heredar_base(base: str = None) -> bool:
+    """Mueve la sesión base antigua a la del listener si este aún no tiene login. True si la ha movido."""
+    origen, destino = _archivo(_base(base)), _archivo(nombre_rol("listener", base))
+    if leer_clave(destino) is not None or leer_clave(origen) is None or origen == destino:
+        return False
+    try:
+        os.replace(origen, destino)
+        if os.path.exists(origen + "-journal"):
+            os.replace(origen + "-journal", destino + "-journal")
+    except OSError as e:                   # p.ej. otro proceso (versión anterior) aún la tiene abierta
+        print(f"[sesiones] no se pudo mover {origen} a {destino}: {e}")
+        return False
+    print(f"[sesiones] listener: {origen} movida a {destino}")
+    return True
+
+
+def sesion(rol: str, base: str = None):
+    """
+    Sesión para TelegramClient(sesion(rol), api_id, api_hash): StringSession en memoria (con la clave del
+    propio rol) para los roles de TELEGRAM_SESSION_MEMORIA; si no, el nombre de la sesión de archivo del rol.
+    """
+    rol = rol.lower()
+    nombre = nombre_rol(rol, base)
+    if rol == "listener":
+        heredar_base(base)                 # instalación anterior: la sesión base pasa a ser la del listener
+    if rol in _memoria():
+        clave = leer_clave(nombre)
+        if clave is not None:
+            from telethon.sessions import StringSession
+            return StringSession(cadena(clave))
+    return nombre                          # sin login previo: archivo propio y login interactivo
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] != ["login"] or any(r not in ROLES for r in argv[1:]):
+        print(f"Uso: python comun/sesiones.py login [{' '.join(ROLES)}]")
+        return 2
+    import asyncio
+    from dotenv import load_dotenv, find_dotenv
+    from telethon import TelegramClient
+    load_dotenv(find_dotenv(usecwd=True), override=False)
+    roles = argv[1:] or ROLES
+
+    if "listener" in roles:
+        heredar_base()
+
+    async def _login(nombre):
+        client = TelegramClient(nombre, int(os.environ["TELEGRAM_API_ID"]), os.environ["TELEGRAM_API_HASH"])
+        await client.start(phone=os.getenv("TELEGRAM_PHONE") or None)
+        await client.disconnect()
+
+    for rol in roles:
+        nombre = nombre_rol(rol)
+        if leer_clave(nombre) is not None:
+            print(f"[sesiones] {rol}: {_archivo(nombre)} (ya autorizada)")
+            continue
+        print(f"[sesiones] {rol}: login propio en {_archivo(nombre)}")
+        asyncio.run(_login(nombre))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# trazado.py — latencias por etapa (spans) de cada mensaje, guardadas con su fila
+# - Ancla: hora de pared (epoch ms) al empezar a procesar el mensaje en el parseador.
+# - Etapas locales: offset y duración con perf_counter_ns (alta resolución, monótono).
+# - Etapas entre procesos (Telegram -> listener -> Redis -> parseador): por hora de pared.
+#
+# Registro compacto (JSON en la columna 'spans' de Trazas_Unica):
+#   {"w0": 1734170000123, "e": {"clasificar": [0.0, 1.84], "csv": [2.1, 0.35], ...}}
+#   e[etapa] = [offset_ms respecto a w0, duracion_ms]   (offset negativo = antes de w0)
+
+import json, time
+from contextlib import contextmanager
+from datetime import datetime
+
+# Orden de presentación de las etapas (visor / informes)
+ETAPAS = (
+    "telegram_listener",   # ts_utc (Telegram) -> captura en listener
+    "listener",            # captura -> XADD (incluye round-trips a Redis)
+    "cola_redis",          # ts_redis_ingest -> lectura en parseador
+    "clasificar",
+    "bbdd",                # básicos + operativos + outbox (una transacción)
+    "bbdd_basico",         # registros anteriores al outbox
+    "csv",
+    "bbdd_operativos",
+    "socket",
+    "telegram",
+    "ack_ea",              # difusión por socket -> ACK del EA
+)
+
+
+def ahora_ms() -> int:
+    return time.time_ns() // 1_000_000
+
+
+def iso_a_ms(ts) -> int:
+    """'2025-12-14T10:38:02.123Z' (o con +00:00) -> epoch ms. None si no se puede."""
+    if not ts:
+        return None
+    try:
+        s = str(ts).strip()
+        if s.endswith("Z"):
+            s = s[:-1] + "+00:00"
+        return int(datetime.fromisoformat(s).timestamp() * 1000)
+    except Exception:
+        return None
+
+
+class Traza:
+    """Spans de un mensaje dentro del parseador. No bloquea ni hace I/O."""
+    __slots__ = ("w0", "t0", "e")
+
+    def __init__(self):
+        self.w0 = ahora_ms()
+        self.t0 = time.perf_counter_ns()
+        self.e = {}
+
+    def _offset(self, t_ns: int) -> float:
+        return round((t_ns - self.t0) / 1e6, 3)
+
+    @contextmanager
+    def etapa(self, nombre: str):
+        t = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.e[nombre] = [self._offset(t), round((time.perf_counter_ns() - t) / 1e6, 3)]
+
+    def registrar(self, nombre: str, inicio_ns: int, fin_ns: int):
+        """Etapa medida fuera de un 'with' (p.ej. en otro hilo) con perf_counter_ns."""
+        self.e[nombre] = [self._offset(inicio_ns), round((fin_ns - inicio_ns) / 1e6, 3)]
+
+    def externa(self, nombre: str, inicio_ms, fin_ms):
+        """Etapa entre procesos por hora de pared (epoch ms). Se ignora si falta un extremo."""
+        if inicio_ms is None or fin_ms is None:
+            return
+        self.e[nombre] = [round(inicio_ms - self.w0, 3), round(fin_ms - inicio_ms, 3)]
+
+    def desde_evento(self, data: dict):
+        """Etapas previas al parseador a partir de los campos del stream (listener + Redis)."""
+        ts_tg = iso_a_ms(data.get("ts_utc"))
+        t_cap = _int_o_none(data.get("t_cap"))
+        d_lst = _float_o_none(data.get("d_lst"))
+        ts_ingest = iso_a_ms(data.get("ts_redis_ingest"))
+        self.externa("telegram_listener", ts_tg, t_cap)
+        if t_cap is not None and d_lst is not None:
+            self.e["listener"] = [round(t_cap - self.w0, 3), round(d_lst, 3)]
+        self.externa("cola_redis", ts_ingest, self.w0)
+
+    def a_json(self) -> str:
+        return json.dumps({"w0": self.w0, "e": self.e}, separators=(",", ":"))
+
+
+def _int_o_none(v):
+    try:
+        return int(v) if v not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _float_o_none(v):
+    try:
+        return float(v) if v not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+
+def duraciones(spans_json: str) -> dict:
+    """{etapa: duracion_ms} de un registro guardado. {} si está vacío o corrupto."""
+    if not spans_json:
+        return {}
+    try:
+        e = json.loads(spans_json).get("e") or {}
+        return {k: float(v[1]) for k, v in e.items() if isinstance(v, (list, tuple)) and len(v) >= 2}
+    except Exception:
+        return {}
+
+
+def percentiles(valores, ps=(50, 95, 99)) -> dict:
+    """Percentiles por rango más cercano. {p: valor}; vacío si no hay valores."""
+    xs = sorted(valores)
+    if not xs:
+        return {}
+    n = len(xs)
+    out = {}
+    for p in ps:
+        k = max(0, min(n - 1, int(-(-p * n // 100)) - 1))   # ceil(p*n/100) - 1
+        out[p] = xs[k]
+    return out
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+# fake_telegram.py — sustituto local de Telegram para pruebas de carga de extremo a extremo
+# - Eventos con el subconjunto de la interfaz de Telethon que usan los handlers de listener.py:
+#     event.message (id, message, date, edit_date, sender_id, reply_to_msg_id), event.chat_id,
+#     await event.get_chat() -> telethon.tl.types.Channel (canales falsos, broadcast)
+# - Llama a listener.on_new / listener.on_edit tal cual (con la tarea publicadora del listener en marcha):
+#   mismos filtros, cola, revisiones, dedup, enrutado normal/prioritario y XADD contra el Redis real (REDIS_URL).
+# - Reproduce un corpus a ritmo fijo (--ritmo msg/s) repartido entre N canales; --ediciones / --tormenta
+#   simulan tormentas de edición (K ediciones seguidas del mismo mensaje).
+# - Informe: throughput, latencia del handler (hasta encolar, ms), latencia del listener (captura -> lote
+#   enviado: d_lst de las entradas publicadas, ms), tamaño de lote y, con --esperar, tiempo hasta que
+#   el parseador vacía el consumer group y latencia captura -> último sink leída de Trazas_Unica.spans.
+#
+# Uso (redis-server local + parseador arrancado aparte):
+#   python listener/fake_telegram.py --ritmo 2000 --mensajes 20000 --canales 20 --esperar 120
+#   python listener/fake_telegram.py --corpus mensajes.jsonl --ediciones 0.1 --tormenta 20 --informe carga.json
+#   (LOG_SAMPLE=listener.evento=0.01,parseador.mensaje=0.01 para que el log no domine la medida)
+
+import os, sys, json, time, random, asyncio, sqlite3, argparse
+from datetime import datetime, timezone
+
+# --- PATH robusto para imports locales ---
+BASE_DIR   = os.path.dirname(os.path.abspath(__file__))          # .../services/src/listener
+PARENT_DIR = os.path.dirname(BASE_DIR)                           # .../services/src
+for _p in (PARENT_DIR, BASE_DIR):
+    if _p not in sys.path:
+        sys.path.insert(0, _p)
+
+from telethon.tl.types import Channel, ChatPhotoEmpty
+
+from comun.trazado import percentiles
+from comun.formato_stream import decodificar
+
+CANAL_BASE = 9_900_000_000   # ids de canal falsos (no chocan con canales reales)
+
+# Corpus por defecto: entradas y gestión típicas de los canales
+CORPUS_DEFECTO = (
+    "BUY XAUUSD 2000 SL 1990 TP 2010 TP 2020",
+    "SELL EURUSD 1.0850 SL 1.0900 TP 1.0800 TP 1.0750",
+    "XAUUSD BUY LIMIT 1985\nSL 1975\nTP 1995\nTP 2005",
+    "GBPUSD SELL NOW 1.2650 SL 1.2700 TP 1.2600",
+    "Move SL to entry XAUUSD",
+    "Close all XAUUSD now",
+    "Take partial profits EURUSD",
+    "Buen día traders, hoy hay noticias a las 14:30",
+)
+
+
+# =================== EVENTOS FALSOS ===================
+class MensajeFalso:
+    __slots__ = ("id", "message", "date", "edit_date", "sender_id", "reply_to_msg_id")
+
+    def __init__(self, msg_id: int, texto: str, date=None, edit_date=None, reply_to=None):
+        self.id = msg_id
+        self.message = texto
+        self.date = date or datetime.now(timezone.utc)
+        self.edit_date = edit_date
+        self.sender_id = None
+        self.reply_to_msg_id = reply_to
+
+
+class EventoFalso:
+    """NewMessage.Event / MessageEdited.Event mínimo."""
+    __slots__ = ("message", "chat_id", "_chat")
+
+    def __init__(self, message: MensajeFalso, chat: Channel):
+        self.message = message
+        self.chat_id = -1_000_000_000_000 - chat.id      # id "marcado" de canal, como Telethon
+        self._chat = chat
+
+    async def get_chat(self):
+        return self._chat
+
+
+def canales_falsos(n: int) -> list:
+    return [Channel(id=CANAL_BASE + i, title=f"Fake {i}", photo=ChatPhotoEmpty(), date=None,
+                    broadcast=True, username=f"fake_canal_{i}", access_hash=CANAL_BASE + i) for i in range(n)]
+
+
+def cargar_corpus(ruta: str = None) -> list:
+    """JSONL (campo text / text/raw / raw por línea) o texto plano con mensajes separados por línea vacía."""
+    if not ruta:
+        return list(CORPUS_DEFECTO)
+    with open(ruta, "r", encoding="utf-8") as f:
+        contenido = f.read()
+    if ruta.endswith(".jsonl"):
+        textos = []
+        for linea in contenido.splitlines():
+            if linea.strip():
+                ev = json.loads(linea)
+                textos.append(ev.get("text") or ev.get("text/raw") or ev.get("raw") or "")
+    else:
+        textos = [b.strip() for b in contenido.split("\n\n")]
+    textos = [t for t in textos if t]
+    if not textos:
+        raise SystemExit(f"[ERROR] Corpus vacío: {ruta}")
+    return textos
+
+
+def _editar(texto: str, k: int) -> str:
+    """Variación mínima (como una corrección del canal): añade una marca de edición."""
+    return f"{texto}\n(edit {k})"
+
+
+# =================== CARGA ===================
+async def _mensaje(ls, chat, msg_id: int, texto: str, ediciones: int, lat: dict):
+    t = time.perf_counter()
+    await ls.on_new(EventoFalso(MensajeFalso(msg_id, texto), chat))
+    lat["new"].append((time.perf_counter() - t) * 1000)
+    for k in range(1, ediciones + 1):
+        ahora = datetime.now(timezone.utc)
+        t = time.perf_counter()
+        await ls.on_edit(EventoFalso(MensajeFalso(msg_id, _editar(texto, k), edit_date=ahora), chat))
+        lat["edit"].append((time.perf_counter() - t) * 1000)
+
+
+async def _xlen(r, stream: str) -> int:
+    try:
+        return int(await r.xlen(stream))
+    except Exception:
+        return 0
+
+
+async def _ultimo_id(r, stream: str) -> str:
+    try:
+        ult = await r.xrevrange(stream, count=1)
+    except Exception:
+        return None
+    return ult[0][0] if ult else None
+
+
+async def _d_lst(r, stream: str, desde: str) -> list:
+    """d_lst (ms) de las entradas publicadas en el stream después de `desde`."""
+    res, inicio = [], f"({desde}" if desde else "-"
+    while True:
+        tramo = await r.xrange(stream, min=inicio, count=1000)
+        if not tramo:
+            return res
+        res += [float(d["d_lst"]) for d in (decodificar(i, f) for i, f in tramo) if d.get("d_lst")]
+        inicio = f"({tramo[-1][0]}"
+
+
+async def generar(ls, r, args, corpus: list) -> dict:
+    """Publica args.mensajes mensajes a args.ritmo msg/s por los handlers del listener."""
+    canales = canales_falsos(args.canales)
+    ls.CHANNEL_IDS = {c.id for c in canales}
+    ls.CHANNEL_CONFIG = {c.id: {"title": c.title, "username": c.username, "include_linked": False} for c in canales}
+    ls.CANALES_META = {c.id: ls.meta_canal(c) for c in canales}     # como tras validate_and_enrich_channels
+
+    rnd = random.Random(args.semilla)
+    base_id = int(time.time()) * 1000          # msg_id únicos por ejecución (el dedup de tg:revs:* dura días)
+    lat = {"new": [], "edit": []}
+    antes = {s: await _xlen(r, s) for s in (ls.PARSE_STREAM, ls.PRIO_STREAM)}
+    ultimos = {s: await _ultimo_id(r, s) for s in antes}
+    lotes_antes, suma_antes = ls.LST_LOTE.resumen()
+    publicador = ls.iniciar_publicador(r)
+    sem = asyncio.Semaphore(args.concurrencia)
+    pendientes = set()
+
+    async def _uno(*a):
+        async with sem:
+            await _mensaje(ls, *a, lat)
+
+    t0 = time.perf_counter()
+    for i in range(args.mensajes):
+        espera = t0 + i / args.ritmo - time.perf_counter()
+        if espera > 0:
+            await asyncio.sleep(espera)
+        ediciones = args.tormenta if rnd.random() < args.ediciones else 0
+        tarea = asyncio.create_task(_uno(canales[i % len(canales)], base_id + i, rnd.choice(corpus), ediciones))
+        pendientes.add(tarea)
+        tarea.add_done_callback(pendientes.discard)
+    if pendientes:
+        await asyncio.gather(*pendientes)
+    await ls.vaciar_cola()
+    segundos = time.perf_counter() - t0
+    publicador.cancel()
+
+    publicados = {s: await _xlen(r, s) - n for s, n in antes.items()}
+    eventos = len(lat["new"]) + len(lat["edit"])
+    d_lst = [v for s in antes for v in await _d_lst(r, s, ultimos[s])]
+    lotes, suma = ls.LST_LOTE.resumen()
+    lotes, suma = lotes - lotes_antes, suma - suma_antes
+    handler = lat["new"] + lat["edit"]
+    return {
+        "mensajes": len(lat["new"]),
+        "ediciones": len(lat["edit"]),
+        "segundos": round(segundos, 3),
+        "eventos_por_seg": round(eventos / segundos, 1) if segundos else 0.0,
+        "publicados": publicados,
+        "descartados": eventos - sum(publicados.values()),
+        "latencia_handler_ms": {f"p{p}": round(v, 3) for p, v in percentiles(handler, (50, 95, 99)).items()},
+        "latencia_listener_ms": {f"p{p}": round(v, 3) for p, v in percentiles(d_lst, (50, 95, 99)).items()},
+        "latencia_listener_max_ms": round(max(d_lst, default=0.0), 3),
+        "lotes": lotes,
+        "lote_medio": round(suma / lotes, 2) if lotes else 0.0,
+        "canales": [c.id for c in canales],
+        "desde_ms": base_id,
+    }
+
+
+async def esperar_parser(r, streams, grupo: str, limite_s: float) -> float:
+    """Segundos hasta que el consumer group no tiene nada sin leer ni sin ACK en los streams; None si vence."""
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < limite_s:
+        vacio = True
+        for s in streams:
+            try:
+                grupos = await r.xinfo_groups(s)
+            except Exception:
+                continue                        # stream inexistente (p.ej. sin mensajes de gestión)
+            g = next((g for g in grupos if g.get("name") == grupo), None)
+            if g is None:
+                vacio = False
+                break
+            ultimo = (await r.xinfo_stream(s)).get("last-generated-id")
+            if g.get("pending") or g.get("last-delivered-id") != ultimo:
+                vacio = False
+                break
+        if vacio:
+            return round(time.perf_counter() - t0, 3)
+        await asyncio.sleep(0.2)
+    return None
+
+
+def latencias_bbdd(db: str, tabla: str, canales: list, desde_ms: int) -> dict:
+    """Captura en listener -> fin del último sink (ms), desde la columna spans de las filas de la prueba."""
+    con = sqlite3.connect(f"file:{db}?mode=ro", uri=True)
+    try:
+        marcas = ",".join("?" * len(canales))
+        filas = con.execute(f"SELECT spans FROM {tabla} WHERE CAST(ch_id AS INTEGER) IN ({marcas}) "
+                            f"AND CAST(msg_id AS INTEGER) >= ? AND spans IS NOT NULL",
+                            (*canales, desde_ms)).fetchall()
+    finally:
+        con.close()
+    e2e = []
+    for (spans,) in filas:
+        try:
+            etapas = json.loads(spans)["e"]
+        except (ValueError, KeyError, TypeError):
+            continue
+        if "listener" not in etapas:
+            continue
+        inicio = etapas["listener"][0]
+        fin = max(off + dur for off, dur in etapas.values())
+        e2e.append(fin - inicio)
+    return {"filas": len(filas), "latencia_e2e_ms": {f"p{p}": round(v, 3) for p, v in percentiles(e2e).items()},
+            "latencia_e2e_max_ms": round(max(e2e, default=0.0), 3)}
+
+
+# =================== CLI ===================
+def imprimir(informe: dict):
+    print(f"[fake-tg] {informe['mensajes']} mensajes + {informe['ediciones']} ediciones en "
+          f"{informe['segundos']:.3f}s → {informe['eventos_por_seg']} eventos/s")
+    print(f"[fake-tg] publicados: {informe['publicados']}  descartados: {informe['descartados']}")
+    lat = "  ".join(f"{k}={v:.3f}" for k, v in informe["latencia_handler_ms"].items())
+    print(f"[fake-tg] latencia handler (encolar) ms: {lat}")
+    lat = "  ".join(f"{k}={v:.3f}" for k, v in informe["latencia_listener_ms"].items())
+    print(f"[fake-tg] latencia listener (captura→lote) ms: {lat}  max={informe['latencia_listener_max_ms']}")
+    print(f"[fake-tg] {informe['lotes']} lotes de publicación, {informe['lote_medio']} mensajes por lote de media")
+    if "parser_vaciado_s" in informe:
+        v = informe["parser_vaciado_s"]
+        print(f"[fake-tg] parseador al día {'tras ' + str(v) + 's' if v is not None else 'NO (venció --esperar)'}")
+    if "bbdd" in informe:
+        b = informe["bbdd"]
+        lat = "  ".join(f"{k}={v:.3f}" for k, v in b["latencia_e2e_ms"].items())
+        print(f"[fake-tg] Trazas_Unica: {b['filas']} filas; captura→último sink ms: {lat}  max={b['latencia_e2e_max_ms']}")
+
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(prog="fake_telegram.py",
+                                 description="Inyecta tráfico simulado de Telegram por los handlers del listener.")
+    ap.add_argument("--corpus", help="JSONL de eventos o texto con mensajes separados por línea vacía.")
+    ap.add_argument("--mensajes", type=int, default=1000, help="Mensajes nuevos a publicar.")
+    ap.add_argument("--ritmo", type=float, default=500.0, help="Mensajes nuevos por segundo.")
+    ap.add_argument("--canales", type=int, default=10, help="Canales falsos entre los que repartir.")
+    ap.add_argument("--ediciones", type=float, default=0.0, help="Fracción de mensajes que se editan.")
+    ap.add_argument("--tormenta", type=int, default=3, help="Ediciones seguidas de cada mensaje editado.")
+    ap.add_argument("--concurrencia", type=int, default=256, help="Handlers en vuelo como máximo.")
+    ap.add_argument("--semilla", type=int, default=1)
+    ap.add_argument("--redis", help="URL de Redis (por defecto REDIS_URL).")
+    ap.add_argument("--esperar", type=float, default=0.0,
+                    help="Segundos máximos esperando a que el parseador vacíe el grupo (0 = no esperar).")
+    ap.add_argument("--bbdd", help="BBDD del parseador para latencia de extremo a extremo (por defecto PASARELA_DB).")
+    ap.add_argument("--informe", help="Guardar el informe en JSON.")
+    args = ap.parse_args(argv)
+    if args.ritmo <= 0 or args.canales <= 0 or args.mensajes <= 0:
+        ap.error("--ritmo, --canales y --mensajes deben ser > 0")
+    return args
+
+
+async def ejecutar(args, ls=None, r=None) -> dict:
+    if ls is None:
+        import listener as ls
+    if r is None:
+        from redis.asyncio import Redis
+        r = Redis.from_url(args.redis or ls.REDIS_URL, decode_responses=True)
+    informe = await generar(ls, r, args, cargar_corpus(args.corpus))
+    if args.esperar > 0:
+        grupo = os.getenv("REDIS_GROUP", "parser")
+        informe["parser_vaciado_s"] = await esperar_parser(r, (ls.PARSE_STREAM, ls.PRIO_STREAM), grupo, args.esperar)
+        db = args.bbdd or os.getenv("PASARELA_DB", "")
+        if db and os.path.exists(db):
+            informe["bbdd"] = latencias_bbdd(db, os.getenv("PASARELA_TABLE", "Trazas_Unica"),
+                                             informe["canales"], informe["desde_ms"])
+    return informe
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    informe = asyncio.run(ejecutar(args))
+    imprimir(informe)
+    if args.informe:
+        with open(args.informe, "w", encoding="utf-8") as f:
+            json.dump(informe, f, ensure_ascii=False, indent=2)
+        print(f"[fake-tg] informe en {args.informe}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,26 @@
 # -*- coding: utf-8 -*-
 # Script auxiliar para listar todos los canales disponibles y obtener sus IDs
-# Uso: python list_channels.py
+# Uso: python list_channels.py [--refrescar]
+# - Lee de la caché de entidades compartida (comun/entidades.py); solo recorre los diálogos de Telegram
+#   si el último recorrido es más antiguo que ENTIDADES_TTL_SEC o con --refrescar.
 
-import os, json, asyncio
+import os, sys, json, asyncio
 from pathlib import Path
 from dotenv import load_dotenv, find_dotenv
 from telethon import TelegramClient
-from telethon.tl.types import Channel
 
 # ========= Carga de .env =========
 ENV_PATH = find_dotenv(usecwd=True) or str(Path(__file__).resolve().parents[1].parent / ".env")
 load_dotenv(ENV_PATH, override=True)
 
+# --- PATH robusto para imports locales ---
+PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))   # .../services/src
+if PARENT_DIR not in sys.path:
+    sys.path.insert(0, PARENT_DIR)
+
+from comun import entidades
+from comun import sesiones
+
 def _must(varname: str) -> str:
     v = os.getenv(varname, "").strip()
     if not v:
@@ -23,40 +32,43 @@ api_hash     = _must("TELEGRAM_API_HASH")
 phone        = os.getenv("TELEGRAM_PHONE", "+34607190588")
 session_name = os.getenv("TELEGRAM_SESSION", "telethon_session")
 
-client = TelegramClient(session_name, api_id, api_hash)
+client = TelegramClient(sesiones.sesion("list_channels", session_name), api_id, api_hash)
 
-async def list_all_channels():
+async def list_all_channels(refrescar: bool = False):
     """Lista todos los canales disponibles con sus IDs para configuración."""
     channels = []
     
     print("\n=== LISTANDO CANALES DISPONIBLES ===\n")
     
-    async for d in client.iter_dialogs():
-        ent = d.entity
-        if isinstance(ent, Channel) and not getattr(ent, "left", False):
-            # Solo canales públicos o megagrupos
-            if not (ent.broadcast or ent.megagroup):
-                continue
-                
-            cid = int(ent.id)
-            title = getattr(ent, "title", "") or ""
-            username = getattr(ent, "username", "") or ""
-            linked_id = getattr(ent, "linked_chat_id", None)
-            
-            channel_info = {
-                "id": cid,
-                "title": title,
-                "username": username,
-                "enabled": True,
-                "include_linked": bool(linked_id)
-            }
-            
-            channels.append(channel_info)
-            
-            # Mostrar información
-            tipo = "CANAL" if ent.broadcast else "MEGAGRUPO"
-            link_info = f" (linked: {linked_id})" if linked_id else ""
-            print(f"[{tipo}] ID: {cid:12d} | @{username or 'N/A':20s} | {title}{link_info}")
+    cache = entidades.CacheEntidades()
+    if refrescar or not cache.barrido_reciente():
+        n = await entidades.barrer_dialogos(client, cache)
+        print(f"[cache] {n} diálogos leídos de Telegram → {cache.ruta}\n")
+    else:
+        print(f"[cache] Diálogos desde {cache.ruta} (--refrescar para releer Telegram)\n")
+    
+    # Solo canales públicos o megagrupos, a los que sigues
+    for ent in cache.canales():
+        cid = int(ent.id)
+        title = ent.title
+        username = ent.username
+        linked_id = ent.linked_chat_id   # solo si ya se consultó (listener con include_linked)
+        
+        channel_info = {
+            "id": cid,
+            "title": title,
+            "username": username,
+            "enabled": True,
+            "include_linked": bool(linked_id)
+        }
+        
+        channels.append(channel_info)
+        
+        # Mostrar información
+        tipo = "CANAL" if ent.broadcast else "MEGAGRUPO"
+        link_info = f" (linked: {linked_id})" if linked_id else ""
+        print(f"[{tipo}] ID: {cid:12d} | @{username or 'N/A':20s} | {title}{link_info}")
+    cache.cerrar()
     
     print(f"\n=== TOTAL: {len(channels)} canales encontrados ===\n")
     
@@ -84,7 +96,7 @@ async def list_all_channels():
 
 async def main():
     await client.start(phone=phone)
-    await list_all_channels()
+    await list_all_channels(refrescar="--refrescar" in sys.argv)
     await client.disconnect()
 
 if __name__ == "__main__":
@@ -2,13 +2,15 @@
 # listener.py — Listener de Telegram con configuración desde archivo JSON
 # - Lee canales desde archivo de configuración (config/channels.json)
 # - Captura mensajes nuevos y editados
-# - Hot-reload: recarga configuración automáticamente
+# - Hot-reload: recarga la configuración en cuanto cambia el archivo (inotify / sondeo, vigilancia.py)
 # - Publica mensajes en Redis Streams
+# - Tras reconectar o reiniciar, recupera lo publicado entre medias desde la marca de agua de cada canal
 
-import os, csv, json, asyncio, subprocess
-from datetime import datetime, timezone
+import os, csv, json, time, asyncio, itertools, subprocess
+from datetime import datetime, timezone, timedelta
 from telethon import TelegramClient, events, functions, types
 from telethon.tl.types import Channel
+from telethon.utils import resolve_id
 from redis.asyncio import Redis
 import redis.exceptions
 
@@ -21,6 +23,28 @@ from dotenv import load_dotenv, find_dotenv
 ENV_PATH = find_dotenv(usecwd=True) or str(Path(__file__).resolve().parents[1].parent / ".env")
 load_dotenv(ENV_PATH, override=True)
 
+# --- PATH robusto para imports locales (añade padre para paquetes hermanos) ---
+import sys
+BASE_DIR   = os.path.dirname(os.path.abspath(__file__))          # .../services/src/listener
+PARENT_DIR = os.path.dirname(BASE_DIR)                           # .../services/src
+if PARENT_DIR not in sys.path:
+    sys.path.insert(0, PARENT_DIR)
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+from comun import metricas
+from comun import logs
+from comun.prioridad import es_gestion, stream_prio
+from comun import entidades
+from comun import sesiones
+from publicacion import publicar_varios   # revisión + dedup + XADD por script Lua, en pipeline
+from spool import Spool
+from marcas import MarcasAgua
+import vigilancia
+
+_log     = logs.configurar("listener")
+_log_evt = logs.obtener("listener.evento")   # una línea por NEW/EDIT publicado (muestreable con LOG_SAMPLE)
+
 def _must(varname: str) -> str:
     v = os.getenv(varname, "").strip()
     if not v:
@@ -28,10 +52,9 @@ def _must(varname: str) -> str:
     return v
 
 # ========= CREDENCIALES TELEGRAM =========
-api_id       = int(_must("TELEGRAM_API_ID"))                # (PATCH) antes: valor por defecto hardcodeado
-api_hash     = _must("TELEGRAM_API_HASH")                   # (PATCH)
+# api_id/api_hash se exigen al crear el cliente (main): el módulo se importa sin ellas (fake_telegram.py)
 phone        = os.getenv("TELEGRAM_PHONE", "+34607190588")  # sin cambios funcionales (permite override por .env)
-session_name = os.getenv("TELEGRAM_SESSION", "telethon_session")  # sin cambios
+session_name = os.getenv("TELEGRAM_SESSION", "telethon_session")  # sesión base: el listener usa <base>_listener (comun/sesiones.py)
 
 # ========= OPCIONES CSV =========
 WRITE_CSV = False  # <--- por defecto OFF (pon True si quieres registro en CSV)
@@ -43,8 +66,57 @@ EXCLUDE_TITLES    = set()
 # ========= REDIS (Streams) =========
 REDIS_URL     = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 PARSE_STREAM  = os.getenv("REDIS_STREAM", "pasarela:parse")
+# Carril prioritario: CLOSE/PARCIAL/MOVETO/BREAKEVEN... (prefiltro en comun/prioridad.py)
+PRIO_ENABLED  = os.getenv("PRIO_ENABLED", "1").strip().lower() in ("1", "true", "yes", "on")
+PRIO_STREAM   = os.getenv("REDIS_STREAM_PRIO", stream_prio(PARSE_STREAM))
 DEDUP_TTL_SEC = int(os.getenv("DEDUP_TTL", str(15*24*3600)))  # 15 días
 STREAM_MAXLEN = int(os.getenv("STREAM_MAXLEN", "200000"))
+PUB_COLA_MAX  = int(os.getenv("PUB_COLA_MAX", "10000"))   # capturas en cola hacia la tarea publicadora
+PUB_LOTE_MAX  = int(os.getenv("PUB_LOTE_MAX", "200"))     # mensajes por round-trip como máximo
+
+# ========= SPOOL LOCAL (Redis no disponible) =========
+# Lo capturado mientras Redis falla se guarda en SQLite y se drena en orden al volver (spool.py)
+SPOOL_ENABLED    = os.getenv("SPOOL_ENABLED", "1").strip().lower() in ("1", "true", "yes", "on")
+SPOOL_PATH       = os.getenv("SPOOL_PATH", r"C:\Pasarela\data\listener_spool.db")
+SPOOL_DRENAR_SEC = float(os.getenv("SPOOL_DRENAR_SEC", "2"))   # comprobación de Redis con spool pendiente
+SPOOL_LOTE       = 100
+SPOOLADO         = "spool"   # destino registrado (log/CSV) cuando el mensaje queda en el spool
+SPOOL = None                 # Spool, abierto en main() si SPOOL_ENABLED
+
+# ========= RECUPERACIÓN DE HUECOS (reconexión / reinicio) =========
+# Último msg_id publicado por canal (marcas.py); al reconectar se piden a Telegram solo los posteriores,
+# en paralelo por canal y sin ir más atrás de RECUPERAR_MAX_MIN. Pasan por la misma cola/dedup/revisión
+# que los capturados en vivo, marcados recuperado=1 (el parseador les aplica plazos de caducidad más cortos).
+MARCAS_ENABLED          = os.getenv("MARCAS_ENABLED", "1").strip().lower() in ("1", "true", "yes", "on")
+MARCAS_PATH             = os.getenv("MARCAS_PATH", r"C:\Pasarela\data\listener_marcas.db")
+MARCAS_GUARDAR_SEC      = float(os.getenv("MARCAS_GUARDAR_SEC", "5"))
+RECUPERAR_MAX_MIN       = float(os.getenv("RECUPERAR_MAX_MIN", "60"))        # antigüedad máxima a recuperar
+RECUPERAR_CONCURRENCIA  = int(os.getenv("RECUPERAR_CONCURRENCIA", "8"))      # canales consultados a la vez
+RECUPERAR_MAX_MSG       = int(os.getenv("RECUPERAR_MAX_MSG", "500"))         # mensajes por canal como máximo
+MARCAS = None                # MarcasAgua, abierto en main() si MARCAS_ENABLED
+
+# ========= MÉTRICAS (endpoint Prometheus; 0 = desactivado) =========
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+LISTENER_METRICS_PORT = int(os.getenv("LISTENER_METRICS_PORT", "9101"))
+
+LST_ENTRADA     = metricas.contador("pasarela_listener_mensajes_total", "Mensajes de canales configurados recibidos", ("channel", "tipo"))
+LST_PUBLICADOS  = metricas.contador("pasarela_listener_publicados_total", "Mensajes publicados en el stream", ("channel", "tipo"))
+LST_DESCARTADOS = metricas.contador("pasarela_listener_descartados_total", "Mensajes descartados antes de publicar", ("motivo",))
+LST_DURACION    = metricas.histograma("pasarela_listener_seconds", "Captura -> XADD dentro del listener (d_lst)")
+LST_META        = metricas.contador("pasarela_listener_canal_meta_total", "Metadatos de canal por evento: caché o get_chat()", ("origen",))
+LST_COLA_LLENA  = metricas.contador("pasarela_listener_cola_llena_total", "Capturas que esperaron por cola de publicación llena (backpressure)")
+LST_COLA_ESPERA = metricas.histograma("pasarela_listener_cola_espera_seconds", "Espera en la cola de publicación")
+LST_LOTE        = metricas.histograma("pasarela_listener_lote_publicacion", "Mensajes por round-trip de publicación",
+                                      buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500))
+metricas.gauge("pasarela_listener_cola_publicacion", "Capturas esperando a la tarea publicadora",
+               funcion=lambda: _COLA_PUB.qsize() if _COLA_PUB is not None else 0)
+LST_RECUPERADOS = metricas.contador("pasarela_listener_recuperados_total", "Mensajes recuperados de huecos por motivo (arranque|reconexion)", ("motivo",))
+LST_CONFIG      = metricas.contador("pasarela_listener_config_total", "Recargas de channels.json y canales validados/quitados", ("op",))
+LST_SPOOL       = metricas.contador("pasarela_listener_spool_total", "Mensajes por el spool local (guardado|drenado|duplicado)", ("op",))
+LST_SPOOL_RITMO = metricas.gauge("pasarela_listener_spool_drenaje_msg_s", "Ritmo del último drenado del spool (msg/s)")
+metricas.gauge("pasarela_listener_spool_profundidad", "Mensajes en el spool pendientes de publicar",
+               funcion=lambda: len(SPOOL) if SPOOL is not None else 0)
+REDIS_RTT       = metricas.histograma("pasarela_redis_rtt_seconds", "Round-trip de comandos Redis", ("op",))
 
 # ========= FILTRO DE MENSAJES ANTIGUOS =========
 # Ignorar mensajes más antiguos que X minutos desde el inicio del listener
@@ -73,7 +145,13 @@ def append_csv(row):
         csv.writer(f).writerow(row)
 
 def log(msg: str):
-    print(f"[listener] {datetime.now(timezone.utc).isoformat()} {msg}")
+    """Encola el mensaje en comun.logs (nivel según los marcadores ❌/[ERROR] y ⚠️/[WARNING] del texto)."""
+    if "❌" in msg or "[ERROR]" in msg:
+        _log.error(msg)
+    elif "⚠️" in msg or "[WARNING]" in msg:
+        _log.warning(msg)
+    else:
+        _log.info(msg)
 
 # ========= REDIS WATCHDOG (auto-restart) =========
 REDIS_SERVICE_NAME = os.getenv("REDIS_SERVICE_NAME", "Memurai")  # Nombre del servicio de Redis en Windows
@@ -178,50 +256,148 @@ async def check_and_restart_redis() -> bool:
         return False
 
 # ========= REDIS UTILS (async) =========
-async def get_or_set_rev_on_new(r: Redis, channel_id: int, msg_id: int) -> int:
-    rev_key = f"tg:rev:{channel_id}:{msg_id}"
-    await r.set(rev_key, 1, nx=True)
-    val = await r.get(rev_key)
-    try: return int(val or 1)
-    except: return 1
-
-async def next_rev_on_edit(r: Redis, channel_id: int, msg_id: int) -> int:
-    rev_key = f"tg:rev:{channel_id}:{msg_id}"
-    new_val = await r.incr(rev_key)
-    if new_val < 2:
-        await r.set(rev_key, 2)
-        return 2
-    return new_val
-
-async def dedup_once(r: Redis, channel_id: int, msg_id: int, revision: int) -> bool:
-    dkey = f"tg:dedup:{channel_id}:{msg_id}:{revision}"
-    ok = await r.set(dkey, "1", nx=True, ex=DEDUP_TTL_SEC)
-    return bool(ok)
-
-async def publish_to_stream(r: Redis, fields: dict):
+async def _rtt(op: str, coro):
+    """Espera la corrutina Redis y registra su round-trip en REDIS_RTT{op}."""
+    t = time.perf_counter()
+    try:
+        return await coro
+    finally:
+        REDIS_RTT.observe(time.perf_counter() - t, op)
+
+# ========= COLA DE PUBLICACIÓN (handlers -> tarea publicadora) =========
+# Los handlers de Telethon solo encolan; una tarea saca todo lo disponible (hasta PUB_LOTE_MAX) y lo
+# publica en un pipeline (un round-trip por lote). Con poca carga el lote es de 1: misma latencia que
+# publicar en el handler; en ráfagas, N mensajes por round-trip. Un solo consumidor = orden de captura.
+# Cola llena -> el handler espera (backpressure hacia Telethon) y se cuenta en LST_COLA_LLENA.
+_COLA_PUB = None        # asyncio.Queue, creada por iniciar_publicador()
+_FALLO_PUB = []         # RedisUnrecoverableError de la tarea publicadora (sin spool): main() la relanza
+_SEQ_IDEM = itertools.count()
+
+class Pendiente:
+    """Mensaje capturado a la espera de la tarea publicadora (o fila del spool al drenar)."""
+    __slots__ = ("tipo", "ch_id", "msg_id", "stream", "fields", "t0_ns", "t_cola", "idem", "spool_id")
+
+    def __init__(self, tipo: str, ch_id: int, msg_id: int, stream: str, fields: dict,
+                 t0_ns: int = None, idem: str = None, spool_id: int = None):
+        self.tipo, self.ch_id, self.msg_id, self.stream, self.fields = tipo, ch_id, msg_id, stream, fields
+        self.t0_ns = t0_ns
+        self.t_cola = time.perf_counter()
+        # Clave de idempotencia de la captura: reintentos y spool no publican dos veces
+        self.idem = idem or f"tg:idem:{ch_id}:{msg_id}:{fields.get('t_cap', '')}:{next(_SEQ_IDEM)}"
+        self.spool_id = spool_id
+
+    @property
+    def prio(self) -> bool:
+        return self.stream == PRIO_STREAM
+
+    def item(self):
+        return (self.stream, self.tipo, self.ch_id, self.msg_id, self.fields, self.idem)
+
+    def sellar_d_lst(self):
+        if self.t0_ns is not None:
+            self.fields["d_lst"] = f"{(time.perf_counter_ns() - self.t0_ns) / 1e6:.3f}"
+
+def iniciar_publicador(r: Redis) -> asyncio.Task:
+    """Crea la cola (en el bucle actual) y lanza la tarea publicadora."""
+    global _COLA_PUB
+    _COLA_PUB = asyncio.Queue(maxsize=PUB_COLA_MAX)
+    _FALLO_PUB.clear()
+    return asyncio.create_task(publicador(r))
+
+async def vaciar_cola():
+    """Espera a que la tarea publicadora haya procesado todo lo encolado."""
+    await _COLA_PUB.join()
+
+async def encolar(tipo: str, ch_id: int, msg_id: int, fields: dict, text: str, t0_ns: int = None):
+    """
+    Enruta (PARSE_STREAM o, si el texto parece gestión de posiciones, PRIO_STREAM) y encola.
+    El dep_id del prioritario (última entrada normal del canal) lo pone la tarea publicadora.
+    """
+    stream = PRIO_STREAM if PRIO_ENABLED and es_gestion(text) else PARSE_STREAM
+    p = Pendiente(tipo, ch_id, msg_id, stream, fields, t0_ns)
+    if _COLA_PUB.full():
+        LST_COLA_LLENA.inc()
+    await _COLA_PUB.put(p)
+
+async def publicador(r: Redis):
+    """Tarea publicadora: lotes de lo disponible en la cola, en orden de captura."""
+    while True:
+        lote = [await _COLA_PUB.get()]
+        while len(lote) < PUB_LOTE_MAX and not _COLA_PUB.empty():
+            lote.append(_COLA_PUB.get_nowait())
+        try:
+            for tramo in _tramos(lote):
+                await publish_to_stream(r, tramo)
+        except RedisUnrecoverableError as e:
+            # Sin spool: como antes, el listener se detiene (main() relanza el error)
+            _FALLO_PUB.append(e)
+            if client is not None:
+                await client.disconnect()
+        except Exception as e:
+            log(f"[ERROR] Publicando lote de {len(lote)} mensajes: {e}")
+        finally:
+            for _ in lote:
+                _COLA_PUB.task_done()
+        if _FALLO_PUB:
+            return
+
+def _tramos(lote: list):
+    """
+    Corta el lote antes de cada mensaje prioritario cuyo canal tiene una entrada normal antes en el
+    mismo tramo: su dep_id es el entry_id de esa entrada, que solo se conoce tras publicarla.
     """
-    Publica mensaje en Redis Stream con recuperación automática si Redis cae.
-    Si falla la inserción, verifica y reinicia Redis automáticamente, luego reintenta.
+    tramo, normales = [], set()
+    for p in lote:
+        if p.prio and p.ch_id in normales:
+            yield tramo
+            tramo, normales = [], set()
+        tramo.append(p)
+        if not p.prio:
+            normales.add(p.ch_id)
+    if tramo:
+        yield tramo
+
+async def publish_to_stream(r: Redis, tramo: list):
     """
+    Publica un tramo de mensajes en Redis Streams con recuperación automática si Redis cae.
+    Revisión, dedup, ts_redis_ingest y XADD de cada mensaje van en un script Lua (publicacion.py);
+    todo el tramo en un pipeline: un round-trip.
+    Si falla la inserción: con spool, el tramo queda en el spool local (idempotente: lo que llegó a
+    publicarse antes del corte no se repite); sin spool, verifica y reinicia Redis y reintenta.
+    """
+    for p in tramo:
+        if p.prio:
+            p.fields["dep_id"] = _ULTIMO_NORMAL.get(p.ch_id, "")
+    if SPOOL is not None and SPOOL.activo():
+        _a_spool(tramo)   # Redis caído o spool aún sin drenar: se respeta el orden
+        return
+
     max_retries = 2  # Intentos máximos de publicación (1 inicial + 1 después de reinicio)
     
     for attempt in range(max_retries):
         try:
-            # Intentar obtener timestamp de Redis
-            sec, micro = await r.time()
-            sec = int(sec); micro = int(micro)
-            dt = datetime.fromtimestamp(sec + micro / 1_000_000, tz=timezone.utc)
-            ts_redis_ingest = dt.isoformat(timespec="milliseconds").replace("+00:00", "Z")
-            to_send = dict(fields)
-            to_send["ts_redis_ingest"] = ts_redis_ingest
+            ahora = time.perf_counter()
+            for p in tramo:
+                p.sellar_d_lst()
+                LST_COLA_ESPERA.observe(ahora - p.t_cola)
             
             # Intentar insertar en stream
-            await r.xadd(PARSE_STREAM, to_send, maxlen=STREAM_MAXLEN, approximate=True)
+            resultados = await _rtt("publicar", publicar_varios(r, [p.item() for p in tramo],
+                                                               STREAM_MAXLEN, DEDUP_TTL_SEC))
+            LST_LOTE.observe(len(tramo))
+            for p, (rev, entry_id) in zip(tramo, resultados):
+                _publicado(p, rev, entry_id)
             return  # ✅ Éxito, salir
             
         except (ConnectionError, TimeoutError, redis.exceptions.ConnectionError, 
                 redis.exceptions.TimeoutError, OSError) as e:
             # Error de conexión - Redis puede estar caído
+            if SPOOL is not None:
+                # Con spool no se espera al watchdog: el tramo queda guardado y drenar_spool recupera Redis
+                log(f"[SPOOL] ⚠️  Error publicando en Redis: {e} → spool local hasta que vuelva")
+                SPOOL.caido = True
+                _a_spool(tramo)
+                return
             if attempt == 0:
                 # Primer intento falló, verificar y reiniciar Redis
                 log(f"[REDIS-WATCHDOG] ⚠️  Error publicando en Redis (intento {attempt + 1}): {e}")
@@ -247,287 +423,479 @@ async def publish_to_stream(r: Redis, fields: dict):
             log(f"[REDIS-WATCHDOG] ❌ Error no relacionado con conexión: {e}")
             raise  # Re-lanzar excepción
 
+def _publicado(p: Pendiente, rev: int, entry_id):
+    """Resultado de un mensaje del pipeline: duplicado, publicado en vivo o drenado del spool."""
+    _marcar(p)   # en Redis (publicado ahora o antes): la recuperación de huecos no lo vuelve a pedir
+    if entry_id is None:
+        if p.spool_id is None:
+            LST_DESCARTADOS.inc("duplicado")
+        else:
+            LST_SPOOL.inc("duplicado")
+        return
+    if not p.prio:
+        _ULTIMO_NORMAL[p.ch_id] = entry_id
+    if p.spool_id is not None:
+        LST_SPOOL.inc("drenado")
+        return
+    if p.t0_ns is not None:
+        LST_DURACION.observe((time.perf_counter_ns() - p.t0_ns) / 1e9)
+    _registrar(p, rev, p.stream)
+
+def _registrar(p: Pendiente, rev, destino: str):
+    f = p.fields
+    username, title = f.get("channel_username", ""), f.get("channel_title", "")
+    LST_PUBLICADOS.inc(username, p.tipo)
+    _log_evt.info(f"{p.tipo.upper()} | ch_id={p.ch_id} ({title or username}) msg_id={p.msg_id} rev={rev} → {destino}",
+                  extra={"tipo": p.tipo, "ch_id": p.ch_id, "msg_id": p.msg_id, "revision": rev})
+    if WRITE_CSV:
+        append_csv([p.tipo, p.ch_id, title, username, p.msg_id, rev, f.get("ts_utc", ""),
+                    f.get("sender_id", ""), f.get("text/raw", "")])
+
+def _marcar(p: Pendiente):
+    if MARCAS is not None and p.tipo == "new":
+        MARCAS.ver(p.ch_id, p.msg_id)
+
+def _a_spool(tramo: list):
+    for p in tramo:
+        p.sellar_d_lst()
+        SPOOL.agregar(p.tipo, p.ch_id, p.msg_id, p.stream, p.fields, p.idem)
+        _marcar(p)
+        LST_SPOOL.inc("guardado")
+        _registrar(p, "?", SPOOLADO)   # la revisión se asigna al drenar
+
+async def drenar(r: Redis) -> int:
+    """
+    Publica las filas del spool en orden de captura (idempotente por fila, por lotes) hasta vaciarlo;
+    vacío, vuelve al camino directo. Si Redis falla a medias, lo drenado queda borrado y el resto espera.
+    Devuelve cuántas filas se han sacado.
+    """
+    t0, n = time.perf_counter(), 0
+    try:
+        while True:
+            filas = SPOOL.primeras(SPOOL_LOTE)
+            if not filas:
+                SPOOL.caido = False      # sin await desde primeras(): ningún mensaje se encola entre medias
+                break
+            lote = [Pendiente(t, c, m, s, f, idem=k, spool_id=i) for i, t, c, m, s, k, f in filas]
+            for tramo in _tramos(lote):
+                for p in tramo:
+                    if p.prio:
+                        p.fields["dep_id"] = _ULTIMO_NORMAL.get(p.ch_id, "")   # su señal ya salió del spool
+                resultados = await _rtt("publicar", publicar_varios(r, [p.item() for p in tramo],
+                                                                   STREAM_MAXLEN, DEDUP_TTL_SEC))
+                for p, (rev, entry_id) in zip(tramo, resultados):
+                    _publicado(p, rev, entry_id)
+                SPOOL.borrar_hasta(tramo[-1].spool_id)
+                n += len(tramo)
+    except (ConnectionError, TimeoutError, redis.exceptions.ConnectionError,
+            redis.exceptions.TimeoutError, OSError) as e:
+        log(f"[SPOOL] ⚠️  Redis falló drenando: {e}")
+    if n:
+        seg = time.perf_counter() - t0
+        ritmo = n / seg if seg > 0 else 0.0
+        LST_SPOOL_RITMO.set(v=ritmo)
+        log(f"[SPOOL] {n} mensajes drenados en {seg:.2f}s ({ritmo:.0f} msg/s); quedan {len(SPOOL)}")
+    return n
+
+async def drenar_spool(r: Redis):
+    """Tarea de fondo: con spool pendiente, drena en cuanto Redis responde; si no responde, watchdog."""
+    ultimo_watchdog = 0.0
+    while True:
+        await asyncio.sleep(SPOOL_DRENAR_SEC)
+        if not SPOOL.activo():
+            continue
+        try:
+            await r.ping()
+        except Exception:
+            if time.monotonic() - ultimo_watchdog > 60:
+                ultimo_watchdog = time.monotonic()
+                log(f"[SPOOL] Redis no responde; {len(SPOOL)} mensajes en spool")
+                await check_and_restart_redis()
+            continue
+        await drenar(r)
+
+# ========= ENRUTADO NORMAL / PRIORITARIO =========
+_ULTIMO_NORMAL = {}   # ch_id -> último ID publicado por ese canal en el stream normal (solo la tarea publicadora)
+
 # ========= TELETHON CLIENT =========
-client = TelegramClient(session_name, api_id, api_hash)
+client = None   # TelegramClient, creado en main()
+
+class ClienteListener(TelegramClient):
+    """TelegramClient que, tras cada reconexión automática, lanza la recuperación de huecos."""
+    async def _handle_auto_reconnect(self):
+        # Gancho interno de Telethon (MTProtoSender auto_reconnect_callback); Telethon no hace catch-up aquí
+        await super()._handle_auto_reconnect()
+        asyncio.create_task(recuperar_huecos("reconexion"))
+
+def crear_cliente() -> TelegramClient:
+    api_id   = int(_must("TELEGRAM_API_ID"))                # (PATCH) antes: valor por defecto hardcodeado
+    api_hash = _must("TELEGRAM_API_HASH")                   # (PATCH)
+    return ClienteListener(sesiones.sesion("listener", session_name), api_id, api_hash)
 
 # ========= CHANNEL CONFIGURATION =========
+# Conjunto activo (lo consultan los handlers): se sustituye entero, sin await entre las tres asignaciones,
+# así un evento nunca ve un CHANNEL_IDS nuevo con el CHANNEL_CONFIG / CANALES_META del anterior.
 CHANNEL_IDS = set()
 CHANNEL_CONFIG = {}  # {channel_id: {title, username, include_linked}}
 CONFIG_FILE = os.getenv("CHANNELS_CONFIG", str(Path(__file__).resolve().parents[1].parent / "config" / "channels.json"))
-CONFIG_FILE_MTIME = 0
+CONFIG_INOTIFY    = os.getenv("CONFIG_INOTIFY", "1") == "1"          # 0 = forzar sondeo también en Linux
+CONFIG_SONDEO_SEC = float(os.getenv("CONFIG_SONDEO_SEC", "2"))       # sondeo del archivo sin inotify (Windows)
+
+# Canales del archivo ya validados: cid -> {"config", "meta", "linked"}. Una recarga solo resuelve
+# los añadidos, los que cambian de configuración y los que aún no se habían podido validar; y los
+# resuelve contra la caché de entidades compartida (comun/entidades.py): en frío no hace falta
+# recorrer diálogos, solo se consulta Telegram por lo caducado o desconocido.
+_VALIDADOS = {}
+CACHE_ENT = None   # entidades.CacheEntidades (ENTIDADES_DB), se abre con la primera validación
 
 def load_channels_from_file():
-    """Carga canales desde archivo JSON de configuración."""
-    global CHANNEL_IDS, CHANNEL_CONFIG, CONFIG_FILE_MTIME
-    
+    """Lee canales habilitados del archivo JSON de configuración: {cid: config}; None si falta o es inválido."""
     config_path = Path(CONFIG_FILE)
     
     if not config_path.exists():
         log(f"[CONFIG] Archivo no encontrado: {CONFIG_FILE}")
         log(f"[CONFIG] Ejecuta 'python list_channels.py' para generar el archivo de configuración.")
-        return False
+        return None
     
     try:
-        # Verificar si el archivo cambió
-        current_mtime = config_path.stat().st_mtime
-        if current_mtime == CONFIG_FILE_MTIME:
-            return True  # Sin cambios, no recargar
-        CONFIG_FILE_MTIME = current_mtime
-        
         with open(config_path, "r", encoding="utf-8") as f:
             config = json.load(f)
         
-        new_ids = set()
         new_config = {}
-        enabled_count = 0
         
         for ch in config.get("channels", []):
             if not ch.get("enabled", True):
                 continue
             
             cid = int(ch["id"])
-            new_ids.add(cid)
             new_config[cid] = {
                 "title": ch.get("title", ""),
                 "username": ch.get("username", ""),
                 "include_linked": ch.get("include_linked", False)
             }
-            enabled_count += 1
-            
-            # Incluir linked_chat_id si está configurado
-            if ch.get("include_linked", False):
-                # Necesitamos obtener el linked_id del canal real
-                # Lo haremos en validación async
-                pass
-        
-        CHANNEL_IDS = new_ids
-        CHANNEL_CONFIG = new_config
-        
-        log(f"[CONFIG] {enabled_count} canales cargados desde {CONFIG_FILE}")
-        for cid, info in list(new_config.items())[:10]:  # Mostrar primeros 10
-            log(f"    • {cid} → {info['title'] or info['username'] or 'N/A'}")
-        if len(new_config) > 10:
-            log(f"    ... y {len(new_config) - 10} más")
         
-        return True
+        log(f"[CONFIG] {len(new_config)} canales cargados desde {CONFIG_FILE}")
+        return new_config
         
     except json.JSONDecodeError as e:
         log(f"[ERROR] JSON inválido en {CONFIG_FILE}: {e}")
-        return False
+        return None
     except Exception as e:
         log(f"[ERROR] Error cargando configuración: {e}")
-        return False
+        return None
 
-async def validate_and_enrich_channels():
-    """Valida que los canales existen y añade linked_chat_id si está configurado."""
-    global CHANNEL_IDS, CHANNEL_CONFIG
-    
-    if not CHANNEL_IDS:
-        return
+def _cache_entidades() -> entidades.CacheEntidades:
+    global CACHE_ENT
+    if CACHE_ENT is None:
+        CACHE_ENT = entidades.CacheEntidades()
+    return CACHE_ENT
+
+async def validate_and_enrich_channels(new_config: dict):
+    """
+    Valida los canales de new_config (incremental: solo se resuelven los nuevos o cambiados, vía caché de
+    entidades), añade linked_chat_id si está configurado y sustituye de una vez CHANNEL_IDS / CHANNEL_CONFIG /
+    CANALES_META.
+    """
+    global CHANNEL_IDS, CHANNEL_CONFIG, CANALES_META, _VALIDADOS
     
-    validated_ids = set()
-    validated_config = {}
+    pendientes = [cid for cid, config in new_config.items()
+                  if cid not in _VALIDADOS or _VALIDADOS[cid]["config"] != config]
+    quitados = [cid for cid in _VALIDADOS if cid not in new_config]
+    cache = _cache_entidades()
+    ents = await entidades.resolver_canales(client, cache, pendientes) if pendientes else {}
     
-    async for d in client.iter_dialogs():
-        ent = d.entity
-        if not isinstance(ent, Channel) or getattr(ent, "left", False):
-            continue
-        
-        cid = int(ent.id)
-        if cid not in CHANNEL_IDS:
+    validados = {cid: v for cid, v in _VALIDADOS.items() if cid in new_config and cid not in pendientes}
+    missing = []
+    for cid in pendientes:
+        ent = ents.get(cid)
+        if ent is None or ent.tipo != entidades.CANAL or ent.left:
+            missing.append(cid)
             continue
-        
-        # Canal encontrado y válido
-        validated_ids.add(cid)
-        config = CHANNEL_CONFIG.get(cid, {})
-        validated_config[cid] = config.copy()
-        
-        # Si include_linked está activo, añadir el linked_chat_id
-        if config.get("include_linked", False):
-            linked_id = getattr(ent, "linked_chat_id", None)
-            if linked_id:
-                lid = int(linked_id)
-                validated_ids.add(lid)
-                validated_config[lid] = {
-                    "title": f"{config.get('title', '')} [linked]",
-                    "username": config.get("username", ""),
-                    "include_linked": False
-                }
+        config = new_config[cid]
+        # Si include_linked está activo, añadir el linked_chat_id (GetFullChannel solo si la caché no lo sabe)
+        linked_id = await entidades.enlazado(client, cache, ent) if config.get("include_linked", False) else None
+        validados[cid] = {"config": config, "meta": meta_canal(ent, config),
+                          "linked": int(linked_id) if linked_id else None}
     
     # Verificar canales no encontrados
-    missing = CHANNEL_IDS - validated_ids
     if missing:
         log(f"[WARNING] {len(missing)} canales no encontrados o sin acceso:")
         for cid in missing:
-            config = CHANNEL_CONFIG.get(cid, {})
-            log(f"    • {cid} → {config.get('title', 'N/A')}")
+            log(f"    • {cid} → {new_config[cid].get('title', 'N/A')}")
     
+    validated_ids = set()
+    validated_config = {}
+    validated_meta = {}
+    for cid, v in validados.items():
+        config = v["config"]
+        validated_ids.add(cid)
+        validated_config[cid] = config.copy()
+        validated_meta[cid] = v["meta"]
+        if v["linked"]:
+            lid = v["linked"]
+            validated_ids.add(lid)
+            validated_config[lid] = {
+                "title": f"{config.get('title', '')} [linked]",
+                "username": config.get("username", ""),
+                "include_linked": False
+            }
+            if lid in CANALES_META:
+                validated_meta[lid] = CANALES_META[lid]   # los linked chats se cachean con su primer evento
+    
+    # Sustitución atómica respecto a los handlers (mismo bucle, sin await entre medias)
+    _VALIDADOS = validados
     CHANNEL_IDS = validated_ids
     CHANNEL_CONFIG = validated_config
+    CANALES_META = validated_meta
     
-    if validated_ids:
-        log(f"[CONFIG] {len(validated_ids)} canales validados y activos")
+    LST_CONFIG.inc("validados", n=len(pendientes) - len(missing))
+    LST_CONFIG.inc("quitados", n=len(quitados))
+    log(f"[CONFIG] {len(validated_ids)} canales activos (consultados {len(pendientes)}, "
+        f"sin acceso {len(missing)}, quitados {len(quitados)})")
+    for cid in pendientes[:10]:  # Mostrar primeros 10
+        if cid in validados:
+            info = validados[cid]["config"]
+            log(f"    • {cid} → {info['title'] or info['username'] or 'N/A'}")
+    if len(pendientes) > 10:
+        log(f"    ... y {len(pendientes) - 10} más")
+
+async def vigilar_config():
+    """Hot-reload: recarga y valida channels.json en cuanto cambia (inotify o sondeo)."""
+    async for _ in vigilancia.cambios(CONFIG_FILE, CONFIG_SONDEO_SEC, inotify=CONFIG_INOTIFY):
+        LST_CONFIG.inc("recargas")
+        try:
+            new_config = load_channels_from_file()
+            if new_config is not None:
+                await validate_and_enrich_channels(new_config)
+        except Exception as e:
+            log(f"[ERROR] Recarga de configuración: {e}")   # se mantiene el conjunto activo anterior
+
+# ========= CACHÉ DE METADATOS DE CANAL =========
+# ch_id -> {"title", "username", "valido"}: se rellena en validate_and_enrich_channels (entidades ya
+# resueltas) y se renueva en cada recarga. Los handlers solo esperan a get_chat() para un canal aún no cacheado
+# (p.ej. un linked chat o un canal añadido entre recargas) y lo guardan para los siguientes eventos.
+CANALES_META = {}
+
+def meta_canal(ent, config: dict = None) -> dict:
+    """Metadatos de una entidad de Telegram (username con fallback al archivo de configuración)."""
+    es_canal = isinstance(ent, Channel) or getattr(ent, "tipo", None) == entidades.CANAL   # Telethon o caché
+    valido = (es_canal and not getattr(ent, "left", False)
+              and bool(getattr(ent, "broadcast", False) or getattr(ent, "megagroup", False)))
+    return {
+        "title": getattr(ent, "title", "") or "",
+        # Fallback: usar username del archivo de configuración si el canal no tiene username en Telegram
+        "username": getattr(ent, "username", "") or (config or {}).get("username", ""),
+        "valido": valido,
+    }
+
+def ch_id_evento(event) -> int:
+    """id POSITIVO del chat a partir del id marcado del evento (-100… en canales), sin red."""
+    try:
+        return resolve_id(int(event.chat_id or 0))[0]
+    except (TypeError, ValueError):
+        return 0
+
+async def meta_canal_evento(event, ch_id: int) -> dict:
+    meta = CANALES_META.get(ch_id)
+    if meta is not None:
+        LST_META.inc("cache")
+        return meta
+    LST_META.inc("get_chat")
+    meta = CANALES_META[ch_id] = meta_canal(await event.get_chat(), CHANNEL_CONFIG.get(ch_id))
+    return meta
+
+# ========= HANDLERS =========
+def _antiguo(fecha) -> bool:
+    """Filtrar mensajes antiguos para evitar atasco (los huecos se recuperan aparte, con su propio límite)."""
+    if not fecha:
+        return False
+    msg_time = fecha.replace(tzinfo=timezone.utc) if fecha.tzinfo is None else fecha
+    age_minutes = (datetime.now(timezone.utc) - msg_time).total_seconds() / 60
+    return age_minutes > MESSAGE_AGE_LIMIT_MINUTES
+
+async def _capturar(tipo: str, ch_id: int, meta: dict, msg, fecha, t_cap: int, t0_ns: int, recuperado: bool = False):
+    """Exclusiones y vacío, campos del stream y a la cola de publicación (vivo y recuperado)."""
+    title, username = meta["title"], meta["username"]
+    if username in EXCLUDE_USERNAMES or title in EXCLUDE_TITLES:
+        LST_DESCARTADOS.inc("excluido")
+        return False
+
+    text = (msg.message or "").replace("\r", " ").strip()
+    if not text:
+        LST_DESCARTADOS.inc("vacio")
+        return False
+
+    LST_ENTRADA.inc(username, tipo)
+    fields = {
+        "type": tipo,
+        "channel_id": ch_id,
+        "channel_username": username,
+        "channel_title": title,
+        "msg_id": msg.id,
+        "ts_utc": utc_iso(fecha),
+        "sender_id": str(msg.sender_id or ""),
+        "text/raw": text,
+        "estado_operacion": "0",
+        "reply_to": msg.reply_to_msg_id or "",   # respuesta a una señal -> el parser la enlaza (ref_oid)
+        "t_cap": t_cap
+    }
+    if recuperado:
+        fields["recuperado"] = "1"
+    await encolar(tipo, ch_id, msg.id, fields, text, t0_ns)
+    return True
+
+# ==== NEW MESSAGE ====
+async def on_new(event: events.NewMessage.Event):
+    """Mensaje nuevo: filtros (canal, antigüedad, exclusiones, vacío) y a la cola de publicación."""
+    # Trazado: hora de captura (pared, epoch ms) + reloj monótono para d_lst
+    t_cap, t0_ns = time.time_ns() // 1_000_000, time.perf_counter_ns()
+    # Filtro por id numérico antes que nada (sin red)
+    ch_id = ch_id_evento(event)
+    if ch_id not in CHANNEL_IDS:
+        return
+    msg = event.message
+    if _antiguo(msg.date):
+        # Mensaje demasiado antiguo, ignorar silenciosamente
+        LST_DESCARTADOS.inc("antiguo")
+        return
+
+    meta = await meta_canal_evento(event, ch_id)
+    if not meta["valido"]:
+        return
+    await _capturar("new", ch_id, meta, msg, msg.date, t_cap, t0_ns)
+
+# ==== MESSAGE EDITED ====
+async def on_edit(event: events.MessageEdited.Event):
+    """Mensaje editado: como on_new (la tarea publicadora le asigna la siguiente revisión), con la hora de edición."""
+    # Trazado: hora de captura (pared, epoch ms) + reloj monótono para d_lst
+    t_cap, t0_ns = time.time_ns() // 1_000_000, time.perf_counter_ns()
+    # Filtro por id numérico antes que nada (sin red)
+    ch_id = ch_id_evento(event)
+    if ch_id not in CHANNEL_IDS:
+        return
+    msg = event.message
+    if _antiguo(msg.edit_date or msg.date):
+        # Mensaje demasiado antiguo, ignorar silenciosamente
+        LST_DESCARTADOS.inc("antiguo")
+        return
+
+    meta = await meta_canal_evento(event, ch_id)
+    if not meta["valido"]:
+        return
+    await _capturar("edit", ch_id, meta, msg, msg.edit_date or msg.date, t_cap, t0_ns)
+
+# ==== HUECOS TRAS RECONEXIÓN / REINICIO ====
+def _peer(ch_id: int):
+    """InputPeer desde la caché de entidades (sin tocar la sesión); si no, PeerChannel."""
+    e = CACHE_ENT.obtener(ch_id) if CACHE_ENT is not None else None
+    if e is not None and e.access_hash is not None:
+        return e.input_peer()
+    return types.PeerChannel(ch_id)
+
+async def recuperar_canal(ch_id: int, marca: int, desde: datetime) -> int:
+    """Mensajes del canal con id > marca y fecha >= desde, en orden; a la cola como recuperados."""
+    meta = CANALES_META.get(ch_id)
+    if meta is None:
+        config = CHANNEL_CONFIG.get(ch_id, {})
+        meta = {"title": config.get("title", ""), "username": config.get("username", ""), "valido": True}
+    n = 0
+    async for msg in client.iter_messages(_peer(ch_id), limit=RECUPERAR_MAX_MSG, min_id=marca,
+                                          offset_date=desde, reverse=True):
+        if getattr(msg, "action", None) is not None:
+            continue   # mensajes de servicio (fijado, cambio de título…)
+        if await _capturar("new", ch_id, meta, msg, msg.date, time.time_ns() // 1_000_000,
+                           time.perf_counter_ns(), recuperado=True):
+            n += 1
+    return n
+
+async def recuperar_huecos(motivo: str) -> int:
+    """Recupera, en paralelo por canal (RECUPERAR_CONCURRENCIA), lo publicado desde la marca de cada canal."""
+    if MARCAS is None or client is None:
+        return 0
+    t0 = time.perf_counter()
+    desde = datetime.now(timezone.utc) - timedelta(minutes=RECUPERAR_MAX_MIN)
+    canales = [(cid, MARCAS.get(cid)) for cid in CHANNEL_IDS]
+    canales = [(cid, marca) for cid, marca in canales if marca is not None]
+    sem = asyncio.Semaphore(RECUPERAR_CONCURRENCIA)
+
+    async def _uno(cid, marca):
+        async with sem:
+            try:
+                return await recuperar_canal(cid, marca, desde)
+            except Exception as e:
+                log(f"[RECUPERACION] ⚠️  Canal {cid}: {e}")
+                return 0
+
+    n = sum(await asyncio.gather(*(_uno(cid, marca) for cid, marca in canales)))
+    LST_RECUPERADOS.inc(motivo, n=n)
+    log(f"[RECUPERACION] {motivo}: {n} mensajes recuperados de {len(canales)} canales "
+        f"en {time.perf_counter() - t0:.1f}s (máx. {RECUPERAR_MAX_MIN:.0f} min)")
+    return n
+
+async def guardar_marcas():
+    while True:
+        await asyncio.sleep(MARCAS_GUARDAR_SEC)
+        try:
+            MARCAS.guardar()
+        except Exception as e:
+            log(f"[ERROR] Guardando marcas de agua: {e}")
 
 # ========= MAIN =========
 async def main():
+    global client, SPOOL, MARCAS
+    client = crear_cliente()
     r: Redis = Redis.from_url(REDIS_URL, decode_responses=True)
+    if SPOOL_ENABLED:
+        os.makedirs(os.path.dirname(os.path.abspath(SPOOL_PATH)), exist_ok=True)
+        SPOOL = Spool(SPOOL_PATH)
+        log(f"[SPOOL] {SPOOL_PATH} ({len(SPOOL)} mensajes pendientes de una ejecución anterior)")
+        asyncio.create_task(drenar_spool(r))
+    if MARCAS_ENABLED:
+        os.makedirs(os.path.dirname(os.path.abspath(MARCAS_PATH)), exist_ok=True)
+        MARCAS = MarcasAgua(MARCAS_PATH)
+        log(f"[RECUPERACION] Marcas de agua en {MARCAS_PATH} ({len(MARCAS)} canales)")
     await client.start(phone=phone)
 
     if WRITE_CSV:
         ensure_csv_header(CSV_PATH)
 
     # Cargar configuración inicial
-    if not load_channels_from_file():
+    new_config = load_channels_from_file()
+    if new_config is None:
         log("[ERROR] No se pudo cargar configuración. Verifica el archivo channels.json")
         return
     
-    await validate_and_enrich_channels()
+    await validate_and_enrich_channels(new_config)
     
     if not CHANNEL_IDS:
         log("[ERROR] Ningún canal válido encontrado. Verifica tu configuración.")
         return
     
-    log(f"Publicando mensajes de {len(CHANNEL_IDS)} canales en Redis Stream: {PARSE_STREAM}")
+    log(f"Publicando mensajes de {len(CHANNEL_IDS)} canales en Redis Stream: {PARSE_STREAM}"
+        + (f" (gestión de posiciones → {PRIO_STREAM})" if PRIO_ENABLED else ""))
     log(f"CSV={'ON' if WRITE_CSV else 'OFF'}. Ctrl+C para salir.")
     log(f"[FILTRO] Ignorando mensajes más antiguos de {MESSAGE_AGE_LIMIT_MINUTES} minutos para evitar atasco")
+    if metricas.servir(LISTENER_METRICS_PORT, METRICS_HOST):
+        log(f"[METRICAS] http://{METRICS_HOST}:{LISTENER_METRICS_PORT}/metrics")
 
-    # Hot-reload: recargar configuración periódicamente
-    async def periodic_refresh():
-        while True:
-            await asyncio.sleep(600)  # cada 10 minutos verificar cambios
-            if load_channels_from_file():
-                await validate_and_enrich_channels()
-                log(f"[CONFIG] Recarga automática completada. {len(CHANNEL_IDS)} canales activos.")
-    
-    asyncio.create_task(periodic_refresh())
-
-    # ==== NEW MESSAGE ====
-    @client.on(events.NewMessage())
-    async def on_new(event: events.NewMessage.Event):
-        # Filtrar mensajes antiguos para evitar atasco
-        msg = event.message
-        if msg.date:
-            msg_time = msg.date.replace(tzinfo=timezone.utc) if msg.date.tzinfo is None else msg.date
-            now = datetime.now(timezone.utc)
-            age_minutes = (now - msg_time).total_seconds() / 60
-            if age_minutes > MESSAGE_AGE_LIMIT_MINUTES:
-                # Mensaje demasiado antiguo, ignorar silenciosamente
-                return
-        
-        chat = await event.get_chat()
-        # id POSITIVO del canal
-        ch_id = int(getattr(chat, "id", 0)) if isinstance(chat, Channel) else int(event.chat_id or 0)
-        if not isinstance(chat, Channel) or getattr(chat, "left", False):
-            return
-        if not (chat.broadcast or chat.megagroup):
-            return
-        if ch_id not in CHANNEL_IDS:
-            return
-
-        title    = getattr(chat, "title", "") or ""
-        username = getattr(chat, "username", "") or ""
-        # Fallback: usar username del archivo de configuración si el canal no tiene username en Telegram
-        if not username:
-            config_username = CHANNEL_CONFIG.get(ch_id, {}).get("username", "")
-            if config_username:
-                username = config_username
-        if username in EXCLUDE_USERNAMES or title in EXCLUDE_TITLES:
-            return
+    # Hot-reload: recargar configuración en cuanto cambia el archivo
+    log(f"[CONFIG] Vigilando {CONFIG_FILE} ({vigilancia.modo(CONFIG_INOTIFY)})")
+    asyncio.create_task(vigilar_config())
 
-        text = (msg.message or "").replace("\r", " ").strip()
-        if not text:
-            return
+    # Handlers (a nivel de módulo: fake_telegram.py los llama con eventos simulados); solo encolan
+    iniciar_publicador(r)
+    client.add_event_handler(on_new, events.NewMessage())
+    client.add_event_handler(on_edit, events.MessageEdited())
 
-        rev = await get_or_set_rev_on_new(r, ch_id, msg.id)
-        if not await dedup_once(r, ch_id, msg.id, rev):
-            return
-
-        fields = {
-            "type": "new",
-            "channel_id": ch_id,
-            "channel_username": username,
-            "channel_title": title,
-            "msg_id": msg.id,
-            "revision": rev,
-            "ts_utc": utc_iso(msg.date),
-            "sender_id": str(msg.sender_id or ""),
-            "text/raw": text,
-            "estado_operacion": "0"
-        }
-        try:
-            await publish_to_stream(r, fields)
-            log(f"NEW | ch_id={ch_id} ({title or username}) msg_id={msg.id} rev={rev} → {PARSE_STREAM}")
-            if WRITE_CSV:
-                append_csv(["new", ch_id, title, username, msg.id, rev, utc_iso(msg.date), str(msg.sender_id or ""), text])
-        except RedisUnrecoverableError:
-            # Redis no se pudo recuperar - detener listener
-            raise
-
-    # ==== MESSAGE EDITED ====
-    @client.on(events.MessageEdited())
-    async def on_edit(event: events.MessageEdited.Event):
-        # Filtrar mensajes antiguos para evitar atasco
-        msg = event.message
-        edit_time = msg.edit_date or msg.date
-        if edit_time:
-            msg_time = edit_time.replace(tzinfo=timezone.utc) if edit_time.tzinfo is None else edit_time
-            now = datetime.now(timezone.utc)
-            age_minutes = (now - msg_time).total_seconds() / 60
-            if age_minutes > MESSAGE_AGE_LIMIT_MINUTES:
-                # Mensaje demasiado antiguo, ignorar silenciosamente
-                return
-        
-        chat = await event.get_chat()
-        ch_id = int(getattr(chat, "id", 0)) if isinstance(chat, Channel) else int(event.chat_id or 0)
-        if not isinstance(chat, Channel) or getattr(chat, "left", False):
-            return
-        if not (chat.broadcast or chat.megagroup):
-            return
-        if ch_id not in CHANNEL_IDS:
-            return
-
-        title    = getattr(chat, "title", "") or ""
-        username = getattr(chat, "username", "") or ""
-        # Fallback: usar username del archivo de configuración si el canal no tiene username en Telegram
-        if not username:
-            config_username = CHANNEL_CONFIG.get(ch_id, {}).get("username", "")
-            if config_username:
-                username = config_username
-        if username in EXCLUDE_USERNAMES or title in EXCLUDE_TITLES:
-            return
-
-        text = (msg.message or "").replace("\r", " ").strip()
-        if not text:
-            return
-
-        rev = await next_rev_on_edit(r, ch_id, msg.id)
-        if not await dedup_once(r, ch_id, msg.id, rev):
-            return
-
-        fields = {
-            "type": "edit",
-            "channel_id": ch_id,
-            "channel_username": username,
-            "channel_title": title,
-            "msg_id": msg.id,
-            "revision": rev,
-            "ts_utc": utc_iso(msg.edit_date or msg.date),
-            "sender_id": str(msg.sender_id or ""),
-            "text/raw": text,
-            "estado_operacion": "0"
-        }
-        try:
-            await publish_to_stream(r, fields)
-            log(f"EDIT | ch_id={ch_id} ({title or username}) msg_id={msg.id} rev={rev} → {PARSE_STREAM}")
-            if WRITE_CSV:
-                append_csv(["edit", ch_id, title, username, msg.id, rev,
-                            utc_iso(msg.edit_date or msg.date), str(msg.sender_id or ""), text])
-        except RedisUnrecoverableError:
-            # Redis no se pudo recuperar - detener listener
-            raise
+    # Lo publicado mientras el listener estaba parado (desde la marca de agua de cada canal)
+    if MARCAS is not None:
+        asyncio.create_task(guardar_marcas())
+        asyncio.create_task(recuperar_huecos("arranque"))
 
     try:
         await client.run_until_disconnected()
+        if _FALLO_PUB:
+            raise _FALLO_PUB[0]
     except RedisUnrecoverableError as e:
         # Redis no se pudo recuperar - detener listener con mensaje claro
         log("")
@@ -547,6 +915,9 @@ async def main():
         log("=" * 80)
         log("")
         raise SystemExit(1)
+    finally:
+        if MARCAS is not None:
+            MARCAS.guardar()
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# marcas.py — último msg_id publicado por canal (marca de agua), persistente en SQLite
+# - Tras una reconexión o un reinicio, el listener pide a Telegram solo los mensajes con id > marca
+#   (recuperación de huecos en listener.py); sin marca no hay hueco que calcular.
+# - La marca avanza cuando un mensaje nuevo llega a Redis (o al spool), no al capturarlo: lo que se
+#   perdiera en la cola de publicación al caer el proceso vuelve a pedirse.
+# - En memoria por mensaje; a disco cada MARCAS_GUARDAR_SEC (un UPSERT por canal cambiado) y al cerrar.
+# - Se usa desde el bucle asyncio del listener (un solo hilo).
+
+import sqlite3
+import time
+
+TABLA = "Marcas"
+
+
+class MarcasAgua:
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        self._con = sqlite3.connect(ruta, isolation_level=None)
+        self._con.execute("PRAGMA journal_mode=WAL;")
+        self._con.execute("PRAGMA synchronous=NORMAL;")
+        self._con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {TABLA}(
+            ch_id INTEGER PRIMARY KEY,
+            msg_id INTEGER NOT NULL,
+            ts_ms INTEGER NOT NULL
+        )
+        """)
+        self._marcas = dict(self._con.execute(f"SELECT ch_id, msg_id FROM {TABLA}").fetchall())
+        self._sucias = set()
+
+    def __len__(self):
+        return len(self._marcas)
+
+    def get(self, ch_id: int):
+        return self._marcas.get(int(ch_id))
+
+    def ver(self, ch_id: int, msg_id: int):
+        """Mensaje nuevo ya publicado: la marca solo avanza."""
+        ch_id, msg_id = int(ch_id), int(msg_id)
+        if msg_id > self._marcas.get(ch_id, 0):
+            self._marcas[ch_id] = msg_id
+            self._sucias.add(ch_id)
+
+    def guardar(self) -> int:
+        if not self._sucias:
+            return 0
+        ahora = int(time.time() * 1000)
+        filas = [(c, self._marcas[c], ahora) for c in self._sucias]
+        self._con.execute("BEGIN")
+        self._con.executemany(f"""
+        INSERT INTO {TABLA}(ch_id, msg_id, ts_ms) VALUES (?,?,?)
+        ON CONFLICT(ch_id) DO UPDATE SET msg_id = MAX(msg_id, excluded.msg_id), ts_ms = excluded.ts_ms
+        """, filas)
+        self._con.execute("COMMIT")
+        self._sucias.clear()
+        return len(filas)
+
+    def cerrar(self):
+        self.guardar()
+        self._con.close()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# migrar_dedup.py — pasa las claves por mensaje tg:rev:{ch}:{msg} + tg:dedup:{ch}:{msg}:{rev} al esquema
+#                   por canal de publicacion.py (tg:revs:{ch} hash + tg:vistos:{ch} zset)
+# - Revisión: la de tg:rev. Momento de la revisión: se deduce del TTL que le queda a su tg:dedup
+#   (ahora - (ttl - restante)), así caduca en el esquema nuevo cuando habría caducado en el antiguo.
+# - Sin tg:dedup vigente el mensaje no se migra: en los dos esquemas un 'new' volvería a publicarse.
+# - No pisa lo que el script nuevo ya haya escrito (HSETNX / ZADD NX), pero lo normal es migrar con el
+#   listener parado.
+# - Por defecto solo simula; con --aplicar escribe y borra TODAS las tg:rev:* y tg:dedup:* antiguas.
+#
+# Uso:
+#   python migrar_dedup.py                      # simulación sobre REDIS_URL
+#   python migrar_dedup.py --aplicar
+#   python migrar_dedup.py --redis redis://127.0.0.1:6379/0 --ttl 1296000 --aplicar
+
+import os, sys, time, argparse
+
+# --- PATH robusto para imports locales ---
+LISTENER_DIR = os.path.dirname(os.path.abspath(__file__))                   # .../services/src/listener
+PARENT_DIR   = os.path.dirname(LISTENER_DIR)                                # .../services/src
+for _p in (LISTENER_DIR, PARENT_DIR):
+    if _p not in sys.path:
+        sys.path.insert(0, _p)
+
+from publicacion import REVS_PREFIJO, VISTOS_PREFIJO
+
+REDIS_URL     = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+DEDUP_TTL_SEC = int(os.getenv("DEDUP_TTL", str(15*24*3600)))   # el mismo que usa el listener
+LOTE          = 500
+
+
+def _txt(v) -> str:
+    return v.decode() if isinstance(v, bytes) else str(v)
+
+
+def _escanear(r, patron: str):
+    for k in r.scan_iter(match=patron, count=1000):
+        yield _txt(k)
+
+
+def _borrar(r, claves: list) -> int:
+    n = 0
+    for i in range(0, len(claves), LOTE):
+        n += r.delete(*claves[i:i + LOTE])
+    return n
+
+
+def migrar(r, ttl: int = DEDUP_TTL_SEC, aplicar: bool = False) -> dict:
+    """Devuelve el resumen {antiguas, migrados, caducados, canales, borradas}."""
+    ahora = int(r.time()[0])
+    antiguas = [k for k in _escanear(r, "tg:rev:*") if len(k.split(":")) == 4]
+    res = {"antiguas": len(antiguas), "migrados": 0, "caducados": 0, "canales": 0, "borradas": 0}
+    canales = set()
+    for i in range(0, len(antiguas), LOTE):
+        tramo = antiguas[i:i + LOTE]
+        revs = r.mget(tramo)
+        pipe = r.pipeline(transaction=False)
+        for clave, rev in zip(tramo, revs):
+            _, _, ch, msg = clave.split(":")
+            pipe.pttl(f"tg:dedup:{ch}:{msg}:{_txt(rev) if rev is not None else 0}")
+        restantes = pipe.execute()
+        pipe = r.pipeline(transaction=False)
+        for clave, rev, pttl in zip(tramo, revs, restantes):
+            _, _, ch, msg = clave.split(":")
+            if rev is None or pttl == -2:
+                res["caducados"] += 1
+                continue
+            visto = ahora if pttl == -1 else ahora - ttl + pttl // 1000
+            res["migrados"] += 1
+            canales.add(ch)
+            pipe.hsetnx(f"{REVS_PREFIJO}{ch}", msg, int(_txt(rev)))
+            pipe.zadd(f"{VISTOS_PREFIJO}{ch}", {msg: visto}, nx=True)
+        if aplicar:
+            pipe.execute()
+    res["canales"] = len(canales)
+    if aplicar:
+        pipe = r.pipeline(transaction=False)
+        for ch in canales:
+            pipe.expire(f"{REVS_PREFIJO}{ch}", ttl)
+            pipe.expire(f"{VISTOS_PREFIJO}{ch}", ttl)
+        pipe.execute()
+        res["borradas"] = _borrar(r, antiguas) + _borrar(r, list(_escanear(r, "tg:dedup:*")))
+    return res
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Migra tg:rev:*/tg:dedup:* por mensaje a tg:revs:*/tg:vistos:* por canal.")
+    ap.add_argument("--redis", default=REDIS_URL)
+    ap.add_argument("--ttl", type=int, default=DEDUP_TTL_SEC, help="DEDUP_TTL del listener (segundos)")
+    ap.add_argument("--aplicar", action="store_true", help="Escribir y borrar las claves antiguas (si no, simula)")
+    args = ap.parse_args()
+
+    import redis
+    r = redis.Redis.from_url(args.redis)
+    t0 = time.perf_counter()
+    res = migrar(r, args.ttl, args.aplicar)
+    modo = "aplicado" if args.aplicar else "simulación"
+    print(f"[migrar_dedup] {modo}: {res['antiguas']} claves tg:rev antiguas → {res['migrados']} mensajes en "
+          f"{res['canales']} canales, {res['caducados']} ya caducados; {res['borradas']} claves borradas "
+          f"({time.perf_counter() - t0:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
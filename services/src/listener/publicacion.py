@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# publicacion.py — publicación de un mensaje capturado en UN round-trip a Redis (script Lua)
+# - Antes: SET NX + GET (o INCR [+ SET]) para la revisión, SET NX EX de dedup, TIME y XADD: hasta 5 RTT.
+# - El script hace lo mismo en el servidor, atómico (sin carreras entre dos eventos del mismo mensaje):
+#     1) revisión + dedup, dos claves por canal (no dos por mensaje):
+#          tg:revs:{ch}    hash   msg_id -> última revisión
+#          tg:vistos:{ch}  zset   msg_id -> segundo (TIME) de esa revisión
+#        new  -> ya hay revisión vigente: duplicado, no se publica; si no, revisión 1
+#        edit -> revisión + 1 (mínimo 2), siempre se publica
+#        Vigente = asignada hace menos de dedup_ttl, igual que duraba el antiguo tg:dedup:{ch}:{msg}:{rev}.
+#        Cada llamada recorta hasta RECORTE_LOTE mensajes caducados del canal y renueva el EXPIRE de las
+#        dos claves (un canal sin tráfico desaparece entero). Pasado dedup_ttl la revisión vuelve a empezar
+#        (antes tg:rev:* no caducaba nunca); el oid sigue siendo único porque lleva ts_redis_ingest.
+#        Claves antiguas tg:rev:* / tg:dedup:*: migrar_dedup.py.
+#     2) ts_redis_ingest con TIME del servidor (ISO 8601 UTC, ms), como antes
+#     3) XADD stream MAXLEN ~ n * revision <rev> ts_redis_ingest <iso> <campos…>
+# - Formato v2 (STREAM_FORMATO=2, comun/formato_stream.py): el script mantiene el diccionario de canales
+#   (KEYS[4], HSET solo si el username/título cambia), no calcula el ISO (el ID de la entrada ya lleva los ms)
+#   y el XADD es: * r <rev> <campos compactos…>.
+# - Clave de idempotencia opcional (KEYS[5], una por captura): si ya existe, la captura ya se publicó
+#   (p.ej. se cortó la conexión tras ejecutar el script, o se repite desde el spool) y no se asigna otra revisión.
+# - publicar_varios: N capturas en un pipeline (N EVALSHA, un round-trip) para la tarea publicadora.
+# - EVALSHA con recarga automática (register_script); sin dependencias salvo redis-py.
+
+from comun.formato_stream import FORMATO_STREAM, CANALES_KEY, codificar, meta_canal
+
+IDEM_TTL_SEC = 24 * 3600   # basta con cubrir reintentos y el drenado del spool
+REVS_PREFIJO   = "tg:revs:"
+VISTOS_PREFIJO = "tg:vistos:"
+RECORTE_LOTE   = 64        # mensajes caducados que se borran, como mucho, por llamada
+
+SCRIPT_PUBLICAR = """
+if KEYS[5] and not redis.call('SET', KEYS[5], '1', 'NX', 'EX', ARGV[5]) then
+  return {0}
+end
+local ttl = tonumber(ARGV[3])
+local ahora = tonumber(redis.call('TIME')[1])
+local caducado = ahora - ttl
+local viejos = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', caducado, 'LIMIT', 0, ARGV[9])
+if #viejos > 0 then
+  redis.call('HDEL', KEYS[1], unpack(viejos))
+  redis.call('ZREM', KEYS[3], unpack(viejos))
+end
+local rev = tonumber(redis.call('HGET', KEYS[1], ARGV[2]))
+if rev and (tonumber(redis.call('ZSCORE', KEYS[3], ARGV[2])) or 0) <= caducado then
+  rev = nil   -- caducado pero aún sin recortar
+end
+if ARGV[1] == 'new' then
+  if rev then
+    return {rev}
+  end
+  rev = 1
+else
+  rev = math.max((rev or 0) + 1, 2)
+end
+redis.call('HSET', KEYS[1], ARGV[2], rev)
+redis.call('ZADD', KEYS[3], ahora, ARGV[2])
+redis.call('EXPIRE', KEYS[1], ttl)
+redis.call('EXPIRE', KEYS[3], ttl)
+
+if ARGV[6] == '2' then
+  if redis.call('HGET', KEYS[4], ARGV[7]) ~= ARGV[8] then
+    redis.call('HSET', KEYS[4], ARGV[7], ARGV[8])
+  end
+  local args = {KEYS[2], 'MAXLEN', '~', ARGV[4], '*', 'r', rev}
+  for i = 10, #ARGV do
+    args[#args + 1] = ARGV[i]
+  end
+  return {rev, redis.call('XADD', unpack(args))}
+end
+
+-- TIME -> 'YYYY-MM-DDTHH:MM:SS.mmmZ' (días -> fecha civil, sin os.date en el Lua de Redis)
+local t = redis.call('TIME')
+local s, us = tonumber(t[1]), tonumber(t[2])
+local z = math.floor(s / 86400)
+local sod = s - z * 86400
+z = z + 719468
+local era = math.floor(z / 146097)
+local doe = z - era * 146097
+local yoe = math.floor((doe - math.floor(doe / 1460) + math.floor(doe / 36524) - math.floor(doe / 146096)) / 365)
+local doy = doe - (365 * yoe + math.floor(yoe / 4) - math.floor(yoe / 100))
+local mp = math.floor((5 * doy + 2) / 153)
+local d = doy - math.floor((153 * mp + 2) / 5) + 1
+local m = mp < 10 and mp + 3 or mp - 9
+local y = yoe + era * 400 + (m <= 2 and 1 or 0)
+local iso = string.format('%04d-%02d-%02dT%02d:%02d:%02d.%03dZ', y, m, d,
+  math.floor(sod / 3600), math.floor(sod % 3600 / 60), sod % 60, math.floor(us / 1000))
+
+local args = {KEYS[2], 'MAXLEN', '~', ARGV[4], '*', 'revision', rev, 'ts_redis_ingest', iso}
+for i = 10, #ARGV do
+  args[#args + 1] = ARGV[i]
+end
+return {rev, redis.call('XADD', unpack(args))}
+"""
+
+_SCRIPTS = {}   # cliente Redis -> Script registrado
+
+
+def _script(r):
+    sc = _SCRIPTS.get(r)
+    if sc is None:
+        sc = _SCRIPTS[r] = r.register_script(SCRIPT_PUBLICAR)
+    return sc
+
+
+def _txt(v) -> str:
+    return v.decode() if isinstance(v, bytes) else str(v)
+
+
+def _argumentos(stream: str, tipo: str, ch_id, msg_id, fields: dict, idem, maxlen: int, dedup_ttl: int,
+                formato: str = None):
+    formato = formato or FORMATO_STREAM
+    argv = [tipo, msg_id, dedup_ttl, maxlen, IDEM_TTL_SEC, formato, ch_id]
+    if formato == "2":
+        argv.append(meta_canal(fields))
+        fields = codificar({"type": tipo, "channel_id": ch_id, "msg_id": msg_id, **fields})
+    else:
+        argv.append("")
+    argv.append(RECORTE_LOTE)
+    for k, v in fields.items():
+        argv += (k, v)
+    keys = [f"{REVS_PREFIJO}{ch_id}", stream, f"{VISTOS_PREFIJO}{ch_id}", CANALES_KEY]
+    return keys + ([idem] if idem else []), argv
+
+
+def _resultado(res):
+    return int(res[0]), (_txt(res[1]) if len(res) > 1 else None)
+
+
+async def publicar(r, stream: str, tipo: str, ch_id, msg_id, fields: dict,
+                   maxlen: int, dedup_ttl: int, idem: str = None, formato: str = None):
+    """
+    Revisión + dedup + ts_redis_ingest + XADD en un EVALSHA. tipo: 'new' | 'edit'.
+    idem: clave de idempotencia de la captura (tg:idem:…); con ella, repetir la llamada no publica dos veces.
+    formato: '1' | '2' (por defecto STREAM_FORMATO).
+    Devuelve (revision, entry_id); entry_id None si ya estaba publicada (duplicado; revision 0 por idem).
+    """
+    keys, argv = _argumentos(stream, tipo, ch_id, msg_id, fields, idem, maxlen, dedup_ttl, formato)
+    return _resultado(await _script(r)(keys=keys, args=argv))
+
+
+async def publicar_varios(r, items, maxlen: int, dedup_ttl: int, formato: str = None) -> list:
+    """
+    items: [(stream, tipo, ch_id, msg_id, fields, idem)] -> [(revision, entry_id)] en el mismo orden.
+    Un solo round-trip (pipeline sin MULTI); cada script sigue siendo atómico y se ejecuta en orden.
+    """
+    sc = _script(r)
+    pipe = r.pipeline(transaction=False)
+    for item in items:
+        keys, argv = _argumentos(*item, maxlen, dedup_ttl, formato)
+        await sc(keys=keys, args=argv, client=pipe)
+    return [_resultado(res) for res in await pipe.execute()]
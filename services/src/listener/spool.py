@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# spool.py — cola local (SQLite, solo-añadir) del listener mientras Redis no está disponible
+# - Si publicar falla por conexión, el mensaje capturado se guarda aquí en vez de perderse (antes el
+#   listener salía con RedisUnrecoverableError y lo publicado hasta reiniciarlo lo tiraba el filtro de edad).
+# - Mientras quede algo en el spool, lo nuevo también entra aquí: se drena en orden de captura (FIFO
+#   único para el stream normal y el prioritario).
+# - Cada fila guarda la clave de idempotencia de su captura (tg:idem:…): el drenado publica con ella
+#   (publicacion.py) y una fila repetida tras un corte (publicada pero sin borrar, o publicada a medias
+#   en un lote antes de caer Redis) no crea otra entrada ni otra revisión.
+# - WAL + synchronous=NORMAL: sobrevive a la caída del proceso; una fila solo se borra tras el XADD.
+# - Se usa desde el bucle asyncio del listener (un solo hilo).
+
+import json
+import sqlite3
+import time
+
+TABLA = "Spool"
+
+
+class Spool:
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        self._con = sqlite3.connect(ruta, isolation_level=None)
+        self._con.execute("PRAGMA journal_mode=WAL;")
+        self._con.execute("PRAGMA synchronous=NORMAL;")
+        self._con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {TABLA}(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts_ms INTEGER NOT NULL,
+            tipo TEXT NOT NULL,
+            ch_id INTEGER NOT NULL,
+            msg_id INTEGER NOT NULL,
+            stream TEXT NOT NULL,
+            idem TEXT NOT NULL,
+            fields TEXT NOT NULL
+        )
+        """)
+        self._n = self._con.execute(f"SELECT COUNT(*) FROM {TABLA}").fetchone()[0]
+        self.caido = self._n > 0          # Redis marcado como no disponible (o spool sin vaciar al arrancar)
+
+    def __len__(self):
+        return self._n
+
+    def activo(self) -> bool:
+        """True si lo capturado debe ir al spool (Redis caído o quedan filas por drenar)."""
+        return self.caido or self._n > 0
+
+    def agregar(self, tipo: str, ch_id: int, msg_id: int, stream: str, fields: dict, idem: str) -> int:
+        cur = self._con.execute(
+            f"INSERT INTO {TABLA}(ts_ms, tipo, ch_id, msg_id, stream, idem, fields) VALUES (?,?,?,?,?,?,?)",
+            (int(time.time() * 1000), tipo, int(ch_id), int(msg_id), stream, idem,
+             json.dumps(fields, ensure_ascii=False, default=str)))
+        self._n += 1
+        return cur.lastrowid
+
+    def primeras(self, limite: int = 100) -> list:
+        """[(id, tipo, ch_id, msg_id, stream, idem, fields)] en orden de captura."""
+        filas = self._con.execute(
+            f"SELECT id, tipo, ch_id, msg_id, stream, idem, fields FROM {TABLA} ORDER BY id LIMIT ?",
+            (limite,)).fetchall()
+        return [(i, t, c, m, s, k, json.loads(f)) for i, t, c, m, s, k, f in filas]
+
+    def borrar(self, id_: int):
+        if self._con.execute(f"DELETE FROM {TABLA} WHERE id = ?", (id_,)).rowcount:
+            self._n -= 1
+
+    def borrar_hasta(self, id_: int):
+        """Borra un lote drenado (todas las filas con id <= id_) en una sola sentencia."""
+        self._n -= self._con.execute(f"DELETE FROM {TABLA} WHERE id <= ?", (id_,)).rowcount
+
+    def cerrar(self):
+        self._con.close()
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+# vigilancia.py — aviso de cambios en un archivo (config/channels.json) casi al instante
+# - Linux: inotify (ctypes, sin dependencias) sobre el DIRECTORIO del archivo, filtrando por nombre:
+#   así se ve también el reemplazo atómico (escribir temporal + rename) de editores y list_channels.py.
+#   IN_CLOSE_WRITE | IN_MOVED_TO: una notificación por escritura terminada, no por cada write().
+# - Resto (Windows) o si inotify no está disponible: sondeo de (mtime, tamaño) cada `sondeo` segundos.
+# - Rebote: tras el primer aviso se espera `rebote` s y se descartan los que lleguen entre medias
+#   (un guardado puede generar varios eventos).
+# - Uso:  async for _ in cambios(ruta): recargar()
+
+import os
+import sys
+import asyncio
+import ctypes
+import ctypes.util
+import struct
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO    = 0x00000080
+IN_Q_OVERFLOW  = 0x00004000
+IN_NONBLOCK    = 0o4000
+IN_CLOEXEC     = 0o2000000
+_EVENTO = struct.Struct("iIII")   # wd, mask, cookie, len (+ nombre de len bytes)
+
+
+def _inotify(directorio: str):
+    """fd de inotify vigilando `directorio`; None si no hay inotify (no Linux, sin libc, límite de watches…)."""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, os.fsencode(directorio), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+def _leer(fd: int, nombre: bytes) -> bool:
+    """Vacía los eventos pendientes; True si alguno afecta al archivo (o se desbordó la cola)."""
+    afecta = False
+    while True:
+        try:
+            datos = os.read(fd, 64 * 1024)
+        except BlockingIOError:
+            return afecta
+        i = 0
+        while i + _EVENTO.size <= len(datos):
+            _, mask, _, n = _EVENTO.unpack_from(datos, i)
+            i += _EVENTO.size
+            if mask & IN_Q_OVERFLOW or datos[i:i + n].rstrip(b"\0") == nombre:
+                afecta = True
+            i += n
+
+
+def _firma(ruta: str):
+    try:
+        st = os.stat(ruta)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+async def cambios(ruta: str, sondeo: float = 2.0, rebote: float = 0.2, inotify: bool = True):
+    """Generador asíncrono: produce la ruta cada vez que el archivo cambia (no al empezar)."""
+    ruta = os.path.abspath(ruta)
+    fd = _inotify(os.path.dirname(ruta)) if inotify else None
+    if fd is None:
+        firma = _firma(ruta)
+        while True:
+            await asyncio.sleep(sondeo)
+            nueva = _firma(ruta)
+            if nueva != firma:
+                firma = nueva
+                await asyncio.sleep(rebote)
+                firma = _firma(ruta)
+                yield ruta
+        return
+
+    loop = asyncio.get_running_loop()
+    aviso = asyncio.Event()
+    nombre = os.fsencode(os.path.basename(ruta))
+    loop.add_reader(fd, aviso.set)
+    try:
+        while True:
+            await aviso.wait()
+            aviso.clear()
+            if not _leer(fd, nombre):
+                continue
+            await asyncio.sleep(rebote)
+            aviso.clear()
+            _leer(fd, nombre)
+            yield ruta
+    finally:
+        loop.remove_reader(fd)
+        os.close(fd)
+
+
+def modo(inotify: bool = True) -> str:
+    """'inotify' o 'sondeo' (para el log de arranque)."""
+    if not inotify:
+        return "sondeo"
+    fd = _inotify(os.getcwd())
+    if fd is None:
+        return "sondeo"
+    os.close(fd)
+    return "inotify"
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# broadcast_client.py — cliente de prueba del protocolo secuenciado de broadcast_server
+# - Se conecta, envía HELLO o SINCE <epoch> <seq> y muestra las líneas recibidas.
+# - Guarda (epoch, último seq) en un JSON para pedir solo lo perdido al reconectar.
+#
+# Uso:
+#   python broadcast_client.py                      # 127.0.0.1:8888, estado en broadcast_client.json
+#   python broadcast_client.py --port 8888 --estado C:\Pasarela\data\cliente_ea.json
+#   python broadcast_client.py --once               # replay y salir (no queda escuchando)
+
+import os, json, socket, argparse
+
+
+class ClienteReplay:
+    """Cliente mínimo: mantiene epoch/último seq, descarta duplicados y detecta huecos."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8888, estado_path: str = "", timeout: float = 5.0):
+        self.host = host
+        self.port = port
+        self.estado_path = estado_path
+        self.timeout = timeout
+        self.epoch = None
+        self.last_seq = 0
+        self.huecos = []          # [(desde, hasta)] anunciados con #GAP
+        self.sock = None
+        self._buf = b""
+        self._hello = False
+        self._cargar_estado()
+
+    # ---------- estado ----------
+    def _cargar_estado(self):
+        if not self.estado_path or not os.path.exists(self.estado_path):
+            return
+        try:
+            with open(self.estado_path, "r", encoding="utf-8") as f:
+                st = json.load(f)
+            self.epoch = st.get("epoch")
+            self.last_seq = int(st.get("last_seq", 0))
+        except Exception:
+            pass
+
+    def _guardar_estado(self):
+        if not self.estado_path:
+            return
+        tmp = self.estado_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"epoch": self.epoch, "last_seq": self.last_seq}, f)
+        os.replace(tmp, self.estado_path)
+
+    # ---------- conexión ----------
+    def conectar(self):
+        self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._buf = b""
+        self._hello = False
+        if self.epoch is None:
+            hola = "HELLO\n"
+        else:
+            hola = f"SINCE {self.epoch} {self.last_seq}\n"
+        self.sock.sendall(hola.encode("ascii"))
+
+    def cerrar(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    def _lineas(self):
+        while True:
+            while b"\n" in self._buf:
+                linea, self._buf = self._buf.split(b"\n", 1)
+                yield linea.decode("utf-8", "replace")
+            data = self.sock.recv(65536)
+            if not data:
+                return
+            self._buf += data
+
+    def esperar_hello(self):
+        """Consume líneas hasta el #HELLO del servidor (a partir de ahí el modo secuenciado está activo)."""
+        for linea in self._lineas():
+            if linea.startswith("#HELLO"):
+                self._aplicar_hello(linea.split())
+                return True
+        return False
+
+    def _aplicar_hello(self, partes):
+        epoch = int(partes[1])
+        if self.epoch is not None and epoch != self.epoch:
+            self.last_seq = 0   # servidor reiniciado sin persistencia: nueva numeración
+        self.epoch = epoch
+        self._hello = True
+        self._guardar_estado()
+
+    def recibir(self, hasta_replay_end: bool = False):
+        """
+        Generador de (seq, línea) nuevas. Aplica #HELLO/#GAP, ignora seq ya vistos.
+        Con hasta_replay_end=True termina al recibir #REPLAY_END.
+        """
+        for linea in self._lineas():
+            if linea.startswith("#"):
+                partes = linea.split()
+                if partes[0] == "#HELLO" and len(partes) >= 3:
+                    self._aplicar_hello(partes)
+                elif partes[0] == "#GAP" and len(partes) >= 3:
+                    self.huecos.append((int(partes[1]), int(partes[2])))
+                    print(f"[cliente] ⚠️ hueco no recuperable seq {partes[1]}..{partes[2]}")
+                elif partes[0] == "#REPLAY_END" and hasta_replay_end:
+                    return
+                continue
+            sq, sep, resto = linea.partition("|")
+            if not sep or not sq.isdigit():
+                if self._hello:
+                    yield None, linea  # línea sin secuencia (servidor antiguo)
+                # antes del #HELLO: entrega en modo antiguo, llegará de nuevo en el replay
+                continue
+            n = int(sq)
+            if n <= self.last_seq:
+                continue               # duplicado (ya entregado)
+            self.last_seq = n
+            self._guardar_estado()
+            yield n, resto
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Cliente de prueba del broadcast secuenciado (replay).")
+    ap.add_argument("--host", default=os.getenv("SOCKET_HOST", "127.0.0.1"))
+    ap.add_argument("--port", type=int, default=int(os.getenv("SOCKET_PORT", "8888")))
+    ap.add_argument("--estado", default="broadcast_client.json", help="Fichero JSON con epoch/último seq.")
+    ap.add_argument("--once", action="store_true", help="Recibir el replay y salir.")
+    return ap.parse_args()
+
+
+def main():
+    args = parse_args()
+    cli = ClienteReplay(args.host, args.port, args.estado, timeout=None)
+    cli.conectar()
+    print(f"[cliente] conectado a {args.host}:{args.port} (epoch={cli.epoch} last_seq={cli.last_seq})")
+    try:
+        for seq, linea in cli.recibir(hasta_replay_end=args.once):
+            print(f"[cliente] seq={seq} {linea}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cli.cerrar()
+        print(f"[cliente] fin (epoch={cli.epoch} last_seq={cli.last_seq})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,485 @@
+# -*- coding: utf-8 -*-
+# broadcast_server.py — servidor TCP de difusión (fan-out) para los EA de MT5
+# - Un único hilo con selectors: accept, lecturas y escrituras no bloqueantes.
+# - Cada cliente tiene su propia cola de envío acotada; broadcast() solo encola
+#   y despierta al hilo, nunca espera a un terminal lento.
+# - Cliente lento (cola llena o mensaje más antiguo > evict_sec) -> se expulsa.
+# - Métricas por cliente: backlog, latencia de entrega, enviados/descartados.
+# - Secuencia + replay: cada línea difundida recibe un nº de secuencia creciente y
+#   se guarda en un buffer circular (opcionalmente persistido en fichero).
+#
+# Protocolo (líneas terminadas en \n):
+#   cliente -> servidor
+#     HELLO                  modo secuenciado, sin replay (cliente nuevo); lo difundido desde la conexión
+#                            y aún no enviado se reenvía con su seq detrás del #HELLO
+#     SINCE <epoch> <seq>    modo secuenciado + replay de todo lo posterior a <seq>
+#     SINCE <seq>            igual, asumiendo la época actual
+#     ACK <oid> [...]        el EA confirma que ha recibido/encolado la señal <oid>
+#     ACK <oid> CERRADA      ... o que su posición se cerró (también RECHAZADA/ERROR): sale del índice de posiciones
+#   servidor -> cliente (modo secuenciado)
+#     #HELLO <epoch> <last_seq>
+#     #GAP <desde> <hasta>   secuencias perdidas que ya no están en el buffer
+#     #REPLAY_END <last_seq>
+#     <seq>|<línea CSV>
+#   Los clientes que no envían nada (EA antiguos) siguen recibiendo la línea CSV sin prefijo.
+
+import os, socket, selectors, threading, time
+from collections import deque
+
+from comun import logs
+
+log = logs.obtener("parseador.broadcast")
+
+_ACCEPT = "accept"
+_WAKE = "wake"
+STATS_REFRESCO_SEC = 1.0   # snapshot de stats(): como mucho una vez por segundo (y al conectar/desconectar)
+
+
+class _Cliente:
+    """Estado de un EA conectado: socket, cola de envío y contadores."""
+    __slots__ = ("conn", "fd", "addr", "cola", "offset", "rbuf", "conectado_desde",
+                 "enviados", "bytes_enviados", "lat_ultima_ms", "lat_max_ms", "lat_ewma_ms",
+                 "escribiendo", "secuencial", "cupo_replay")
+
+    def __init__(self, conn, addr):
+        self.conn = conn
+        self.fd = conn.fileno()
+        self.addr = addr
+        self.cola = deque()          # (t_encolado_ns, payload bytes)
+        self.offset = 0              # bytes ya enviados del primer payload de la cola
+        self.rbuf = b""
+        self.conectado_desde = time.time()
+        self.enviados = 0
+        self.bytes_enviados = 0
+        self.lat_ultima_ms = 0.0
+        self.lat_max_ms = 0.0
+        self.lat_ewma_ms = 0.0
+        self.escribiendo = False     # True si está registrado para EVENT_WRITE
+        self.secuencial = False      # True tras HELLO/SINCE: recibe "<seq>|<línea>"
+        self.cupo_replay = 0         # líneas de replay aún en cola (no cuentan para queue_max)
+
+    def backlog_bytes(self) -> int:
+        total = sum(len(p) for _, p in self.cola)
+        return total - self.offset
+
+
+class BroadcastWorker(threading.Thread):
+    """
+    Servidor de difusión por líneas. Interfaz compatible con la versión anterior:
+    start(), stop() y broadcast(message). broadcast() es thread-safe y no bloquea.
+    """
+
+    def __init__(self, host: str, port: int, queue_max: int = 256, evict_sec: float = 5.0,
+                 stats_every_sec: float = 0.0, replay_size: int = 1000, replay_file: str = "",
+                 on_ack=None):
+        super().__init__(daemon=True)
+        self.host = host
+        self.port = port
+        self.queue_max = max(1, int(queue_max))
+        self.evict_sec = float(evict_sec)
+        self.stats_every_sec = float(stats_every_sec)
+        self.sock = None
+        self.sel = None
+        self.clientes = {}           # fileno -> _Cliente (solo lo toca el hilo del loop)
+        self.stop_event = threading.Event()
+        self._entrantes = deque()    # (t_ns, payload) pendientes de repartir
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._stats_lock = threading.Lock()
+        self._stats = []             # snapshot por cliente para stats()
+        self._t_stats = 0.0          # monotonic del último snapshot (0 = rehacer ya)
+        self.expulsados = 0          # clientes expulsados por lentos
+        self.descartados = 0         # mensajes descartados al expulsar
+        self.listo = threading.Event()
+        self.on_ack = on_ack         # callback(oid, addr, resto) en el hilo del loop: debe ser rápido
+        # --- secuencia / replay ---
+        self.replay = deque(maxlen=max(1, int(replay_size)))   # (seq, payload sin prefijo)
+        self.replay_file = replay_file or ""
+        self._replay_fh = None
+        self._replay_lineas = 0
+        self.epoch = int(time.time())
+        self.seq = 0
+        if self.replay_file:
+            self._cargar_replay()
+
+    # ---------- API pública (cualquier hilo) ----------
+    def broadcast(self, message: str) -> int:
+        """Encola la línea para todos los clientes. Devuelve nº de clientes conectados."""
+        payload = (message.rstrip("\r\n") + "\n").encode("utf-8")
+        self._entrantes.append((time.monotonic_ns(), payload))
+        self._despertar()
+        return len(self.clientes)
+
+    def stop(self):
+        self.stop_event.set()
+        self._despertar()
+
+    @property
+    def ultimo_seq(self) -> int:
+        return self.seq
+
+    def stats(self) -> list:
+        """Snapshot por cliente: addr, backlog (mensajes/bytes), latencias y contadores."""
+        with self._stats_lock:
+            return [dict(s) for s in self._stats]
+
+    @property
+    def clientes_conectados(self) -> int:
+        return len(self.clientes)
+
+    # ---------- Loop ----------
+    def run(self):
+        self.sel = selectors.DefaultSelector()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            self.sock.bind((self.host, self.port))
+            self.port = self.sock.getsockname()[1]   # puerto real si se pidió 0
+            self.sock.listen(8)
+            self.sock.setblocking(False)
+            self.sel.register(self.sock, selectors.EVENT_READ, _ACCEPT)
+            self.sel.register(self._wake_r, selectors.EVENT_READ, _WAKE)
+            log.info(f"escuchando en {self.host}:{self.port} (cola/cliente={self.queue_max}, expulsión>{self.evict_sec}s, "
+                  f"replay={self.replay.maxlen} epoch={self.epoch} seq={self.seq})")
+            self.listo.set()
+            ultimo_stats = time.monotonic()
+            while not self.stop_event.is_set():
+                for key, mask in self.sel.select(timeout=1.0):
+                    if key.data == _ACCEPT:
+                        self._aceptar()
+                    elif key.data == _WAKE:
+                        self._vaciar_wake()
+                    else:
+                        cli = key.data
+                        if mask & selectors.EVENT_READ:
+                            self._leer(cli)
+                        if mask & selectors.EVENT_WRITE and cli.fd in self.clientes:
+                            self._enviar(cli)
+                self._repartir()
+                self._expulsar_lentos()
+                if time.monotonic() - self._t_stats >= STATS_REFRESCO_SEC:
+                    self._actualizar_stats()
+                if self.stats_every_sec > 0 and time.monotonic() - ultimo_stats >= self.stats_every_sec:
+                    ultimo_stats = time.monotonic()
+                    self._imprimir_stats()
+        except Exception as e:
+            log.exception(f"loop detenido: {e}")
+        finally:
+            self.listo.set()
+            self._close_all()
+            if self._replay_fh is not None:
+                try:
+                    self._replay_fh.close()
+                except Exception:
+                    pass
+            for s in (self.sock, self._wake_r, self._wake_w):
+                try:
+                    s.close()
+                except Exception:
+                    pass
+            try:
+                self.sel.close()
+            except Exception:
+                pass
+
+    def _despertar(self):
+        try:
+            self._wake_w.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass  # buffer lleno = ya hay un despertar pendiente
+
+    def _vaciar_wake(self):
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def _aceptar(self):
+        try:
+            conn, addr = self.sock.accept()
+        except (BlockingIOError, OSError):
+            return
+        conn.setblocking(False)
+        try:
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            pass
+        cli = _Cliente(conn, addr)
+        self.clientes[cli.fd] = cli
+        self.sel.register(conn, selectors.EVENT_READ, cli)
+        self._t_stats = 0.0
+        log.info(f"cliente conectado {addr}")
+
+    def _leer(self, cli: _Cliente):
+        try:
+            data = cli.conn.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._cerrar(cli, "desconectado")
+            return
+        cli.rbuf += data
+        while b"\n" in cli.rbuf:
+            linea, cli.rbuf = cli.rbuf.split(b"\n", 1)
+            self._comando(cli, linea.decode("utf-8", "ignore").strip())
+        if len(cli.rbuf) > 4096:
+            cli.rbuf = b""  # basura sin fin de línea: descartar
+
+    def _comando(self, cli: _Cliente, linea: str):
+        partes = linea.split()
+        if not partes:
+            return
+        cmd = partes[0].upper()
+        if cmd == "HELLO":
+            self._activar_secuencial(cli, reemitir=True)
+        elif cmd == "SINCE":
+            try:
+                nums = [int(x) for x in partes[1:3]]
+            except ValueError:
+                nums = []
+            if len(nums) == 2:
+                epoch, desde = nums
+            elif len(nums) == 1:
+                epoch, desde = self.epoch, nums[0]
+            else:
+                return
+            self._activar_secuencial(cli)
+            self._replay_desde(cli, desde if epoch == self.epoch else 0)
+        elif cmd == "ACK" and len(partes) >= 2:
+            if self.on_ack is not None:
+                try:
+                    self.on_ack(partes[1], cli.addr, " ".join(partes[2:]))
+                except Exception as e:
+                    log.warning(f"callback ACK: {e}")
+            return
+        self._enviar(cli)
+
+    def _activar_secuencial(self, cli: _Cliente, reemitir: bool = False):
+        """
+        Pasa el cliente a modo secuenciado y le encola '#HELLO <epoch> <seq>'.
+        Las líneas sin prefijo aún no empezadas son las últimas difundidas (seq-n+1 .. seq): con reemitir (HELLO)
+        se conservan como '<seq>|<línea>' detrás del #HELLO, que anuncia el seq anterior a la primera; sin él
+        (SINCE) se descartan, porque el replay ya las incluye.
+        """
+        if cli.secuencial:
+            self._encolar(cli, f"#HELLO {self.epoch} {self.seq}\n".encode("utf-8"))
+            return
+        cli.secuencial = True
+        cabeza = cli.cola.popleft() if cli.cola and cli.offset else None
+        pendientes = list(cli.cola)
+        cli.cola.clear()
+        if cabeza is not None:
+            cli.cola.append(cabeza)
+        primero = self.seq - len(pendientes) + 1
+        self._encolar(cli, f"#HELLO {self.epoch} {primero - 1 if reemitir else self.seq}\n".encode("utf-8"))
+        if reemitir:
+            for sq, (t_ns, p) in enumerate(pendientes, primero):
+                cli.cola.append((t_ns, str(sq).encode("ascii") + b"|" + p))
+
+    def _replay_desde(self, cli: _Cliente, desde: int):
+        """Encola todo lo del buffer con seq > desde (si desde > último seq, no hay nada que reenviar)."""
+        if desde > self.seq:
+            desde = self.seq
+        items = [(sq, p) for sq, p in self.replay if sq > desde]
+        primero = items[0][0] if items else self.seq + 1
+        if primero > desde + 1:
+            self._encolar(cli, f"#GAP {desde + 1} {primero - 1}\n".encode("utf-8"))
+        for sq, p in items:
+            self._encolar(cli, str(sq).encode("ascii") + b"|" + p)
+            cli.cupo_replay += 1
+        self._encolar(cli, f"#REPLAY_END {self.seq}\n".encode("utf-8"))
+        if items:
+            log.info(f"replay a {cli.addr}: {len(items)} línea(s) desde seq={desde + 1}")
+
+    def _encolar(self, cli: _Cliente, payload: bytes):
+        cli.cola.append((time.monotonic_ns(), payload))
+
+    def _repartir(self):
+        """Pasa los mensajes entrantes a la cola de cada cliente e intenta enviar ya."""
+        if not self._entrantes:
+            return
+        lote = []
+        while self._entrantes:
+            t_ns, payload = self._entrantes.popleft()
+            self.seq += 1
+            self.replay.append((self.seq, payload))
+            self._persistir(self.seq, payload)
+            lote.append((t_ns, payload, str(self.seq).encode("ascii") + b"|" + payload))
+        self._volcar_replay()             # un flush por ronda, no por línea
+        for cli in list(self.clientes.values()):
+            for t_ns, plano, con_seq in lote:
+                if len(cli.cola) - cli.cupo_replay >= self.queue_max:
+                    self._cerrar(cli, f"lento (cola llena {self.queue_max})", expulsado=True)
+                    break
+                cli.cola.append((t_ns, con_seq if cli.secuencial else plano))
+            else:
+                self._enviar(cli)
+
+    def _enviar(self, cli: _Cliente):
+        conn = cli.conn
+        while cli.cola:
+            t_ns, payload = cli.cola[0]
+            try:
+                n = conn.send(payload[cli.offset:] if cli.offset else payload)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                log.warning(f"error enviando a cliente {cli.addr}: {e}")
+                self._cerrar(cli, "error de envío")
+                return
+            cli.offset += n
+            cli.bytes_enviados += n
+            if cli.offset < len(payload):
+                break  # envío parcial: esperar a EVENT_WRITE
+            cli.cola.popleft()
+            cli.offset = 0
+            cli.enviados += 1
+            if cli.cupo_replay:
+                cli.cupo_replay -= 1
+            lat_ms = (time.monotonic_ns() - t_ns) / 1e6
+            cli.lat_ultima_ms = lat_ms
+            cli.lat_max_ms = max(cli.lat_max_ms, lat_ms)
+            cli.lat_ewma_ms = lat_ms if cli.enviados == 1 else 0.8 * cli.lat_ewma_ms + 0.2 * lat_ms
+        self._marcar_escritura(cli, bool(cli.cola))
+
+    def _marcar_escritura(self, cli: _Cliente, quiere: bool):
+        if quiere == cli.escribiendo:
+            return
+        eventos = selectors.EVENT_READ | (selectors.EVENT_WRITE if quiere else 0)
+        try:
+            self.sel.modify(cli.conn, eventos, cli)
+            cli.escribiendo = quiere
+        except (KeyError, ValueError, OSError):
+            pass
+
+    def _expulsar_lentos(self):
+        if self.evict_sec <= 0:
+            return
+        limite_ns = time.monotonic_ns() - int(self.evict_sec * 1e9)
+        for cli in list(self.clientes.values()):
+            if cli.cola and cli.cola[0][0] < limite_ns:
+                self._cerrar(cli, f"lento (>{self.evict_sec}s sin vaciar cola)", expulsado=True)
+
+    def _cerrar(self, cli: _Cliente, motivo: str, expulsado: bool = False):
+        if self.clientes.get(cli.fd) is not cli:
+            return
+        del self.clientes[cli.fd]
+        self._t_stats = 0.0
+        if expulsado:
+            self.expulsados += 1
+            self.descartados += len(cli.cola)
+        try:
+            self.sel.unregister(cli.conn)
+        except (KeyError, ValueError, OSError):
+            pass
+        try:
+            cli.conn.close()
+        except Exception:
+            pass
+        log.info(f"cliente {motivo} {cli.addr}" + (f" (descartados={len(cli.cola)})" if expulsado else ""))
+
+    # ---------- Persistencia del buffer de replay ----------
+    def _cargar_replay(self):
+        """Lee '#EPOCH <n>' + líneas '<seq>|<payload>' y recupera época, secuencia y buffer."""
+        try:
+            with open(self.replay_file, "rb") as f:
+                for raw in f:
+                    raw = raw.rstrip(b"\r\n")
+                    if raw.startswith(b"#EPOCH "):
+                        try:
+                            self.epoch = int(raw.split()[1])
+                        except (IndexError, ValueError):
+                            pass
+                        continue
+                    sq, sep, payload = raw.partition(b"|")
+                    if not sep:
+                        continue
+                    try:
+                        n = int(sq)
+                    except ValueError:
+                        continue
+                    self.replay.append((n, payload + b"\n"))
+                    self.seq = max(self.seq, n)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log.warning(f"no se pudo leer replay {self.replay_file}: {e}")
+        self._compactar_replay()
+
+    def _compactar_replay(self):
+        """Reescribe el fichero solo con el contenido actual del buffer (escritura atómica)."""
+        try:
+            d = os.path.dirname(os.path.abspath(self.replay_file))
+            os.makedirs(d, exist_ok=True)
+            tmp = self.replay_file + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(f"#EPOCH {self.epoch}\n".encode("ascii"))
+                for sq, payload in self.replay:
+                    f.write(str(sq).encode("ascii") + b"|" + payload)
+            if self._replay_fh is not None:
+                self._replay_fh.close()
+            os.replace(tmp, self.replay_file)
+            self._replay_fh = open(self.replay_file, "ab")
+            self._replay_lineas = len(self.replay)
+        except Exception as e:
+            log.warning(f"replay sin persistencia ({self.replay_file}): {e}")
+            self._replay_fh = None
+
+    def _persistir(self, seq: int, payload: bytes):
+        if self._replay_fh is None:
+            return
+        try:
+            self._replay_fh.write(str(seq).encode("ascii") + b"|" + payload)   # flush: uno por ronda, _volcar_replay
+            self._replay_lineas += 1
+            if self._replay_lineas > 2 * self.replay.maxlen:
+                self._compactar_replay()
+        except Exception as e:
+            log.warning(f"error persistiendo replay: {e}")
+
+    def _volcar_replay(self):
+        if self._replay_fh is None:
+            return
+        try:
+            self._replay_fh.flush()
+        except Exception as e:
+            log.warning(f"error persistiendo replay: {e}")
+
+    # ---------- Métricas ----------
+    def _actualizar_stats(self):
+        snap = []
+        for cli in self.clientes.values():
+            snap.append({
+                "addr": f"{cli.addr[0]}:{cli.addr[1]}",
+                "secuencial": cli.secuencial,
+                "backlog_msgs": len(cli.cola),
+                "backlog_bytes": cli.backlog_bytes(),
+                "enviados": cli.enviados,
+                "bytes_enviados": cli.bytes_enviados,
+                "lat_ultima_ms": round(cli.lat_ultima_ms, 3),
+                "lat_max_ms": round(cli.lat_max_ms, 3),
+                "lat_ewma_ms": round(cli.lat_ewma_ms, 3),
+                "conectado_seg": round(time.time() - cli.conectado_desde, 1),
+            })
+        with self._stats_lock:
+            self._stats = snap
+        self._t_stats = time.monotonic()
+
+    def _imprimir_stats(self):
+        log.info(f"stats clientes={len(self.clientes)} seq={self.seq} expulsados={self.expulsados} descartados={self.descartados}")
+        for s in self.stats():
+            log.info(f"    • {s['addr']} backlog={s['backlog_msgs']}msg/{s['backlog_bytes']}B enviados={s['enviados']} "
+                  f"lat_ultima={s['lat_ultima_ms']}ms lat_ewma={s['lat_ewma_ms']}ms lat_max={s['lat_max_ms']}ms")
+
+    def _close_all(self):
+        for cli in list(self.clientes.values()):
+            try:
+                cli.conn.close()
+            except Exception:
+                pass
+        self.clientes.clear()
+        with self._stats_lock:
+            self._stats = []
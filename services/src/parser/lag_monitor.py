@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+# lag_monitor.py — retraso del consumer group del parser sobre pasarela:parse
+# - Cada LAG_CHECK_EVERY_SEC lee XINFO GROUPS + XPENDING del stream/grupo.
+# - Lag en entradas: entradas aún no entregadas al grupo (campo 'lag' de Redis ≥7; si no, XRANGE).
+# - Lag en tiempo: ahora - ts_redis_ingest de la entrada NO entregada más antigua.
+# - Publica gauges en comun.metricas y alerta (con cooldown) al superar umbrales.
+#
+# Uso:
+#   - Dentro del parseador: hilo MonitorLag (LAG_MONITOR_ENABLED=1, por defecto).
+#   - Suelto:  python lag_monitor.py            # bucle, alertas vía publicador.send_once
+#              python lag_monitor.py --once     # una medición y salir
+
+import os, sys, time, asyncio, argparse, threading
+from datetime import datetime, timezone
+
+import redis
+
+# --- PATH robusto para imports locales (añade padre para paquetes hermanos) ---
+BASE_DIR   = os.path.dirname(os.path.abspath(__file__))          # .../services/src/parser
+PARENT_DIR = os.path.dirname(BASE_DIR)                           # .../services/src
+if PARENT_DIR not in sys.path:
+    sys.path.insert(0, PARENT_DIR)
+
+from comun import metricas
+from comun import logs
+
+log = logs.obtener("parseador.lag")   # dentro del parseador: mismo logging estructurado que el resto
+
+LAG_CHECK_EVERY_SEC    = float(os.getenv("LAG_CHECK_EVERY_SEC", "15"))
+LAG_ALERT_ENTRIES      = int(os.getenv("LAG_ALERT_ENTRIES", "20"))        # 0 = sin alerta por nº de entradas
+LAG_ALERT_SEC          = float(os.getenv("LAG_ALERT_SEC", "60"))          # 0 = sin alerta por tiempo
+LAG_ALERT_COOLDOWN_SEC = float(os.getenv("LAG_ALERT_COOLDOWN_SEC", "900"))
+_XRANGE_MAX_CONTEO     = 10000   # tope al contar entradas con XRANGE (Redis < 7)
+
+LAG_ENTRADAS  = metricas.gauge("pasarela_stream_lag_entradas", "Entradas del stream aún no entregadas al grupo", ("stream", "grupo"))
+LAG_SEGUNDOS  = metricas.gauge("pasarela_stream_lag_segundos", "Antigüedad de la entrada no entregada más antigua (ts_redis_ingest)", ("stream", "grupo"))
+PENDIENTES    = metricas.gauge("pasarela_stream_pendientes", "Entradas entregadas sin ACK (XPENDING)", ("stream", "grupo"))
+PEND_ANTIGUO  = metricas.gauge("pasarela_stream_pendiente_segundos", "Antigüedad de la entrada pendiente más antigua", ("stream", "grupo"))
+CONSUMIDORES  = metricas.gauge("pasarela_stream_consumidores", "Consumidores registrados en el grupo", ("stream", "grupo"))
+ALERTAS       = metricas.contador("pasarela_stream_lag_alertas_total", "Alertas de lag emitidas", ("tipo",))
+
+
+def _txt(v) -> str:
+    return v.decode() if isinstance(v, bytes) else str(v)
+
+
+def _ms_de_id(entry_id) -> int:
+    return int(_txt(entry_id).split("-", 1)[0])
+
+
+def _iso_a_epoch(ts: str):
+    try:
+        dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    except (ValueError, AttributeError):
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def medir_lag(r, stream: str, grupo: str) -> dict:
+    """
+    Foto del retraso del grupo. Devuelve dict con:
+      lag_entradas, lag_segundos, pendientes, pendiente_segundos, consumidores, last_delivered
+    lag_segundos / pendiente_segundos = 0.0 si no hay nada atrasado.
+    """
+    ahora = time.time()
+    info = None
+    for g in r.xinfo_groups(stream):
+        if _txt(g.get("name")) == grupo:
+            info = g
+            break
+    if info is None:
+        raise LookupError(f"grupo {grupo!r} no existe en {stream!r}")
+
+    last = _txt(info.get("last-delivered-id") or "0-0")
+    # Primera entrada posterior al último ID entregado = la no entregada más antigua
+    siguiente = r.xrange(stream, min="(" + last, max="+", count=1)
+
+    lag = info.get("lag")
+    if lag is None:
+        # Redis < 7 (o lag indeterminado tras XDEL/XTRIM): contar a mano, con tope
+        lag = len(r.xrange(stream, min="(" + last, max="+", count=_XRANGE_MAX_CONTEO)) if siguiente else 0
+    lag = int(lag)
+
+    lag_seg = 0.0
+    if siguiente:
+        sid, campos = siguiente[0]
+        ts = campos.get(b"ts_redis_ingest", campos.get("ts_redis_ingest"))
+        t_ingest = _iso_a_epoch(_txt(ts)) if ts is not None else None
+        if t_ingest is None:
+            t_ingest = _ms_de_id(sid) / 1000.0   # entradas sin ts_redis_ingest: usar el ID
+        lag_seg = max(0.0, ahora - t_ingest)
+
+    pend = r.xpending(stream, grupo)
+    n_pend = int(pend.get("pending") or 0)
+    pend_seg = 0.0
+    if n_pend and pend.get("min"):
+        pend_seg = max(0.0, ahora - _ms_de_id(pend["min"]) / 1000.0)
+
+    return {
+        "lag_entradas": lag,
+        "lag_segundos": round(lag_seg, 3),
+        "pendientes": n_pend,
+        "pendiente_segundos": round(pend_seg, 3),
+        "consumidores": int(info.get("consumers") or 0),
+        "last_delivered": last,
+    }
+
+
+def _alertar_publicador(texto: str):
+    """Alerta suelta por el publicador de Telegram (modo independiente)."""
+    from publicador.publicador import send_once
+    try:
+        asyncio.run(send_once(texto))
+    except SystemExit:
+        pass  # send_once ya imprimió el error
+
+
+class MonitorLag(threading.Thread):
+    """
+    Hilo daemon que mide el lag periódicamente, actualiza gauges y llama a alertar(texto)
+    al cruzar umbrales (una vez por cooldown) y al recuperarse.
+    """
+
+    def __init__(self, r, stream: str, grupo: str, alertar=None,
+                 cada_sec: float = LAG_CHECK_EVERY_SEC,
+                 umbral_entradas: int = LAG_ALERT_ENTRIES,
+                 umbral_sec: float = LAG_ALERT_SEC,
+                 cooldown_sec: float = LAG_ALERT_COOLDOWN_SEC):
+        super().__init__(daemon=True, name="lag-monitor")
+        self.r = r
+        self.stream = stream
+        self.grupo = grupo
+        self.alertar = alertar
+        self.cada_sec = max(1.0, float(cada_sec))
+        self.umbral_entradas = int(umbral_entradas)
+        self.umbral_sec = float(umbral_sec)
+        self.cooldown_sec = float(cooldown_sec)
+        self.ultima = None            # última medición (dict)
+        self._en_alerta = False
+        self._ultima_alerta = 0.0
+        self._parar = threading.Event()
+
+    def stop(self):
+        self._parar.set()
+
+    def run(self):
+        while not self._parar.is_set():
+            self.comprobar()
+            self._parar.wait(self.cada_sec)
+
+    def _excede(self, m: dict) -> list:
+        motivos = []
+        if self.umbral_entradas > 0 and m["lag_entradas"] >= self.umbral_entradas:
+            motivos.append(f"{m['lag_entradas']} entradas sin leer (umbral {self.umbral_entradas})")
+        if self.umbral_sec > 0 and m["lag_segundos"] >= self.umbral_sec:
+            motivos.append(f"la más antigua espera {m['lag_segundos']:.0f}s (umbral {self.umbral_sec:.0f}s)")
+        if self.umbral_sec > 0 and m["pendiente_segundos"] >= self.umbral_sec:
+            motivos.append(f"{m['pendientes']} pendientes sin ACK desde hace {m['pendiente_segundos']:.0f}s")
+        return motivos
+
+    def comprobar(self):
+        """Una medición + gauges + alerta si procede. Devuelve el dict medido (o None si falla)."""
+        try:
+            m = medir_lag(self.r, self.stream, self.grupo)
+        except Exception as e:
+            log.warning(f"no se pudo medir {self.stream}/{self.grupo}: {e}")
+            return None
+        self.ultima = m
+        et = (self.stream, self.grupo)
+        LAG_ENTRADAS.set(*et, v=m["lag_entradas"])
+        LAG_SEGUNDOS.set(*et, v=m["lag_segundos"])
+        PENDIENTES.set(*et, v=m["pendientes"])
+        PEND_ANTIGUO.set(*et, v=m["pendiente_segundos"])
+        CONSUMIDORES.set(*et, v=m["consumidores"])
+
+        motivos = self._excede(m)
+        ahora = time.monotonic()
+        if motivos:
+            if not self._en_alerta or ahora - self._ultima_alerta >= self.cooldown_sec:
+                self._emitir("lag", f"⚠️ Pasarela: el parser va con retraso en {self.stream}/{self.grupo}: "
+                                    + "; ".join(motivos))
+                self._ultima_alerta = ahora
+            self._en_alerta = True
+        elif self._en_alerta:
+            self._en_alerta = False
+            self._emitir("recuperado", f"✅ Pasarela: lag de {self.stream}/{self.grupo} normalizado "
+                                       f"({m['lag_entradas']} entradas, {m['lag_segundos']:.0f}s)")
+        return m
+
+    def _emitir(self, tipo: str, texto: str):
+        ALERTAS.inc(tipo)
+        if tipo == "lag":
+            log.warning(texto, extra={"stream": self.stream, "grupo": self.grupo})
+        else:
+            log.info(texto, extra={"stream": self.stream, "grupo": self.grupo})
+        if self.alertar is None:
+            return
+        try:
+            self.alertar(texto)
+        except Exception as e:
+            log.warning(f"alerta no enviada: {e}")
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Monitor de lag del consumer group del parser.")
+    ap.add_argument("--once", action="store_true", help="Una medición, imprimirla y salir.")
+    ap.add_argument("--sin-alertas", action="store_true", help="No enviar alertas a Telegram.")
+    return ap.parse_args()
+
+
+def main():
+    from dotenv import load_dotenv, find_dotenv
+    load_dotenv(find_dotenv(usecwd=True), override=False)
+    args = parse_args()
+    url    = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+    stream = os.getenv("REDIS_STREAM", "pasarela:parse")
+    grupo  = os.getenv("REDIS_GROUP", "parser")
+    r = redis.Redis.from_url(url)
+    logs.configurar("lag_monitor")       # suelto: alertas y avisos a consola / LOG_DIR/lag_monitor.jsonl
+    if args.once:
+        print(medir_lag(r, stream, grupo))
+        return
+    puerto = int(os.getenv("LAG_METRICS_PORT", "9103"))
+    if metricas.servir(puerto, os.getenv("METRICS_HOST", "127.0.0.1")):
+        print(f"[lag] métricas en :{puerto}/metrics")
+    mon = MonitorLag(r, stream, grupo, alertar=None if args.sin_alertas else _alertar_publicador)
+    print(f"[lag] vigilando {stream}/{grupo} cada {mon.cada_sec:.0f}s "
+          f"(umbral {mon.umbral_entradas} entradas / {mon.umbral_sec:.0f}s)")
+    try:
+        mon.run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# outbox.py — outbox transaccional (SQLite) para los efectos externos del parseador (CSV MT4, socket EA, Telegram)
+# - Las salidas de un mensaje se insertan en la MISMA transacción que su fila de Trazas_Unica,
+#   con clave (oid, sink): reprocesar la entrada del stream (o un duplicado del listener) no crea otra.
+# - Ciclo de una salida:  pendiente -> en_curso (reclamada) -> hecho | error | caducado
+#   Solo se entrega lo que se reclama (UPDATE ... WHERE estado='pendiente'), así dos caminos
+#   (arranque y reproceso del mismo mensaje) no entregan la misma salida dos veces.
+# - Al arrancar, lo que quedó 'en_curso' (caída a mitad de un efecto) vuelve a 'pendiente' con
+#   interrumpido=1: el sink puede comprobar el destino antes de repetir (p.ej. oid ya en colaMT4.csv).
+# - Todas las funciones reciben un cursor: la transacción la abre y cierra quien llama.
+
+import json
+import time
+
+TABLA = "Outbox"
+
+PENDIENTE, EN_CURSO, HECHO, ERROR, CADUCADO = "pendiente", "en_curso", "hecho", "error", "caducado"
+
+
+def asegurar_tabla(cur, tabla: str = TABLA):
+    cur.execute(f"""
+    CREATE TABLE IF NOT EXISTS {tabla}(
+        oid TEXT NOT NULL,
+        sink TEXT NOT NULL,
+        stream TEXT,
+        entry_id TEXT,
+        payload TEXT,
+        estado TEXT NOT NULL DEFAULT '{PENDIENTE}',
+        intentos INTEGER NOT NULL DEFAULT 0,
+        interrumpido INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        ts_creado INTEGER,
+        ts_estado INTEGER,
+        PRIMARY KEY (oid, sink)
+    )
+    """)
+    cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{tabla}_estado ON {tabla}(estado, ts_creado)")
+    cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{tabla}_entry ON {tabla}(stream, entry_id)")
+
+
+def _ms() -> int:
+    return time.time_ns() // 1_000_000
+
+
+def insertar(cur, oid: str, stream: str, entry_id: str, salidas: dict, tabla: str = TABLA) -> None:
+    """salidas: {sink: payload (dict serializable)}. Las ya existentes para (oid, sink) no se tocan."""
+    ahora = _ms()
+    cur.executemany(
+        f"INSERT OR IGNORE INTO {tabla}(oid, sink, stream, entry_id, payload, estado, ts_creado, ts_estado) "
+        f"VALUES (?,?,?,?,?,?,?,?)",
+        [(oid, sink, stream, entry_id, json.dumps(p, ensure_ascii=False, default=str), PENDIENTE, ahora, ahora)
+         for sink, p in salidas.items()],
+    )
+
+
+def reclamar(cur, oid: str = None, desde_ms: int = None, tabla: str = TABLA) -> list:
+    """
+    Pasa a 'en_curso' las salidas pendientes (de un oid, o todas las creadas desde desde_ms)
+    y las devuelve: [(oid, sink, payload_dict, interrumpido)] en orden de creación.
+    """
+    if oid is not None:
+        filtro, params = "oid = ?", (oid,)
+    else:
+        filtro, params = "ts_creado >= ?", (int(desde_ms or 0),)
+    filas = cur.execute(
+        f"SELECT oid, sink, payload, interrumpido FROM {tabla} WHERE estado = ? AND {filtro} "
+        f"ORDER BY ts_creado, rowid", (PENDIENTE,) + params).fetchall()
+    ahora = _ms()
+    cur.executemany(
+        f"UPDATE {tabla} SET estado = ?, intentos = intentos + 1, ts_estado = ? WHERE oid = ? AND sink = ? AND estado = ?",
+        [(EN_CURSO, ahora, o, s, PENDIENTE) for o, s, _p, _i in filas],
+    )
+    return [(o, s, json.loads(p) if p else {}, bool(i)) for o, s, p, i in filas]
+
+
+def sinks_emitidos(cur, oids: list, tabla: str = TABLA) -> set:
+    """Sinks con salida creada (y no caducada) para alguno de estos oids, p.ej. otras revisiones del mismo mensaje."""
+    if not oids:
+        return set()
+    marcas = ",".join("?" * len(oids))
+    filas = cur.execute(f"SELECT DISTINCT sink FROM {tabla} WHERE oid IN ({marcas}) AND estado <> ?",
+                        tuple(oids) + (CADUCADO,)).fetchall()
+    return {s for (s,) in filas}
+
+
+def marcar(cur, oid: str, sink: str, estado: str, error: str = None, tabla: str = TABLA) -> None:
+    cur.execute(f"UPDATE {tabla} SET estado = ?, error = ?, ts_estado = ? WHERE oid = ? AND sink = ?",
+                (estado, error, _ms(), oid, sink))
+
+
+def recuperar_interrumpidas(cur, tabla: str = TABLA) -> int:
+    """Al arrancar: 'en_curso' de un proceso anterior -> 'pendiente' (interrumpido=1)."""
+    cur.execute(f"UPDATE {tabla} SET estado = ?, interrumpido = 1, ts_estado = ? WHERE estado = ?",
+                (PENDIENTE, _ms(), EN_CURSO))
+    return cur.rowcount
+
+
+def caducar(cur, antes_ms: int, tabla: str = TABLA) -> int:
+    """Pendientes creadas antes de antes_ms -> 'caducado' (no se entregan tarde)."""
+    cur.execute(f"UPDATE {tabla} SET estado = ?, ts_estado = ? WHERE estado = ? AND ts_creado < ?",
+                (CADUCADO, _ms(), PENDIENTE, int(antes_ms)))
+    return cur.rowcount
+
+
+def purgar(cur, antes_ms: int, tabla: str = TABLA) -> int:
+    """
+    Borra las salidas terminadas (hecho/caducado/error) creadas antes de antes_ms. Las de error no se
+    reintentan solas: quedan para revisarlas durante la retención (OUTBOX_RETENCION_DIAS), no para siempre.
+    """
+    cur.execute(f"DELETE FROM {tabla} WHERE estado IN (?, ?, ?) AND ts_creado < ?",
+                (HECHO, CADUCADO, ERROR, int(antes_ms)))
+    return cur.rowcount
+
+
+def resumen(cur, tabla: str = TABLA) -> dict:
+    return dict(cur.execute(f"SELECT estado, COUNT(*) FROM {tabla} GROUP BY estado").fetchall())
@@ -1,15 +1,14 @@
 ﻿# -*- coding: utf-8 -*-
 # parseador_local31.py — v3.3.4 (patch A+B)
 # Mantiene: ruta fija MT4/Files, newline='' + flush(), trazas visuales,
-# estados y política de atomicidad/rollback, score<10 -> estado=6 solo BBDD.
+# estados y política de atomicidad/rollback, score<10 -> estado=6 solo BBDD,
+# score=10 fuera de plazo (CADUCIDAD_*_SEC) -> estado=7 solo BBDD.
 # Patch A: evitar duplicados (EDIT) por UNIQUE(oid) sin romper CSV.
 # Patch B: SQLite WAL + busy_timeout + reintentos ante "database is locked".
 
-import os, sys, csv, json, time, socket, threading, atexit
+import os, sys, csv, json, time, queue, atexit
 import sqlite3
-import redis
 from typing import Optional
-from datetime import datetime, timezone
 from time import sleep
 
 # --- (NUEVO) Carga .env robusta ---
@@ -18,9 +17,8 @@ from dotenv import load_dotenv, find_dotenv
 ENV_PATH = find_dotenv(usecwd=True) or str(Path(__file__).resolve().parents[1].parent / ".env")
 load_dotenv(ENV_PATH, override=True)
 
-# --- Telegram (NUEVO, solo envío) ---
-import asyncio
-from telethon import TelegramClient, errors
+# Telethon/asyncio (envío a Telegram) y redis se importan al usarse: arranque rápido y
+# módulo importable sin ellos (las partes puras están en parser/pipeline.py)
 
 # --- PATH robusto para imports locales (añade padre para paquetes hermanos) ---
 BASE_DIR  = os.path.dirname(os.path.abspath(__file__))          # .../services/src/parser
@@ -30,13 +28,34 @@ if PARENT_DIR not in sys.path:
 if BASE_DIR not in sys.path:
     sys.path.insert(0, BASE_DIR)
 
-# === IMPORT CORRECTO DEL ANALIZADOR (SIN NOMBRES NUEVOS) ===
-from reglasnegocio.reglasnegocio import clasificar_mensajes, formatear_senal, formatear_motivo_rechazo
+# === Clasificación y construcción de filas (sin efectos al importar) ===
+from parser import pipeline
+from parser.pipeline import CSV_FIELDS, TELEGRAM_DISCLAIMER
+from parser.broadcast_server import BroadcastWorker
+from parser.sinks import Despachador, Sink
+from parser.posiciones import IndicePosiciones, GESTION
+from parser import outbox
+from comun.trazado import Traza, ahora_ms, iso_a_ms
+from comun import metricas
+from comun.oid import clave_mensaje
+from comun import logs
+from comun.prioridad import stream_prio, id_menor_igual
+from comun import entidades
+from comun import sesiones
+from comun import formato_stream
+
+log      = logs.configurar("parseador")
+log_msg  = logs.obtener("parseador.mensaje")   # detalle por mensaje (muestreable con LOG_SAMPLE)
+log_tg   = logs.obtener("parseador.tg")
+log_sock = logs.obtener("parseador.socket")
 
 # =================== CONFIG ===================
 REDIS_URL    = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 REDIS_STREAM = os.getenv("REDIS_STREAM", "pasarela:parse")
 REDIS_GROUP  = os.getenv("REDIS_GROUP", "parser")
+# Carril prioritario (gestión de posiciones) publicado por el listener; ver comun/prioridad.py
+REDIS_STREAM_PRIO = os.getenv("REDIS_STREAM_PRIO", stream_prio(REDIS_STREAM))
+PRIO_DEP_MAX_SEC  = float(os.getenv("PRIO_DEP_MAX_SEC", "30"))  # espera máxima por la señal de la que depende
 CONSUMER     = os.getenv("REDIS_CONSUMER", "local")
 
 # Usar misma ruta por defecto que visor.py para evitar inconsistencias
@@ -61,120 +80,99 @@ SOCKET_HOST = os.getenv("SOCKET_HOST", "127.0.0.1")
 SOCKET_PORT = int(os.getenv("SOCKET_PORT", "8888"))
 SOCKET_TIMEOUT = float(os.getenv("SOCKET_TIMEOUT", "1.0"))
 SOCKET_FALLBACK_TO_FILE = os.getenv("SOCKET_FALLBACK_TO_FILE", "true").lower() == "true"
+# Fan-out: cola acotada por cliente y expulsión de consumidores lentos
+SOCKET_CLIENT_QUEUE_MAX = int(os.getenv("SOCKET_CLIENT_QUEUE_MAX", "256"))
+SOCKET_SLOW_EVICT_SEC   = float(os.getenv("SOCKET_SLOW_EVICT_SEC", "5"))
+SOCKET_STATS_EVERY_SEC  = float(os.getenv("SOCKET_STATS_EVERY_SEC", "300"))  # 0 = sin log periódico de stats
+# Replay: buffer circular de las últimas N líneas (con nº de secuencia) para EA que reconectan
+SOCKET_REPLAY_SIZE = int(os.getenv("SOCKET_REPLAY_SIZE", "1000"))
+SOCKET_REPLAY_FILE = os.getenv("SOCKET_REPLAY_FILE", "").strip()  # vacío = solo en memoria
 
 _BROADCAST_SERVER = None
 
-CSV_FIELDS = [
-    'oid','ts_mt4_queue','symbol','order_type',
-    'entry_price','sl','tp1','tp2','tp3','tp4','comment','estado_operacion','channel'
-]
+# === Métricas (endpoint Prometheus; 0 = desactivado) ===
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+PARSER_METRICS_PORT = int(os.getenv("PARSER_METRICS_PORT", "9102"))
+
+PRS_ENTRADA   = metricas.contador("pasarela_parser_mensajes_total", "Mensajes leídos del stream", ("channel",))
+PRS_SALIDA    = metricas.contador("pasarela_parser_salida_total", "Señales entregadas por destino", ("channel", "destino"))
+PRS_CLASIF    = metricas.contador("pasarela_parser_clasificacion_total", "Resultado de clasificar_mensajes por acción", ("accion", "resultado"))
+PRS_ERRORES   = metricas.contador("pasarela_parser_errores_total", "Excepciones procesando mensajes", ("etapa",))
+PRS_ETAPA     = metricas.histograma("pasarela_parser_etapa_seconds", "Duración por etapa (spans)", ("etapa",))
+REDIS_RTT     = metricas.histograma("pasarela_redis_rtt_seconds", "Round-trip de comandos Redis", ("op",))
+BBDD_REINTENTOS = metricas.contador("pasarela_bbdd_lock_reintentos_total", "Reintentos por 'database is locked' en db_*", ("op",))
+metricas.gauge("pasarela_telegram_cola", "Envíos a Telegram en el carril (en cola + en curso)",
+               funcion=lambda: _DESPACHADOR.pendientes("telegram") if _DESPACHADOR is not None else 0)
+
+# === Sinks tras clasificar (parser/sinks.py): un carril (hilo FIFO) por destino ===
+SINK_CSV_REINTENTOS = int(os.getenv("SINK_CSV_REINTENTOS", "3"))
+SINK_TG_REINTENTOS  = int(os.getenv("SINK_TG_REINTENTOS", "1"))
+_DESPACHADOR = None
+
+# Outbox (parser/outbox.py): salidas pendientes al arrancar más antiguas que esto se caducan (no se envían tarde)
+OUTBOX_REANUDAR_MAX_SEC = float(os.getenv("OUTBOX_REANUDAR_MAX_SEC", "120"))
+OUTBOX_RETENCION_DIAS   = float(os.getenv("OUTBOX_RETENCION_DIAS", "7"))   # hecho/caducado/error: luego se purgan
+_OUTBOX_PURGA_SEC       = 3600   # también en marcha, no solo al arrancar
+OUTBOX_TABLE            = os.getenv("PASARELA_OUTBOX_TABLE", outbox.TABLA)
+# Una vez por mensaje, no por revisión: el EA deduplica por comment == oid y el oid cambia en cada edición
+# (el CSV ya deduplica por clave_mensaje en csv_write_row)
+SINKS_UNA_VEZ           = ("socket", "telegram")
+# Fallo de BBDD al registrar (lock tras todos los reintentos...): la entrada no se confirma y se reprocesa a los N s
+BBDD_REINTENTO_SEC      = float(os.getenv("BBDD_REINTENTO_SEC", "10"))
+_BBDD_FALLO = None   # monotonic del último fallo con entradas sin ACK (None = ninguno pendiente)
+
+# === Índice de señales abiertas (parser/posiciones.py): resuelve la gestión a su señal (ref_oid) ===
+POSICIONES_VENTANA_HORAS = float(os.getenv("POSICIONES_VENTANA_HORAS", "72"))
+_POSICIONES = IndicePosiciones(POSICIONES_VENTANA_HORAS)
+_POSICIONES_PODA_SEC = 60
+PRS_GESTION = metricas.contador("pasarela_parser_gestion_total", "Mensajes de gestión por resultado de la resolución a su señal", ("order_type", "resultado"))
+metricas.gauge("pasarela_parser_posiciones_abiertas", "Señales abiertas en el índice de posiciones",
+               funcion=lambda: len(_POSICIONES))
+
+# === Caducidad al procesar: plazo (s) desde ts_utc del mensaje; fuera de plazo -> estado=7 solo BBDD (0 = sin plazo) ===
+# (el listener solo filtra al capturar: tras una caída de Redis o un atasco del parser la cola puede traer señales viejas)
+CADUCIDAD_ENTRADA_SEC = float(os.getenv("CADUCIDAD_ENTRADA_SEC", "60"))    # BUY/SELL/LIMIT/STOP
+CADUCIDAD_GESTION_SEC = float(os.getenv("CADUCIDAD_GESTION_SEC", "300"))   # SL A/BREAKEVEN/PARCIAL/CERRAR
+# Recuperados por el listener tras una reconexión (recuperado=1): el ts_utc ya es viejo al capturarlos, plazos más cortos
+CADUCIDAD_RECUPERADO_ENTRADA_SEC = float(os.getenv("CADUCIDAD_RECUPERADO_ENTRADA_SEC", "20"))
+CADUCIDAD_RECUPERADO_GESTION_SEC = float(os.getenv("CADUCIDAD_RECUPERADO_GESTION_SEC", "120"))
+PRS_CADUCADAS = metricas.contador("pasarela_parser_caducadas_total", "Señales score=10 no enviadas a MT4 por llegar fuera de plazo", ("channel", "tipo"))
+
+# === Monitor de lag del consumer group (umbrales LAG_* en parser/lag_monitor.py) ===
+LAG_MONITOR_ENABLED = os.getenv("LAG_MONITOR_ENABLED", "1").strip() in ("1", "true", "yes", "on")
 
 def _should_run_broadcast() -> bool:
     return SOCKET_ENABLED and SOCKET_MODE == "socket"
 
-class BroadcastWorker(threading.Thread):
-    def __init__(self, host: str, port: int):
-        super().__init__(daemon=True)
-        self.host = host
-        self.port = port
-        self.sock = None
-        self.clients = []
-        self.clients_lock = threading.Lock()
-        self.stop_event = threading.Event()
-
-    def run(self):
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+# ACKs del EA (ACK <oid>) recibidos en el hilo del broadcast; el bucle principal los vuelca a BBDD
+_ACKS_EA = queue.SimpleQueue()
+
+def _on_ack_ea(oid: str, addr, resto: str = ""):
+    _ACKS_EA.put((oid, ahora_ms(), resto))
+
+def _procesar_acks_ea():
+    while True:
         try:
-            self.sock.bind((self.host, self.port))
-            self.sock.listen(8)
-            print(f"[broadcast] escuchando en {self.host}:{self.port}")
-            while not self.stop_event.is_set():
-                try:
-                    self.sock.settimeout(1.0)
-                    conn, addr = self.sock.accept()
-                except socket.timeout:
-                    continue
-                except OSError:
-                    if self.stop_event.is_set():
-                        break
-                    else:
-                        continue
-                print(f"[broadcast] cliente conectado {addr}")
-                with self.clients_lock:
-                    self.clients.append(conn)
-                threading.Thread(target=self._handle_client, args=(conn, addr), daemon=True).start()
-        except Exception as e:
-            print(f"[broadcast][ERROR] {e}")
-        finally:
-            self._close_all()
-            if self.sock:
-                try:
-                    self.sock.close()
-                except Exception:
-                    pass
-
-    def _handle_client(self, conn, addr):
+            oid, ts_ms, resto = _ACKS_EA.get_nowait()
+        except queue.Empty:
+            return
+        _POSICIONES.ack(oid, resto)
         try:
-            conn.settimeout(1.0)
-            while not self.stop_event.is_set():
-                try:
-                    data = conn.recv(1024)
-                    if not data:
-                        break
-                except socket.timeout:
-                    continue
-                except Exception:
-                    break
-        finally:
-            print(f"[broadcast] cliente desconectado {addr}")
-            with self.clients_lock:
-                try:
-                    self.clients.remove(conn)
-                except ValueError:
-                    pass
-            try:
-                conn.close()
-            except Exception:
-                pass
-
-    def broadcast(self, message: str):
-        payload = (message.rstrip("\r\n") + "\n").encode("utf-8")
-        dead = []
-        with self.clients_lock:
-            for c in self.clients:
-                try:
-                    c.sendall(payload)
-                except Exception as e:
-                    dead.append(c)
-                    print(f"[broadcast][WARN] error enviando a cliente: {e}")
-            for c in dead:
-                try:
-                    self.clients.remove(c)
-                except ValueError:
-                    pass
-                try:
-                    c.close()
-                except Exception:
-                    pass
-
-    def stop(self):
-        self.stop_event.set()
-        if self.sock:
-            try:
-                self.sock.close()
-            except Exception:
-                pass
+            db_registrar_ack_ea(oid, ts_ms)
+        except Exception as e:
+            log.warning(f"No se pudo registrar ACK del EA (oid={oid}): {e}")
 
-    def _close_all(self):
-        with self.clients_lock:
-            for c in self.clients:
-                try:
-                    c.close()
-                except Exception:
-                    pass
-            self.clients.clear()
+# Alertas del monitor de lag (hilo aparte); se envían a Telegram desde el bucle principal
+_ALERTAS_LAG = queue.SimpleQueue()
 
+def _procesar_alertas_lag():
+    while True:
+        try:
+            texto = _ALERTAS_LAG.get_nowait()
+        except queue.Empty:
+            return
+        if TG_API_ID and TG_API_HASH and TG_PHONE and TG_TARGETS:
+            _DESPACHADOR.enviar("telegram", tg_send, texto)
 
 def _start_broadcast():
     global _BROADCAST_SERVER
@@ -182,7 +180,13 @@ def _start_broadcast():
         return
     if _BROADCAST_SERVER is not None:
         return
-    server = BroadcastWorker(SOCKET_HOST, SOCKET_PORT)
+    server = BroadcastWorker(SOCKET_HOST, SOCKET_PORT,
+                             queue_max=SOCKET_CLIENT_QUEUE_MAX,
+                             evict_sec=SOCKET_SLOW_EVICT_SEC,
+                             stats_every_sec=SOCKET_STATS_EVERY_SEC,
+                             replay_size=SOCKET_REPLAY_SIZE,
+                             replay_file=SOCKET_REPLAY_FILE,
+                             on_ack=_on_ack_ea)
     server.start()
     _BROADCAST_SERVER = server
 
@@ -205,16 +209,22 @@ def _ensure_broadcast_alive():
 
 atexit.register(_stop_broadcast)
 
-# --- Telegram disclaimer ---
-TELEGRAM_DISCLAIMER = (
-    "Aviso: El contenido de este canal tiene carácter exclusivamente informativo y educativo; "
-    "no constituye asesoramiento financiero ni una invitación a operar. Cada miembro es responsable "
-    "de la ejecución de sus operaciones y de la gestión de su riesgo. El uso de la información se "
-    "realiza bajo el criterio y la responsabilidad de cada trader. Aquí solo se comparten referencias "
-    "de análisis, no instrucciones de inversión. En consecuencia, toda operación que usted ejecute será "
-    "una decisión personal e independiente, y los beneficios o pérdidas que se deriven dependerán únicamente "
-    "de su propia gestión."
-)
+def _stats_socket(campo: str) -> dict:
+    srv = _BROADCAST_SERVER
+    if srv is None:
+        return {}
+    return {(s["addr"],): s[campo] for s in srv.stats()}
+
+metricas.gauge("pasarela_socket_clientes", "Clientes EA conectados al broadcast",
+               funcion=lambda: _BROADCAST_SERVER.clientes_conectados if _BROADCAST_SERVER else 0)
+metricas.gauge("pasarela_socket_expulsados", "Clientes expulsados por lentos desde el arranque",
+               funcion=lambda: _BROADCAST_SERVER.expulsados if _BROADCAST_SERVER else 0)
+metricas.gauge("pasarela_socket_backlog_mensajes", "Líneas pendientes de enviar por cliente", ("cliente",),
+               funcion=lambda: _stats_socket("backlog_msgs"))
+metricas.gauge("pasarela_socket_latencia_ewma_ms", "Latencia de entrega (EWMA) por cliente", ("cliente",),
+               funcion=lambda: _stats_socket("lat_ewma_ms"))
+metricas.gauge("pasarela_socket_seq", "Último nº de secuencia difundido",
+               funcion=lambda: _BROADCAST_SERVER.ultimo_seq if _BROADCAST_SERVER else 0)
 
 # --- Telegram .env (NUEVO) ---
 TG_API_ID   = os.getenv("TELEGRAM_API_ID", "").strip()
@@ -235,6 +245,7 @@ def _tg_loop():
     Devuelve un event loop reutilizable evitando DeprecationWarning en Python 3.10+.
     """
     global _TG_LOOP
+    import asyncio
     try:
         return asyncio.get_running_loop()
     except RuntimeError:
@@ -248,11 +259,13 @@ async def _tg_ensure_session():
     global _TG_CLIENT
     if not (TG_API_ID and TG_API_HASH and TG_PHONE and TG_TARGETS):
         return None
+    from telethon import TelegramClient, errors
     if _TG_CLIENT is None:
-        _TG_CLIENT = TelegramClient(TG_SESSION, int(TG_API_ID), TG_API_HASH)
+        # Sesión propia del parseador (en memoria por defecto): no comparte el SQLite del listener
+        _TG_CLIENT = TelegramClient(sesiones.sesion("parser", TG_SESSION), int(TG_API_ID), TG_API_HASH)
     await _TG_CLIENT.connect()
     if not await _TG_CLIENT.is_user_authorized():
-        print("[TG] Autorizando sesión…")
+        log_tg.info("Autorizando sesión…")
         await _TG_CLIENT.send_code_request(TG_PHONE)
         code = input("[TG] Código (SMS/Telegram): ").strip().replace(" ", "")
         try:
@@ -263,7 +276,7 @@ async def _tg_ensure_session():
     return _TG_CLIENT
 
 async def _tg_resolve_target():
-    """Resuelve destino: link → @usuario → título exacto. Cachea en _TG_ENTITY."""
+    """Resuelve destino: caché de entidades → link → @usuario → título exacto. Cachea en _TG_ENTITY."""
     global _TG_ENTITY
     if _TG_ENTITY is not None:
         return _TG_ENTITY
@@ -272,52 +285,46 @@ async def _tg_resolve_target():
         return None
     cands = [c.strip() for c in TG_TARGETS.split("|") if c.strip()]
 
-    # 1) enlaces t.me
-    for c in cands:
-        if c.startswith(("http://","https://")) or "t.me/" in c:
-            try:
-                _TG_ENTITY = await client.get_entity(c); return _TG_ENTITY
-            except Exception: pass
-    # 2) @username
-    for c in cands:
-        u = c.lstrip("@")
-        if u:
-            try:
-                _TG_ENTITY = await client.get_entity(u); return _TG_ENTITY
-            except Exception: pass
-    # 3) título exacto
-    async for d in client.iter_dialogs():
-        if d.name in cands:
-            _TG_ENTITY = d.entity; return _TG_ENTITY
-
-    print("[TG] No se pudo resolver destino. Revisa TELEGRAM_TARGETS.")
+    cache = entidades.CacheEntidades()
+    try:
+        _TG_ENTITY = await entidades.resolver_destino(client, cache, cands)
+    finally:
+        cache.cerrar()
+    if _TG_ENTITY is not None:
+        return _TG_ENTITY
+
+    log_tg.warning("No se pudo resolver destino. Revisa TELEGRAM_TARGETS.")
     return None
 
-async def _tg_send_async(texto: str):
+async def _tg_send_async(texto: str) -> bool:
     if not texto:
-        return
+        return False
     client = await _tg_ensure_session()
     if client is None:
-        return
+        return False
     entity = await _tg_resolve_target()
     if entity is None:
-        return
+        return False
+    from telethon import errors
     try:
         await client.send_message(entity=entity, message=texto)
-        print("[TG] OK enviado.")
+        log_tg.info("OK enviado.")
+        return True
     except errors.FloodWaitError as fw:
-        print(f"[TG] FloodWait: espera {fw.seconds}s")
+        log_tg.warning(f"FloodWait: espera {fw.seconds}s")
     except errors.ChatWriteForbiddenError:
-        print("[TG] Sin permiso para publicar.")
+        log_tg.warning("Sin permiso para publicar.")
     except Exception as e:
-        print(f"[TG] Error: {e}")
+        log_tg.warning(f"Error: {e}")
+    return False
 
-def tg_send(texto: str):
-    """Envoltura síncrona mínima para llamar desde el flujo actual."""
+def tg_send(texto: str) -> bool:
+    """Envoltura síncrona mínima para llamar desde el flujo actual. True si Telegram aceptó el mensaje."""
     try:
-        _tg_loop().run_until_complete(_tg_send_async(texto))
+        return _tg_loop().run_until_complete(_tg_send_async(texto))
     except Exception as e:
-        print(f"[TG] WARN: {e}")
+        log_tg.warning(f"Envío fallido: {e}")
+        return False
 
 def socket_send_to_mt5(message: str, filename: str = None) -> bool:
     """
@@ -340,20 +347,20 @@ def socket_send_to_mt5(message: str, filename: str = None) -> bool:
         global _BROADCAST_SERVER
         if _BROADCAST_SERVER is not None:
             try:
-                _BROADCAST_SERVER.broadcast(trimmed)
-                print(f"[SOCKET] Mensaje enviado a clientes conectados ({SOCKET_HOST}:{SOCKET_PORT})")
+                n_clientes = _BROADCAST_SERVER.broadcast(trimmed)
+                log_sock.info(f"Mensaje encolado para {n_clientes} cliente(s) conectados ({SOCKET_HOST}:{SOCKET_PORT})")
                 send_success = True
             except Exception as sock_err:
-                print(f"[SOCKET][ERROR] Error en broadcast interno: {sock_err}")
+                log_sock.error(f"Error en broadcast interno: {sock_err}")
         else:
-            print("[SOCKET][WARN] Servidor interno no disponible.")
+            log_sock.warning("Servidor interno no disponible.")
 
     if send_success:
         return True
 
     if not SOCKET_FALLBACK_TO_FILE:
         return False
-    print("[SOCKET][WARN] Usando fallback a archivo compartido.")
+    log_sock.warning("Usando fallback a archivo compartido.")
 
     # --- Fallback: archivo compartido (compatibilidad MT4) ---
     if filename is None:
@@ -368,11 +375,11 @@ def socket_send_to_mt5(message: str, filename: str = None) -> bool:
         with open(filepath, "w", encoding="utf-8") as f:
             f.write(trimmed)
 
-        print(f"[SOCKET] Mensaje escrito en archivo: {filepath}")
+        log_sock.info(f"Mensaje escrito en archivo: {filepath}")
         return True
 
     except Exception as e:
-        print(f"[SOCKET][ERROR] Fallo al escribir archivo: {e}")
+        log_sock.error(f"Fallo al escribir archivo: {e}")
         return False
 
 def _csv_path():
@@ -415,7 +422,10 @@ def db_connect():
         sl REAL,
         tp REAL,
         comment TEXT,
-        PL REAL
+        PL REAL,
+        spans TEXT,
+        revision INTEGER,
+        oid_legacy TEXT
     )
     """)
     # Si ya existía sin la columna PL, añadirla (ignorar si ya existe)
@@ -428,6 +438,26 @@ def db_connect():
         cur.execute(f"ALTER TABLE {TABLE} ADD COLUMN texto_formateado TEXT")
     except Exception:
         pass
+    # Añadir spans (latencias por etapa, ver comun/trazado.py) si no existe
+    try:
+        cur.execute(f"ALTER TABLE {TABLE} ADD COLUMN spans TEXT")
+    except Exception:
+        pass
+    # oid v2 (comun/oid.py): revisión del mensaje y oid antiguo tras migrar (bbdd/migrar_oid.py)
+    for col, tipo in (("revision", "INTEGER"), ("oid_legacy", "TEXT")):
+        try:
+            cur.execute(f"ALTER TABLE {TABLE} ADD COLUMN {col} {tipo}")
+        except Exception:
+            pass
+    # Gestión -> oid(s) de la señal a la que se refiere (parser/posiciones.py)
+    try:
+        cur.execute(f"ALTER TABLE {TABLE} ADD COLUMN ref_oid TEXT")
+    except Exception:
+        pass
+    # Búsqueda (ch_id, msg_id) -> oid(s) sin recorrer la tabla
+    cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{TABLE}_ch_msg ON {TABLE}(ch_id, msg_id)")
+    # Salidas (CSV/socket/Telegram) de cada mensaje, escritas junto con su fila (parser/outbox.py)
+    outbox.asegurar_tabla(cur, OUTBOX_TABLE)
     conn.commit()
     conn.close()
     return sqlite3.connect(DB_FILE)
@@ -440,36 +470,25 @@ def db_exists_oid(oid: str) -> bool:
     finally:
         conn.close()
 
+def db_oids_de_mensaje(ch_id, msg_id) -> list:
+    """
+    Revisiones guardadas de un mensaje de Telegram: [(oid, revision), ...] de la más reciente
+    a la más antigua. Usa idx_<tabla>_ch_msg.
+    """
+    conn, cur = _conn()
+    try:
+        cur.execute(f"SELECT oid, revision FROM {TABLE} WHERE ch_id = ? AND msg_id = ? "
+                    f"ORDER BY COALESCE(revision, 1) DESC, oid DESC", (str(ch_id), str(msg_id)))
+        return cur.fetchall()
+    finally:
+        conn.close()
+
 def db_upsert_basico(meta: dict) -> None:
     """
     Escribe SOLO los campos básicos en Trazas_Unica (no operativos).
     Usa UPSERT por oid.
     """
-    SQL = f"""
-      INSERT INTO {TABLE}
-      (oid, ts_utc, ts_redis_ingest, ch_id, msg_id, channel, channel_username, sender_id, text, texto_formateado, score, estado_operacion)
-      VALUES (?,?,?,?,?,?,?,?,?,?,?,?)
-      ON CONFLICT(oid) DO UPDATE SET
-        ts_utc           = excluded.ts_utc,
-        ts_redis_ingest  = excluded.ts_redis_ingest,
-        ch_id            = excluded.ch_id,
-        msg_id           = excluded.msg_id,
-        channel          = excluded.channel,
-        channel_username = excluded.channel_username,
-        sender_id        = excluded.sender_id,
-        text             = excluded.text,
-        texto_formateado = excluded.texto_formateado,
-        score            = excluded.score,
-        estado_operacion = excluded.estado_operacion
-    """
-    params = (
-        meta['oid'], meta.get('ts_utc'), meta.get('ts_redis_ingest'),
-        meta.get('ch_id'), meta.get('msg_id'), meta.get('channel'),
-        meta.get('channel_username'), meta.get('sender_id'), meta.get('text'),
-        meta.get('texto_formateado'),
-        int(meta.get('score', 0)), int(meta.get('estado_operacion', 0)),
-    )
-
+    SQL, params = pipeline.sql_upsert_basico(meta, TABLE)
     backoff = 0.1
     for _ in range(5):
         conn, cur = _conn()
@@ -482,6 +501,7 @@ def db_upsert_basico(meta: dict) -> None:
             if "locked" in str(e).lower():
                 conn.close()
                 sleep(backoff)
+                BBDD_REINTENTOS.inc("upsert_basico")
                 backoff = min(backoff * 2, 1.6)
                 continue
             conn.close()
@@ -519,6 +539,7 @@ def db_update_ts_mt4_queue(oid: str, tsq: str) -> None:
             if 'locked' in str(e).lower():
                 conn.close()
                 sleep(backoff)
+                BBDD_REINTENTOS.inc("ts_mt4_queue")
                 backoff = min(backoff*2, 1.6)
                 continue
             conn.close()
@@ -535,40 +556,7 @@ def db_update_operativos(oid: str, fila: dict) -> None:
     Actualiza los campos operativos en Trazas_Unica cuando score=10.
     Usa los datos de la fila construida para el CSV.
     """
-    # Convertir tp1, tp2, tp3, tp4 a un solo campo tp concatenado con " / "
-    tp_val = None
-    tp_list = []
-    for i in range(1, 5):
-        tp_key = f'tp{i}'
-        if fila.get(tp_key) is not None:
-            tp_list.append(str(fila.get(tp_key)))
-    
-    # Si hay TPs, concatenarlos con " / "
-    if tp_list:
-        tp_val = " / ".join(tp_list)
-    
-    SQL = f"""
-        UPDATE {TABLE} 
-        SET ts_mt4_queue = ?,
-            symbol = ?,
-            order_type = ?,
-            entry_price = ?,
-            sl = ?,
-            tp = ?,
-            comment = ?
-        WHERE oid = ?
-    """
-    params = (
-        fila.get('ts_mt4_queue'),
-        fila.get('symbol'),
-        fila.get('order_type'),
-        fila.get('entry_price'),
-        fila.get('sl'),
-        tp_val,
-        fila.get('comment'),
-        oid
-    )
-    
+    SQL, params = pipeline.sql_operativos(oid, fila, TABLE)
     backoff = 0.1
     for _ in range(5):
         conn, cur = _conn()
@@ -580,6 +568,7 @@ def db_update_operativos(oid: str, fila: dict) -> None:
             if 'locked' in str(e).lower():
                 conn.close()
                 sleep(backoff)
+                BBDD_REINTENTOS.inc("operativos")
                 backoff = min(backoff*2, 1.6)
                 continue
             conn.close()
@@ -591,33 +580,141 @@ def db_update_operativos(oid: str, fila: dict) -> None:
                 pass
     raise sqlite3.OperationalError("database is locked (retries exhausted)")
 
-# =================== CSV ===================
-def csv_row_to_string(fila):
+def _db_ejecutar(SQL: str, params: tuple) -> None:
+    """Ejecuta una sentencia de escritura con los mismos reintentos ante lock que el resto de db_*."""
+    backoff = 0.1
+    for _ in range(5):
+        conn, cur = _conn()
+        try:
+            cur.execute(SQL, params)
+            conn.commit()
+            return
+        except sqlite3.OperationalError as e:
+            if 'locked' in str(e).lower():
+                conn.close()
+                sleep(backoff)
+                BBDD_REINTENTOS.inc("ejecutar")
+                backoff = min(backoff*2, 1.6)
+                continue
+            conn.close()
+            raise
+        finally:
+            try:
+                conn.close()
+            except Exception:
+                pass
+    raise sqlite3.OperationalError("database is locked (retries exhausted)")
+
+def _db_transaccion(fn, op: str):
+    """fn(cur) dentro de BEGIN IMMEDIATE ... COMMIT, con los mismos reintentos ante lock. Devuelve lo que devuelva fn."""
+    backoff = 0.1
+    for _ in range(5):
+        conn, cur = _conn()
+        try:
+            cur.execute("BEGIN IMMEDIATE")
+            valor = fn(cur)
+            conn.commit()
+            return valor
+        except sqlite3.OperationalError as e:
+            if conn.in_transaction:
+                conn.rollback()
+            if 'locked' in str(e).lower():
+                conn.close()
+                sleep(backoff)
+                BBDD_REINTENTOS.inc(op)
+                backoff = min(backoff*2, 1.6)
+                continue
+            raise
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            try:
+                conn.close()
+            except Exception:
+                pass
+    raise sqlite3.OperationalError("database is locked (retries exhausted)")
+
+def db_registrar_mensaje(basico: dict, fila: Optional[dict], stream: str, entry_id: str, salidas: dict) -> list:
     """
-    Convierte una fila dict a string CSV con el mismo formato que se escribe en el archivo.
-    Retorna la línea CSV como string (sin newline final).
+    Una sola transacción: básicos (+ operativos si hay fila) + salidas del outbox del mensaje.
+    Devuelve las salidas reclamadas para entregar ahora: [(oid, sink, payload, interrumpido)].
+    Si la entrada ya se había procesado, solo vuelve lo que quedó pendiente.
+    Edición (revision > 1): los SINKS_UNA_VEZ que ya salieron con otra revisión del mensaje no se repiten.
     """
-    import io
-    output = io.StringIO()
-    w = csv.DictWriter(output, fieldnames=CSV_FIELDS)
-    w.writerow({k: fila.get(k, "") for k in CSV_FIELDS})
-    return output.getvalue().rstrip('\r\n')
+    oid = basico['oid']
+
+    def _tx(cur):
+        cur.execute(*pipeline.sql_upsert_basico(basico, TABLE))
+        if fila is not None:
+            cur.execute(*pipeline.sql_operativos(oid, fila, TABLE))
+        nuevas = salidas
+        if salidas and int(basico.get('revision') or 1) > 1:
+            previas = [o for (o,) in cur.execute(f"SELECT oid FROM {TABLE} WHERE ch_id = ? AND msg_id = ? AND oid <> ?",
+                                                 (str(basico.get('ch_id')), str(basico.get('msg_id')), oid))]
+            ya = outbox.sinks_emitidos(cur, previas, OUTBOX_TABLE).intersection(SINKS_UNA_VEZ)
+            if ya:
+                log_msg.info(f"Edición: {','.join(sorted(ya))} ya enviados con otra revisión → omitidos (oid={oid})")
+                nuevas = {s: p for s, p in salidas.items() if s not in ya}
+        if nuevas:
+            outbox.insertar(cur, oid, stream, entry_id, nuevas, OUTBOX_TABLE)
+        return outbox.reclamar(cur, oid=oid, tabla=OUTBOX_TABLE)
+
+    return _db_transaccion(_tx, "registrar")
+
+def db_outbox_marcar(oid: str, sink: str, estado: str, error: str = None) -> None:
+    _db_transaccion(lambda cur: outbox.marcar(cur, oid, sink, estado, error, OUTBOX_TABLE), "outbox")
+
+def db_senales_recientes(desde_iso: str) -> list:
+    """Filas score=10 desde desde_iso (ts_utc), en orden cronológico, para reconstruir el índice de posiciones."""
+    conn, cur = _conn()
+    try:
+        cur.execute(f"SELECT oid, ch_id, msg_id, symbol, order_type, ref_oid, ts_utc FROM {TABLE} "
+                    f"WHERE score = 10 AND ts_utc >= ? ORDER BY ts_utc, rowid", (desde_iso,))
+        return cur.fetchall()
+    finally:
+        conn.close()
 
-def csv_write_row(fila):
+def db_update_spans(oid: str, spans_json: str) -> None:
+    """Guarda el registro compacto de latencias por etapa del mensaje."""
+    _db_ejecutar(f"UPDATE {TABLE} SET spans = ? WHERE oid = ?", (spans_json, oid))
+
+def db_registrar_ack_ea(oid: str, ts_ms: int) -> None:
+    """
+    Añade la etapa ack_ea (difusión por socket -> ACK del EA) al registro de spans.
+    Solo si la fila pasó por el socket y aún no tenía ACK.
+    """
+    SQL = f"""
+        UPDATE {TABLE}
+        SET spans = json_set(spans, '$.e.ack_ea', json_array(
+                json_extract(spans, '$.e.socket[0]'),
+                round(? - json_extract(spans, '$.w0') - json_extract(spans, '$.e.socket[0]'), 3)))
+        WHERE oid = ?
+          AND spans IS NOT NULL
+          AND json_extract(spans, '$.e.socket') IS NOT NULL
+          AND json_extract(spans, '$.e.ack_ea') IS NULL
+    """
+    _db_ejecutar(SQL, (ts_ms, oid))
+
+# =================== CSV ===================
+def csv_write_row(fila, comprobar_duplicado: bool = True):
     """
     Escribe asegurando cabecera y evitando duplicar por oid.
+    comprobar_duplicado=False: el llamante ya garantiza que no está (outbox), se evita releer el fichero.
     Devuelve (path, wrote_bool)
     """
     path = _csv_path()
     file_exists = os.path.exists(path)
-    # evitar duplicado por EDIT
+    # evitar duplicado por EDIT: otra revisión del mismo mensaje tiene otro oid pero la misma clave
+    clave = clave_mensaje(fila.get('oid'))
     already = False
-    if file_exists:
+    if file_exists and comprobar_duplicado:
         try:
             with open(path, 'r', encoding='utf-8', newline='') as fr:
                 r = csv.DictReader(fr)
                 for row in r:
-                    if row.get('oid') == fila.get('oid'):
+                    if clave_mensaje(row.get('oid')) == clave:
                         already = True
                         break
         except Exception:
@@ -649,410 +746,470 @@ def csv_remove_oid(oid):
         w.writerows(rows)
         f.flush()
 
-# =================== UTIL: construir fila desde clasificar_mensajes ===================
-def _best_result(resultados):
-    """Prioriza score=10; si no hay, devuelve el primero."""
-    for r in resultados:
-        if int(r.get("score", 0)) == 10:
-            return r
-    return resultados[0]
+# =================== REDIS ===================
+def ensure_group(r):
+    import redis
+    for stream in (REDIS_STREAM, REDIS_STREAM_PRIO):
+        try:
+            r.xgroup_create(name=stream, groupname=REDIS_GROUP, id="0", mkstream=True)
+        except redis.exceptions.ResponseError:
+            pass  # ya existe
+
+def _ack(r, entry_id, stream: str = REDIS_STREAM):
+    t = time.perf_counter()
+    r.xack(stream, REDIS_GROUP, entry_id)
+    REDIS_RTT.observe(time.perf_counter() - t, "xack")
+
+def _registrar_metricas_mensaje(traza, mejor_resultado: dict):
+    """Vuelca en métricas el resultado y los spans de un mensaje (una vez, al final)."""
+    mejor_resultado = mejor_resultado or {}
+    accion = mejor_resultado.get("accion") or "NINGUNA"
+    resultado = "senal" if int(mejor_resultado.get("score", 0)) == 10 else "rechazado"
+    PRS_CLASIF.inc(accion, resultado)
+    for etapa, (_off, dur_ms) in traza.e.items():
+        if dur_ms >= 0:
+            PRS_ETAPA.observe(dur_ms / 1000.0, etapa)
+
+# =================== SINKS ===================
+# Cada salida del outbox se entrega con su efecto y se marca 'hecho' justo después (mismo hilo del carril).
+def _sink_csv(p: dict, interrumpido: bool):
+    fila = p["fila"]
+    # Releer colaMT4.csv solo si puede estar ya: entrega interrumpida o edición de un mensaje ya encolado
+    path, wrote = csv_write_row(fila, comprobar_duplicado=interrumpido or p.get("comprobar", True))
+    log_msg.info(f"CSV {'OK' if wrote else 'OK(dup-skip)'} → {path} (oid={fila['oid']})")
+    if wrote:
+        PRS_SALIDA.inc(p.get("chusr", ""), "csv")
+    return wrote
+
+def _sink_socket(p: dict, interrumpido: bool):
+    if socket_send_to_mt5(p["linea"]):
+        PRS_SALIDA.inc(p.get("chusr", ""), "socket")
+        log_msg.info(f"SOCKET OK → fila CSV enviada a EA (oid={p.get('oid')})")
+        return True
+    raise RuntimeError("no se pudo enviar al EA")
+
+def _sink_telegram(p: dict, interrumpido: bool):
+    if not tg_send(p["texto"]):
+        raise RuntimeError("Telegram no aceptó el mensaje")
+    PRS_SALIDA.inc(p.get("chusr", ""), "telegram")
+
+_EFECTOS = {"csv": _sink_csv, "socket": _sink_socket, "telegram": _sink_telegram}
+
+def _entregar(oid: str, sink: str, payload: dict, interrumpido: bool):
+    valor = _EFECTOS[sink](payload, interrumpido)
+    db_outbox_marcar(oid, sink, outbox.HECHO)
+    return valor
+
+def _payload_telegram(data: dict, fila: dict, texto_formateado: Optional[str]) -> Optional[str]:
+    return pipeline.payload_telegram(data, fila, texto_formateado,
+                                     TELEGRAM_DISCLAIMER if TELEGRAM_DISCLAIMER_ENABLED else None)
+
+def _salidas_mensaje(data: dict, fila: dict, score: int,
+                     texto_formateado: Optional[str], chusr: str) -> dict:
+    """Salidas externas de un mensaje clasificado, como payloads del outbox: {sink: payload}."""
+    salidas = {}
+    if score != 10:
+        return salidas
+    oid = fila['oid']
+    if CSV_ENABLED:
+        salidas["csv"] = {"fila": fila, "chusr": chusr, "comprobar": int(data.get('revision') or 1) > 1}
+    else:
+        log_msg.info(f"CSV DESACTIVADO (CSV_ENABLED=0) → omitido (oid={oid})")
+    if ACTIVAR_SOCKET:
+        salidas["socket"] = {"linea": pipeline.fila_a_csv(fila), "oid": oid, "chusr": chusr}
+    else:
+        log_msg.info(f"SOCKET desactivado (ACTIVAR_SOCKET=false) → omitido (oid={oid})")
+
+    if TG_API_ID and TG_API_HASH and TG_PHONE and TG_TARGETS:
+        if TELEGRAM_ALERT_ENABLED:
+            payload = _payload_telegram(data, fila, texto_formateado)
+            if payload:
+                salidas["telegram"] = {"texto": payload, "chusr": chusr}
+        else:
+            log_tg.info("Envío omitido (TELEGRAM_ALERT_ENABLED=0).")
+    return salidas
 
-def _build_fila_desde_resultado(resultados, evento):
+def _sinks_outbox(reclamadas: list) -> list:
     """
-    Mapear salida de clasificar_mensajes(texto) -> fila estándar del parseador.
+    Sinks para las salidas reclamadas de UN oid. Orden = prioridad: primero lo que espera MT4
+    (CSV, socket); Telegram no se espera para el ACK.
     """
-    mejor = _best_result(resultados)
-    symbol = (mejor.get("activo") or (evento.get("symbol") if isinstance(evento, dict) else "") or "").upper() or None
-    accion = mejor.get("accion")
-    # si no hay 'accion', derivar de 'direccion'
-    if not accion:
-        dir_ = (mejor.get("direccion") or "").upper()
-        if dir_ in ("BUY", "SELL"):
-            accion = dir_
-    
-    # Caso especial: PARTIAL CLOSE - solo rellenar order_type y channel
-    es_partial_close = (accion == "PARTIAL CLOSE")
-    
-    # Caso especial: CLOSE - solo rellenar order_type y channel
-    es_close = (accion == "CLOSE")
-    
-    # Caso especial: BREAKEVEN - solo rellenar symbol, order_type y channel
-    es_breakeven = (accion == "BREAKEVEN")
-    
-    # Caso especial: MOVETO y STOPLOSSESTO
-    es_moveto = (accion == "MOVETO")
-    es_stoplossesto = (accion == "STOPLOSSESTO")
-    
-    if es_partial_close:
-        # PARTIAL CLOSE: solo order_type y channel, resto vacío
-        symbol = None
-        entry_price = None
-        sl = None
-        tp1 = None
-        tp2 = None
-        tp3 = None
-        tp4 = None
-    elif es_close:
-        # CLOSE: solo order_type y channel, resto vacío
-        symbol = None
-        entry_price = None
-        sl = None
-        tp1 = None
-        tp2 = None
-        tp3 = None
-        tp4 = None
-    elif es_breakeven:
-        entry_price = None
-        sl = None
-        tp1 = None
-        tp2 = None
-        tp3 = None
-        tp4 = None
-    elif es_moveto or es_stoplossesto:
-        # MOVETO/STOPLOSSESTO: solo necesita sl (el nuevo valor), no requiere entry_price ni TPs
-        entry_price = None  # No se requiere entrada
-        sl = mejor.get("sl")  # El nuevo valor del SL
-        tp1 = None
-        tp2 = None
-        tp3 = None
-        tp4 = None
+    sinks = []
+    for oid, sink, payload, interrumpido in sorted(reclamadas, key=lambda x: ("csv", "socket", "telegram").index(x[1])):
+        entregar = lambda oid=oid, sink=sink, p=payload, i=interrumpido: _entregar(oid, sink, p, i)
+        if sink == "csv":
+            # OSError: colaMT4.csv bloqueado un instante por el EA (Windows)
+            sinks.append(Sink("csv", "mt4", entregar,
+                              reintentos=SINK_CSV_REINTENTOS, espera=0.02, reintentar_en=(OSError,)))
+        elif sink == "socket":
+            sinks.append(Sink("socket", "socket", entregar))
+        elif sink == "telegram":
+            sinks.append(Sink("telegram", "telegram", entregar,
+                              reintentos=SINK_TG_REINTENTOS, espera=1.0, esperar=False))
+    return sinks
+
+def _cerrar_lote(lote, oid: str, traza, mejor_resultado: dict):
+    """Al terminar todos los sinks (Telegram incluido): errores (también en el outbox), spans y métricas."""
+    for nombre, res in lote.resultados.items():
+        if res.estado == "error":
+            PRS_ERRORES.inc(nombre)
+            log.error(f"Sink {nombre} FAIL tras {res.intentos} intento(s) (oid={oid}): {res.error}",
+                      exc_info=res.error if isinstance(res.error, BaseException) else None,
+                      extra={"oid": oid, "sink": nombre})
+            _DESPACHADOR.enviar("bbdd", db_outbox_marcar, oid, nombre, outbox.ERROR, str(res.error)[:500])
+        elif res.estado == "omitido":
+            log.warning(f"Sink {nombre} omitido (oid={oid}): {res.error}", extra={"oid": oid, "sink": nombre})
+    if traza is not None:
+        _DESPACHADOR.enviar("bbdd", _guardar_traza, oid, traza, mejor_resultado)
+
+def _cargar_posiciones():
+    """Reconstruye el índice de señales abiertas con la ventana POSICIONES_VENTANA_HORAS de Trazas_Unica."""
+    t = time.perf_counter()
+    desde = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() - POSICIONES_VENTANA_HORAS * 3600))
+    filas = [(oid, ch, msg, sym, ot, ref, iso_a_ms(ts)) for oid, ch, msg, sym, ot, ref, ts in db_senales_recientes(desde)]
+    n = _POSICIONES.reconstruir(filas)
+    log.info(f"Posiciones: {n} señales abiertas (de {len(filas)} filas, {POSICIONES_VENTANA_HORAS:g}h) "
+             f"en {(time.perf_counter() - t) * 1000:.0f} ms")
+
+def _resolver_posiciones(data: dict, basico: dict, fila: dict, mejor_resultado: dict):
+    """Señal -> se indexa; gestión -> fila['ref_oid'] con la(s) señal(es) objetivo."""
+    order_type = fila.get('order_type')
+    symbol = fila.get('symbol') or mejor_resultado.get('activo')
+    refs = _POSICIONES.aplicar(fila['oid'], basico.get('ch_id'), order_type, symbol=symbol,
+                               msg_id=data.get('msg_id'), reply_to=data.get('reply_to'), t_ms=ahora_ms())
+    if order_type not in GESTION:
+        return
+    fila['ref_oid'] = ";".join(refs) or None
+    PRS_GESTION.inc(order_type, "resuelta" if refs else "sin_objetivo")
+    if refs:
+        log_msg.info(f"Gestión {order_type} → ref_oid={fila['ref_oid']} (oid={fila['oid']})")
+    elif not symbol and data.get('reply_to') in (None, "", "0"):
+        log_msg.warning(f"Gestión {order_type} sin reply ni símbolo: no se resuelve, no se aplica a todo el canal "
+                        f"(oid={fila['oid']})")
     else:
-        entry_price = mejor.get("entrada_resuelta")
-        sl = mejor.get("sl")
-        tp_list = mejor.get("tp") or []
-        target_open = mejor.get("target_open", False)
-        
-        # Si target está abierto y no hay TPs, poner "OPEN" en tp1
-        if target_open and len(tp_list) == 0:
-            tp1 = "OPEN"
-            tp2 = None
-            tp3 = None
-            tp4 = None
-        else:
-            # Extraer hasta 4 TPs y asignarlos a tp1, tp2, tp3, tp4
-            tp1 = tp_list[0] if len(tp_list) > 0 else None
-            tp2 = tp_list[1] if len(tp_list) > 1 else None
-            tp3 = tp_list[2] if len(tp_list) > 2 else None
-            tp4 = tp_list[3] if len(tp_list) > 3 else None
-    
-    score = int(mejor.get("score", 0))
+        log_msg.warning(f"Gestión {order_type} sin señal abierta a la que referirse (oid={fila['oid']})")
 
-    # OID basado en fecha y msg_id si viene
-    today = datetime.now(timezone.utc).strftime("%Y%m%d")
+def _reanudar_outbox():
+    """
+    Al arrancar: salidas que un proceso anterior dejó sin entregar (en curso o pendientes).
+    Las más antiguas que OUTBOX_REANUDAR_MAX_SEC se caducan: una orden tardía es peor que ninguna.
+    """
+    ahora = ahora_ms()
+    limite = ahora - int(OUTBOX_REANUDAR_MAX_SEC * 1000)
+
+    def _tx(cur):
+        interrumpidas = outbox.recuperar_interrumpidas(cur, OUTBOX_TABLE)
+        caducadas = outbox.caducar(cur, limite, OUTBOX_TABLE)
+        purgadas = outbox.purgar(cur, ahora - int(OUTBOX_RETENCION_DIAS * 86_400_000), OUTBOX_TABLE)
+        return interrumpidas, caducadas, purgadas, outbox.reclamar(cur, desde_ms=limite, tabla=OUTBOX_TABLE)
+
+    interrumpidas, caducadas, purgadas, reclamadas = _db_transaccion(_tx, "outbox")
+    if interrumpidas or caducadas or reclamadas:
+        log.warning(f"Outbox: {len(reclamadas)} salidas por entregar ({interrumpidas} interrumpidas), "
+                    f"{caducadas} caducadas (> {OUTBOX_REANUDAR_MAX_SEC:.0f}s)")
+    if purgadas:
+        log.info(f"Outbox: {purgadas} salidas antiguas purgadas")
+    por_oid = {}
+    for item in reclamadas:
+        por_oid.setdefault(item[0], []).append(item)
+    for oid, items in por_oid.items():
+        lote = _DESPACHADOR.lanzar(_sinks_outbox(items))
+        lote.al_terminar(lambda l, oid=oid: _cerrar_lote(l, oid, None, None))
+
+def _purgar_outbox():
+    """Salidas terminadas (también las de error) más antiguas que OUTBOX_RETENCION_DIAS."""
+    antes = ahora_ms() - int(OUTBOX_RETENCION_DIAS * 86_400_000)
     try:
-        seq_raw = int(str((evento or {}).get("msg_id", "")) or 0) % 100000
-    except Exception:
-        hhmmss = datetime.now(timezone.utc).strftime("%H%M%S")
-        seq_raw = int(hhmmss) % 100000
-    oid = f"{today}-{str(seq_raw).zfill(5)}"
-
-    # Extraer nombre del canal de Telegram (prioriza channel_username, luego channel)
-    channel_name = None
-    if isinstance(evento, dict):
-        channel_name = evento.get('channel_username') or evento.get('channel') or None
-
-    # Mapear acciones a los nuevos textos para order_type
-    order_type_map = {
-        'MOVETO': 'SL A',
-        'STOPLOSSESTO': 'VARIOS SL A',
-        'PARTIAL CLOSE': 'PARCIAL',
-        'CLOSE': 'CERRAR'
-    }
-    order_type = order_type_map.get(accion, accion)
-    
-    fila = {
-        'oid': oid,
-        'ts_mt4_queue': datetime.now(timezone.utc).isoformat(),
-        'symbol': symbol,
-        'order_type': order_type,
-        'entry_price': entry_price,
-        'sl': sl,
-        'tp1': tp1,
-        'tp2': tp2,
-        'tp3': tp3,
-        'tp4': tp4,
-        'comment': oid,
-        'estado_operacion': 0,
-        'score': score,
-        'channel': channel_name
-    }
-    return fila
-
-def _build_basico_desde_evento(evento, score: int, oid: str, texto_formateado: Optional[str] = None) -> dict:
-    """Construye los campos básicos para Trazas_Unica a partir del mensaje Redis."""
-    # Fallbacks para texto y ch_id (único cambio solicitado)
-    txt = None
-    ch_id_val = None
-    if isinstance(evento, dict):
-        txt = (evento.get('text')
-               or evento.get('raw')
-               or evento.get('text/raw'))
-        ch_id_val = (evento.get('ch_id')
-                     or evento.get('chat_id')
-                     or evento.get('channel_id')
-                     or evento.get('ch'))
-
-    # Asegurar que ts_utc siempre tenga un valor (formato ISO UTC compatible con visor.py)
-    # visor.py espera formato: "YYYY-MM-DDTHH:MM:SSZ" (sin microsegundos, sin timezone offset)
-    ts_utc_val = None
-    if isinstance(evento, dict):
-        ts_utc_val = evento.get('ts_utc')
-    
-    # Normalizar formato: eliminar microsegundos y timezone offset
-    if ts_utc_val:
-        try:
-            ts_str = str(ts_utc_val).strip()
-            # Eliminar microsegundos si existen (.123456)
-            if '.' in ts_str:
-                ts_str = ts_str.split('.')[0]
-            # Eliminar timezone offset si existe (+00:00 o -05:00)
-            if '+' in ts_str:
-                ts_str = ts_str.split('+')[0]
-            elif len(ts_str) > 10 and ts_str[-6] in '+-':
-                # Formato como "2025-12-14T10:38:02-05:00"
-                ts_str = ts_str[:-6]
-            # Asegurar formato Z al final
-            if not ts_str.endswith('Z'):
-                ts_str += 'Z'
-            ts_utc_val = ts_str
-        except Exception:
-            # Si falla el parsing, usar timestamp actual
-            ts_utc_val = None
-    
-    # Si no hay ts_utc del evento o el formato es incorrecto, usar timestamp actual
-    if not ts_utc_val:
-        ts_utc_val = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
-    
-    return {
-        'oid': oid,
-        'ts_utc': ts_utc_val,
-        'ts_redis_ingest': (evento.get('ts_redis_ingest') if isinstance(evento, dict) else None),
-        'ch_id': ch_id_val,
-        'msg_id': (evento.get('msg_id') if isinstance(evento, dict) else None),
-        'channel': (evento.get('channel') if isinstance(evento, dict) else None),
-        'channel_username': (evento.get('channel_username') if isinstance(evento, dict) else None),
-        'sender_id': (evento.get('sender_id') if isinstance(evento, dict) else None),
-        'text': txt,
-        'texto_formateado': texto_formateado,
-        'score': int(score),
-        'estado_operacion': 0 if int(score) == 10 else 6,
-    }
+        purgadas = _db_transaccion(lambda cur: outbox.purgar(cur, antes, OUTBOX_TABLE), "outbox")
+    except sqlite3.Error as e:
+        log.warning(f"Outbox: purga aplazada ({e})")
+        return
+    if purgadas:
+        log.info(f"Outbox: {purgadas} salidas antiguas purgadas")
 
-# =================== REDIS ===================
-def ensure_group(r):
+def _guardar_traza(oid: str, traza, mejor_resultado: dict):
+    try:
+        db_update_spans(oid, traza.a_json())
+    except Exception as e:
+        log.warning(f"No se pudieron guardar spans (oid={oid}): {e}")
+    _registrar_metricas_mensaje(traza, mejor_resultado)
+
+# =================== CARRIL PRIORITARIO ===================
+_ULTIMO_NORMAL_PROCESADO = None   # ID del stream normal procesado más reciente (este proceso)
+_PRIO_DIFERIDOS = []              # [(entry_id, fields, t_llegada)] esperando a su dep_id, en orden
+
+def _txt(v) -> str:
+    return v.decode() if isinstance(v, bytes) else str(v)
+
+def _ordenar_lectura(resp):
+    """[(stream, msgs)] con el stream prioritario primero y nombres como str."""
+    lect = [(_txt(st), msgs) for st, msgs in resp]
+    return sorted(lect, key=lambda sm: sm[0] != REDIS_STREAM_PRIO)
+
+def _dep_cumplida(r, dep_id: str) -> bool:
+    """¿La entrada dep_id del stream normal ya está procesada (entregada y sin ACK pendiente)?"""
+    if not dep_id:
+        return True
+    if _ULTIMO_NORMAL_PROCESADO is not None and id_menor_igual(dep_id, _ULTIMO_NORMAL_PROCESADO):
+        return True
+    # Procesada antes de reiniciar o por otro consumidor del grupo
+    for g in r.xinfo_groups(REDIS_STREAM):
+        if _txt(g.get("name")) == REDIS_GROUP:
+            if not id_menor_igual(dep_id, _txt(g.get("last-delivered-id") or "0-0")):
+                return False
+            break
+    return not r.xpending_range(REDIS_STREAM, REDIS_GROUP, min=dep_id, max=dep_id, count=1)
+
+def _recibir_prioritario(r, entry_id, fields: dict):
+    """Entrada del stream prioritario: se procesa ya si su dep_id está hecho; si no, espera en cola."""
+    dep = _txt(fields.get(b"dep_id", b""))
+    if not _PRIO_DIFERIDOS and _dep_cumplida(r, dep):
+        _procesar_entrada(r, REDIS_STREAM_PRIO, entry_id, fields)
+        return
+    log_msg.info(f"PRIO diferido id={_txt(entry_id)} hasta procesar {dep} del stream normal")
+    _PRIO_DIFERIDOS.append((entry_id, fields, time.monotonic()))
+
+def _atender_prioritarios(r):
+    """Procesa, en orden, los prioritarios diferidos cuya dependencia ya se cumplió (o caducó)."""
+    while _PRIO_DIFERIDOS:
+        entry_id, fields, t_llegada = _PRIO_DIFERIDOS[0]
+        dep = _txt(fields.get(b"dep_id", b""))
+        if not _dep_cumplida(r, dep):
+            if time.monotonic() - t_llegada < PRIO_DEP_MAX_SEC:
+                return
+            log.warning(f"PRIO id={_txt(entry_id)}: {dep} sin procesar tras {PRIO_DEP_MAX_SEC:.0f}s; se procesa igualmente")
+        _PRIO_DIFERIDOS.pop(0)
+        _procesar_entrada(r, REDIS_STREAM_PRIO, entry_id, fields)
+
+def _recuperar_prioritarios(r):
+    """Al arrancar (y tras un fallo de BBDD): entradas prioritarias ya entregadas a este consumidor y sin ACK (diferidas al parar)."""
+    resp = r.xreadgroup(groupname=REDIS_GROUP, consumername=CONSUMER,
+                        streams={REDIS_STREAM_PRIO: "0"}, count=1000)
+    ya = {e for e, _f, _t in _PRIO_DIFERIDOS}
+    for _st, msgs in resp or []:
+        for entry_id, fields in msgs:
+            if fields and entry_id not in ya:
+                _PRIO_DIFERIDOS.append((entry_id, fields, time.monotonic()))
+    if _PRIO_DIFERIDOS:
+        log.info(f"{len(_PRIO_DIFERIDOS)} entradas prioritarias pendientes recuperadas")
+
+def _recuperar_pendientes(r):
+    """
+    Al arrancar (y tras un fallo de BBDD): entradas del stream normal entregadas a este consumidor y sin ACK
+    (caída a mitad, BBDD bloqueada).
+    Se reprocesan; el outbox evita repetir las salidas que ya se entregaron.
+    """
+    global _ULTIMO_NORMAL_PROCESADO
+    desde, n = "0", 0
+    while True:
+        resp = r.xreadgroup(groupname=REDIS_GROUP, consumername=CONSUMER,
+                            streams={REDIS_STREAM: desde}, count=100)
+        msgs = resp[0][1] if resp else []
+        if not msgs:
+            break
+        for entry_id, fields in msgs:
+            desde = entry_id
+            if not fields:               # borrada del stream mientras estaba pendiente
+                _ack(r, entry_id)
+                continue
+            _procesar_entrada(r, REDIS_STREAM, entry_id, fields)
+            _ULTIMO_NORMAL_PROCESADO = entry_id
+            n += 1
+    if n:
+        log.info(f"{n} entradas pendientes (sin ACK) reprocesadas")
+
+_CANALES = None   # diccionario de canales del formato v2 (username/título por channel_id)
+
+def _canales(r):
+    global _CANALES
+    if _CANALES is None or _CANALES.r is not r:
+        _CANALES = formato_stream.DiccionarioCanales(r)
+    return _CANALES
+
+def _procesar_entrada(r, stream: str, _msg_id, fields: dict):
+    """Clasifica una entrada del stream, lanza sus sinks y la confirma (ACK)."""
+    global _BBDD_FALLO
+    try:
+        data = formato_stream.decodificar(_msg_id, fields, _canales(r))   # v1 o v2 -> campos v1
+    except Exception as e:
+        # Ilegible (v2 corrupta, cuerpo msgpack sin msgpack instalado...): reintentarla no la arregla y,
+        # sin ACK, _recuperar_pendientes tropezaría con ella en cada arranque. Queda en el log y se confirma.
+        log.error(f"Entrada {_txt(_msg_id)} de {stream} no decodificable ({e!r}); se descarta con ACK. "
+                  f"Campos: {fields!r:.500}", extra={"entry_id": _txt(_msg_id)})
+        PRS_ERRORES.inc("decodificar")
+        _ack(r, _msg_id, stream)
+        return
     try:
-        r.xgroup_create(name=REDIS_STREAM, groupname=REDIS_GROUP, id="0", mkstream=True)
-    except redis.exceptions.ResponseError:
-        pass  # ya existe
+        traza = Traza()
+        traza.desde_evento(data)
+        mid   = data.get('msg_id')
+        ch_id = data.get('ch_id')
+        chusr = data.get('channel_username') or data.get('channel') or ""
+        PRS_ENTRADA.inc(chusr)
+        preview = (data.get('text') or data.get('raw') or data.get('text/raw') or "")[:80].replace("\n"," ")
+        log_msg.info(f"<- Redis msg_id={mid} ch_id={ch_id} ch={chusr} txt='{preview}'")
+
+        with traza.etapa("clasificar"):
+            clasif = pipeline.clasificar_evento(data)
+        if clasif is None:
+            log_msg.info(f"análisis→ msg_id={mid} sin resultados. ACK")
+            PRS_CLASIF.inc("NINGUNA", "sin_resultados")
+            _ack(r, _msg_id, stream)
+            return
+        mejor_resultado, score, texto_formateado, fila = clasif
+        oid   = fila['oid']
+
+        tps_str = ",".join([str(fila[f'tp{i}']) for i in range(1, 5) if fila.get(f'tp{i}') is not None])
+        log_msg.info(f"análisis→ msg_id={mid} score={score} sym={fila['symbol']} "
+                     f"type={fila['order_type']} entry={fila['entry_price']} sl={fila['sl']} tp=[{tps_str}] oid={oid}",
+                     extra={"oid": oid, "msg_id": mid, "channel": chusr, "score": score})
+
+        basico = pipeline.construir_basico(data, score, oid, texto_formateado)
+        edad = None
+        if score == 10:
+            if data.get('recuperado') == '1':
+                plazos = (pipeline.mas_estricto(CADUCIDAD_ENTRADA_SEC, CADUCIDAD_RECUPERADO_ENTRADA_SEC),
+                          pipeline.mas_estricto(CADUCIDAD_GESTION_SEC, CADUCIDAD_RECUPERADO_GESTION_SEC))
+            else:
+                plazos = (CADUCIDAD_ENTRADA_SEC, CADUCIDAD_GESTION_SEC)
+            edad = pipeline.caducidad(data, fila['order_type'], *plazos, ahora_ms())
+        if edad is not None:
+            # Fuera de plazo: ni a MT4 ni al índice de posiciones (el EA no la ejecuta)
+            basico['estado_operacion'] = fila['estado_operacion'] = pipeline.ESTADO_CADUCADA
+            PRS_CADUCADAS.inc(chusr, "entrada" if fila['order_type'] not in GESTION else "gestion")
+            log_msg.warning(f"⏱ caducada{' (recuperada)' if data.get('recuperado') == '1' else ''}: "
+                            f"{fila['order_type']} con {edad:.0f}s desde ts_utc={data.get('ts_utc')} "
+                            f"→ SOLO BBDD (estado={pipeline.ESTADO_CADUCADA}) (oid={oid})",
+                            extra={"oid": oid, "msg_id": mid, "channel": chusr})
+        elif score == 10:
+            _resolver_posiciones(data, basico, fila, mejor_resultado)
+
+        # 0) BBDD (básicos + operativos) y outbox en una transacción; 1..3) sinks de lo reclamado
+        salidas = _salidas_mensaje(data, fila, score, texto_formateado, chusr) if edad is None else {}
+        with traza.etapa("bbdd"):
+            try:
+                reclamadas = db_registrar_mensaje(basico, fila if score == 10 else None, stream, _txt(_msg_id), salidas)
+            except sqlite3.Error as e:
+                # Sin fila ni outbox no se puede entregar nada: sin ACK, la entrada sigue pendiente y se reprocesa
+                log.error(f"BBDD no disponible para oid={oid} ({e}); entrada {_txt(_msg_id)} sin ACK, "
+                          f"reintento en {BBDD_REINTENTO_SEC:.0f}s", extra={"oid": oid, "entry_id": _txt(_msg_id)})
+                PRS_ERRORES.inc("bbdd")
+                _BBDD_FALLO = time.monotonic()
+                return
+        log_msg.info(f"BBDD OK → básicos{' + operativos' if score == 10 else ''} guardados (oid={oid}, score={score})")
+        if len(reclamadas) < len(salidas):
+            log_msg.info(f"Outbox: {len(salidas) - len(reclamadas)} salida(s) ya entregadas o en curso (oid={oid})")
+        lote = _DESPACHADOR.lanzar(_sinks_outbox(reclamadas), traza)
+        lote.al_terminar(lambda l, oid=oid, traza=traza, mr=mejor_resultado: _cerrar_lote(l, oid, traza, mr))
+        resultados_sinks = lote.esperar()
+        if score == 10 and edad is None:
+            csv_status = "CSV desactivado" if not CSV_ENABLED else (
+                "CSV OK" if "csv" not in resultados_sinks or resultados_sinks["csv"].ok else "CSV FAIL")
+            log_msg.info(f"✅ score=10 → {csv_status} + campos operativos en BBDD.")
+        elif score < 10:
+            # score < 10 → solo básicos con estado=6
+            log_msg.info(f"ℹ score<10 → SOLO básicos (estado=6) (oid={oid})")
+
+        _ack(r, _msg_id, stream)
+
+    except Exception as e:
+        log.exception(f"Excepción procesando msg_id={data.get('msg_id')} : {e}",
+                      extra={"msg_id": data.get('msg_id'), "entry_id": _msg_id})
+        PRS_ERRORES.inc("mensaje")
+        _ack(r, _msg_id, stream)
 
 # =================== MAIN LOOP ===================
 def main():
-    print("[parseador] v3.3.4 (patch A+B) arrancando…")
-    print(f"[parseador] CSV destino = {_csv_path()}")
-    print(f"[parseador] BBDD destino = {os.path.abspath(DB_FILE)} | Tabla={TABLE}")
-    print(f"[parseador] Redis={REDIS_URL} Stream={REDIS_STREAM} Group={REDIS_GROUP} Consumer={CONSUMER}")
-    print(f"[parseador] ACTIVAR_SOCKET = {ACTIVAR_SOCKET} (envío por socket {'ACTIVADO' if ACTIVAR_SOCKET else 'DESACTIVADO'})")
+    log.info("v3.3.4 (patch A+B) arrancando…")
+    log.info(f"CSV destino = {_csv_path()}")
+    log.info(f"BBDD destino = {os.path.abspath(DB_FILE)} | Tabla={TABLE}")
+    log.info(f"Redis={REDIS_URL} Stream={REDIS_STREAM} (+{REDIS_STREAM_PRIO}) Group={REDIS_GROUP} Consumer={CONSUMER}")
+    log.info(f"ACTIVAR_SOCKET = {ACTIVAR_SOCKET} (envío por socket {'ACTIVADO' if ACTIVAR_SOCKET else 'DESACTIVADO'})")
 
     _ensure_broadcast_alive()
     if not _should_run_broadcast():
-        print("[parseador] broadcast interno desactivado (SOCKET_MODE != 'socket' o SOCKET_ENABLED=0).")
+        log.info("broadcast interno desactivado (SOCKET_MODE != 'socket' o SOCKET_ENABLED=0).")
 
     # --- Telegram: pre-resolver sesión/target una vez (si hay credenciales) ---
     if TG_API_ID and TG_API_HASH and TG_PHONE and TG_TARGETS:
         try:
             _tg_loop().run_until_complete(_tg_ensure_session())
             _tg_loop().run_until_complete(_tg_resolve_target())
-            print("[TG] Sesión/target listos.")
+            log_tg.info("Sesión/target listos.")
         except Exception as e:
-            print(f"[TG] Aviso inicialización: {e}")
+            log_tg.warning(f"Aviso inicialización: {e}")
     else:
-        print("[TG] Envío desactivado (faltan TELEGRAM_* en .env).")
+        log_tg.info("Envío desactivado (faltan TELEGRAM_* en .env).")
 
     # asegurar tabla
     db_connect().close()
 
+    global _DESPACHADOR, _ULTIMO_NORMAL_PROCESADO, _BBDD_FALLO
+    _DESPACHADOR = Despachador(("mt4", "socket", "bbdd", "telegram"))
+
+    import redis
     r = redis.Redis.from_url(REDIS_URL)
     ensure_group(r)
 
+    if metricas.servir(PARSER_METRICS_PORT, METRICS_HOST):
+        log.info(f"métricas en http://{METRICS_HOST}:{PARSER_METRICS_PORT}/metrics")
+
+    if LAG_MONITOR_ENABLED:
+        from parser.lag_monitor import MonitorLag
+        MonitorLag(r, REDIS_STREAM, REDIS_GROUP, alertar=_ALERTAS_LAG.put).start()
+        MonitorLag(r, REDIS_STREAM_PRIO, REDIS_GROUP, alertar=_ALERTAS_LAG.put).start()
+
+    _cargar_posiciones()
+    _reanudar_outbox()
+    _recuperar_pendientes(r)
+    _recuperar_prioritarios(r)
+
+    t_poda = t_purga = time.monotonic()
     while True:
         try:
+            if time.monotonic() - t_poda >= _POSICIONES_PODA_SEC:
+                _POSICIONES.podar()
+                t_poda = time.monotonic()
+            if time.monotonic() - t_purga >= _OUTBOX_PURGA_SEC:
+                _purgar_outbox()
+                t_purga = time.monotonic()
             _ensure_broadcast_alive()
+            _procesar_acks_ea()
+            _procesar_alertas_lag()
+            if _BBDD_FALLO is not None and time.monotonic() - _BBDD_FALLO >= BBDD_REINTENTO_SEC:
+                _BBDD_FALLO = None
+                _recuperar_pendientes(r)          # lo que quedó sin ACK por la BBDD (normal y prioritario)
+                _recuperar_prioritarios(r)
+            _atender_prioritarios(r)
+            # Ambos streams en la misma lectura (1 entrada de cada como máximo); el prioritario se atiende antes
             resp = r.xreadgroup(groupname=REDIS_GROUP, consumername=CONSUMER,
-                                streams={REDIS_STREAM: ">"}, count=1, block=5000)
+                                streams={REDIS_STREAM_PRIO: ">", REDIS_STREAM: ">"}, count=1,
+                                block=200 if _PRIO_DIFERIDOS else 5000)
             if not resp:
                 continue
 
-            for stream, msgs in resp:
+            for stream, msgs in _ordenar_lectura(resp):
                 for _msg_id, fields in msgs:
-                    try:
-                        data = {k.decode(): v.decode() for k, v in fields.items()}
-                        mid   = data.get('msg_id')
-                        ch_id = data.get('ch_id')
-                        chusr = data.get('channel_username') or data.get('channel') or ""
-                        preview = (data.get('text') or data.get('raw') or data.get('text/raw') or "")[:80].replace("\n"," ")
-                        print(f"[parseador] <- Redis msg_id={mid} ch_id={ch_id} ch={chusr} txt='{preview}'")
-
-                        # === USAR CLASIFICAR_MENSAJES DIRECTO ===
-                        texto = data.get('text') or data.get('raw') or data.get('text/raw') or ""
-                        resultados = clasificar_mensajes(texto)
-                        if not resultados:
-                            print(f"[parseador] análisis→ msg_id={mid} sin resultados. ACK")
-                            r.xack(REDIS_STREAM, REDIS_GROUP, _msg_id)
-                            continue
-                        mejor_resultado = _best_result(resultados)
-                        score = int(mejor_resultado.get("score", 0))
-                        
-                        # Formatear según el score
-                        if score == 10:
-                            texto_formateado = formatear_senal(mejor_resultado)
-                        else:
-                            texto_formateado = formatear_motivo_rechazo(mejor_resultado)
-
-                        fila = _build_fila_desde_resultado(resultados, data)
-                        oid   = fila['oid']
-
-                        tps_str = ",".join([str(fila[f'tp{i}']) for i in range(1, 5) if fila.get(f'tp{i}') is not None])
-                        print(f"[parseador] análisis→ msg_id={mid} score={score} sym={fila['symbol']} "
-                              f"type={fila['order_type']} entry={fila['entry_price']} sl={fila['sl']} tp=[{tps_str}] oid={oid}")
-
-                        # 0) Guardar SIEMPRE en Trazas_Unica los básicos (no operativos)
-                        basico = _build_basico_desde_evento(data, score, oid, texto_formateado)
-                        try:
-                            db_upsert_basico(basico)
-                            print(f"[parseador] BBDD OK → básicos guardados (oid={oid}, score={score})")
-                        except Exception as e:
-                            print(f"[parseador][ERROR] BBDD FAIL básicos (oid={oid}): {e}")
-                            import traceback
-                            traceback.print_exc()
-
-                        if score == 10:
-                            # 1) CSV (evita duplicado por oid) - Solo si CSV_ENABLED está activado
-                            if CSV_ENABLED:
-                                try:
-                                    path, wrote = csv_write_row(fila)
-                                    print(f"[parseador] CSV {'OK' if wrote else 'OK(dup-skip)'} → {path} (oid={oid})")
-                                    csv_ok = True
-                                except Exception as e:
-                                    print(f"[parseador][ERROR] CSV FAIL (oid={oid}): {e}")
-                                    csv_ok = False
-                            else:
-                                print(f"[parseador] CSV DESACTIVADO (CSV_ENABLED=0) → omitido (oid={oid})")
-
-                            # 1b) Actualizar campos operativos en Trazas_Unica
-                            try:
-                                db_update_operativos(oid, fila)
-                                print(f"[parseador] BBDD operativos OK → symbol={fila.get('symbol')} entry={fila.get('entry_price')} sl={fila.get('sl')} tp={fila.get('tp1')} (oid={oid})")
-                            except Exception as e:
-                                print(f"[parseador][ERROR] No se pudieron actualizar campos operativos (oid={oid}): {e}")
-                                import traceback
-                                traceback.print_exc()
-
-                            csv_status = "CSV OK" if CSV_ENABLED else "CSV desactivado"
-                            print(f"[parseador] ✅ score=10 → {csv_status} + campos operativos en BBDD.")
-
-                            # --- NUEVO: enviar fila CSV al EA de socket (mismo formato que se escribe en CSV) ---
-                            # Solo enviar si ACTIVAR_SOCKET está activado
-                            if ACTIVAR_SOCKET:
-                                try:
-                                    csv_line = csv_row_to_string(fila)
-                                    socket_send_to_mt5(csv_line)
-                                    print(f"[parseador] SOCKET OK → fila CSV enviada a EA (oid={oid})")
-                                except Exception as e:
-                                    print(f"[parseador][SOCKET][WARN] No se pudo enviar al EA (oid={oid}): {e}")
-                            else:
-                                print(f"[parseador] SOCKET desactivado (ACTIVAR_SOCKET=false) → omitido (oid={oid})")
-
-                            # --- NUEVO: enviar texto formateado a Telegram (SOLO si existe) ---
-                            try:
-                                if TG_API_ID and TG_API_HASH and TG_PHONE and TG_TARGETS:
-                                    if TELEGRAM_ALERT_ENABLED:
-                                        origen = data.get('channel_username')
-                                        if origen:
-                                            origen = origen.strip()
-                                            if origen and not origen.startswith("@"):
-                                                origen = f"@{origen.lstrip('@')}"
-                                        else:
-                                            alt = data.get('channel') or data.get('channel_title')
-                                            if alt:
-                                                alt_clean = alt.strip().replace(" ", "")
-                                                origen = f"@{alt_clean}" if alt_clean else None
-                                        
-                                        # Caso especial: PARCIAL (PARTIAL CLOSE) - mensaje simple
-                                        if fila.get('order_type') == 'PARCIAL':
-                                            if origen:
-                                                payload = f"{origen} PARCIAL"
-                                            else:
-                                                payload = "PARCIAL"
-                                        # Caso especial: CERRAR (CLOSE) - mensaje simple
-                                        elif fila.get('order_type') == 'CERRAR':
-                                            if origen:
-                                                payload = f"{origen} CERRAR"
-                                            else:
-                                                payload = "CERRAR"
-                                        # Caso especial: BREAKEVEN - mensaje simple
-                                        elif fila.get('order_type') == 'BREAKEVEN':
-                                            if origen:
-                                                payload = f"{origen} Breakeven"
-                                            else:
-                                                payload = "Breakeven"
-                                        # Caso especial: VARIOS SL A (STOPLOSSESTO) - mensaje con valor numérico
-                                        elif fila.get('order_type') == 'VARIOS SL A':
-                                            sl_valor = fila.get('sl')
-                                            if sl_valor is not None:
-                                                if origen:
-                                                    payload = f"{origen} VARIOS SL A {sl_valor}"
-                                                else:
-                                                    payload = f"VARIOS SL A {sl_valor}"
-                                            else:
-                                                payload = None
-                                        # Caso especial: SL A (MOVETO) - mensaje con valor numérico
-                                        elif fila.get('order_type') == 'SL A':
-                                            sl_valor = fila.get('sl')
-                                            if sl_valor is not None:
-                                                if origen:
-                                                    payload = f"{origen} SL A {sl_valor}"
-                                                else:
-                                                    payload = f"SL A {sl_valor}"
-                                            else:
-                                                payload = None
-                                        else:
-                                            # Caso normal: usar texto formateado
-                                            if texto_formateado:
-                                                lineas = []
-                                                if origen:
-                                                    lineas.append(origen)
-                                                lineas.append(texto_formateado)
-                                                if TELEGRAM_DISCLAIMER_ENABLED:
-                                                    lineas.append("")
-                                                    lineas.append(TELEGRAM_DISCLAIMER)
-                                                payload = "\n".join(lineas)
-                                            else:
-                                                payload = None
-                                        
-                                        if payload:
-                                            tg_send(payload)
-                                    else:
-                                        print("[TG] Envío omitido (TELEGRAM_ALERT_ENABLED=0).")
-                            except Exception as e:
-                                print(f"[TG] Aviso envío: {e}")
-
-                        else:
-                            # score < 10 → ya guardamos básicos con estado=6
-                            print(f"[parseador] ℹ score<10 → SOLO básicos (estado=6) (oid={oid})")
-
-                        r.xack(REDIS_STREAM, REDIS_GROUP, _msg_id)
-
-                    except Exception as e:
-                        print(f"[parseador][ERROR] Excepción procesando msg_id={data.get('msg_id')} : {e}")
-                        r.xack(REDIS_STREAM, REDIS_GROUP, _msg_id)
+                    if stream == REDIS_STREAM_PRIO:
+                        _recibir_prioritario(r, _msg_id, fields)
+                        continue
+                    _procesar_entrada(r, stream, _msg_id, fields)
+                    _ULTIMO_NORMAL_PROCESADO = _msg_id
+                    _atender_prioritarios(r)
 
         except KeyboardInterrupt:
-            print("[parseador] Interrumpido por usuario.")
+            log.info("Interrumpido por usuario.")
             break
         except Exception as loop_err:
-            print(f"[parseador][ERROR] Loop: {loop_err}")
+            log.error(f"Loop: {loop_err}")
             time.sleep(1)  # backoff suave
+    _DESPACHADOR.cerrar()
     _stop_broadcast()
 
 if __name__ == "__main__":
-    main()
+    if "--replay" in sys.argv[1:]:
+        # Banco de pruebas: reproduce tráfico sin Telegram/MT4 (ver parser/replay.py)
+        from parser import replay
+        replay.main([a for a in sys.argv[1:] if a != "--replay"], sys.modules[__name__])
+    else:
+        main()
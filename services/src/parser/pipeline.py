@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+# pipeline.py — pasos puros del parseador: clasificar un evento del stream y construir sus salidas
+# - Sin efectos al importar: ni .env, ni Redis, ni Telethon, ni logging, ni BBDD.
+# - Lo usan el bucle en vivo (parseador_local.py), --replay (replay.py) y herramientas por lotes
+#   (testermensajes/testeador_mensajes.py) sin cargar todo el parseador.
+# - Las sentencias SQL se devuelven como (SQL, params); ejecutarlas (y reintentar ante lock) es cosa de quien llama.
+
+import csv
+import io
+from typing import Optional
+from datetime import datetime, timezone
+
+from reglasnegocio.reglasnegocio import clasificar_mensajes, formatear_senal, formatear_motivo_rechazo
+from comun.oid import oid_desde_evento
+from comun.trazado import iso_a_ms
+from parser.posiciones import ABRE
+
+CSV_FIELDS = [
+    'oid','ts_mt4_queue','symbol','order_type',
+    'entry_price','sl','tp1','tp2','tp3','tp4','comment','estado_operacion','channel',
+    'ref_oid',   # gestión (SL A/BREAKEVEN/PARCIAL/CERRAR): oid(s) de la señal objetivo, separados por ';'
+]
+
+# estado_operacion en Trazas_Unica: 0 = a MT4, 6 = score<10 (solo BBDD), 7 = caducada (score=10 fuera de plazo, solo BBDD)
+ESTADO_CADUCADA = 7
+
+# --- Telegram disclaimer ---
+TELEGRAM_DISCLAIMER = (
+    "Aviso: El contenido de este canal tiene carácter exclusivamente informativo y educativo; "
+    "no constituye asesoramiento financiero ni una invitación a operar. Cada miembro es responsable "
+    "de la ejecución de sus operaciones y de la gestión de su riesgo. El uso de la información se "
+    "realiza bajo el criterio y la responsabilidad de cada trader. Aquí solo se comparten referencias "
+    "de análisis, no instrucciones de inversión. En consecuencia, toda operación que usted ejecute será "
+    "una decisión personal e independiente, y los beneficios o pérdidas que se deriven dependerán únicamente "
+    "de su propia gestión."
+)
+
+# =================== CLASIFICACIÓN ===================
+def clasificar_evento(data: dict):
+    """
+    Clasificación pura de un evento del stream.
+    Devuelve (mejor_resultado, score, texto_formateado, fila) o None si no hay resultados.
+    """
+    # === USAR CLASIFICAR_MENSAJES DIRECTO ===
+    texto = data.get('text') or data.get('raw') or data.get('text/raw') or ""
+    resultados = clasificar_mensajes(texto)
+    if not resultados:
+        return None
+    mejor = mejor_resultado(resultados)
+    score = int(mejor.get("score", 0))
+
+    # Formatear según el score
+    if score == 10:
+        texto_formateado = formatear_senal(mejor)
+    else:
+        texto_formateado = formatear_motivo_rechazo(mejor)
+
+    fila = construir_fila(resultados, data)
+    return mejor, score, texto_formateado, fila
+
+def mejor_resultado(resultados):
+    """Prioriza score=10; si no hay, devuelve el primero."""
+    for r in resultados:
+        if int(r.get("score", 0)) == 10:
+            return r
+    return resultados[0]
+
+def construir_fila(resultados, evento):
+    """
+    Mapear salida de clasificar_mensajes(texto) -> fila estándar del parseador.
+    """
+    mejor = mejor_resultado(resultados)
+    symbol = (mejor.get("activo") or (evento.get("symbol") if isinstance(evento, dict) else "") or "").upper() or None
+    accion = mejor.get("accion")
+    # si no hay 'accion', derivar de 'direccion'
+    if not accion:
+        dir_ = (mejor.get("direccion") or "").upper()
+        if dir_ in ("BUY", "SELL"):
+            accion = dir_
+    
+    # Caso especial: PARTIAL CLOSE - solo rellenar order_type y channel
+    es_partial_close = (accion == "PARTIAL CLOSE")
+    
+    # Caso especial: CLOSE - solo rellenar order_type y channel
+    es_close = (accion == "CLOSE")
+    
+    # Caso especial: BREAKEVEN - solo rellenar symbol, order_type y channel
+    es_breakeven = (accion == "BREAKEVEN")
+    
+    # Caso especial: MOVETO y STOPLOSSESTO
+    es_moveto = (accion == "MOVETO")
+    es_stoplossesto = (accion == "STOPLOSSESTO")
+    
+    if es_partial_close:
+        # PARTIAL CLOSE: solo order_type y channel, resto vacío
+        symbol = None
+        entry_price = None
+        sl = None
+        tp1 = None
+        tp2 = None
+        tp3 = None
+        tp4 = None
+    elif es_close:
+        # CLOSE: solo order_type y channel, resto vacío
+        symbol = None
+        entry_price = None
+        sl = None
+        tp1 = None
+        tp2 = None
+        tp3 = None
+        tp4 = None
+    elif es_breakeven:
+        entry_price = None
+        sl = None
+        tp1 = None
+        tp2 = None
+        tp3 = None
+        tp4 = None
+    elif es_moveto or es_stoplossesto:
+        # MOVETO/STOPLOSSESTO: solo necesita sl (el nuevo valor), no requiere entry_price ni TPs
+        entry_price = None  # No se requiere entrada
+        sl = mejor.get("sl")  # El nuevo valor del SL
+        tp1 = None
+        tp2 = None
+        tp3 = None
+        tp4 = None
+    else:
+        entry_price = mejor.get("entrada_resuelta")
+        sl = mejor.get("sl")
+        tp_list = mejor.get("tp") or []
+        target_open = mejor.get("target_open", False)
+        
+        # Si target está abierto y no hay TPs, poner "OPEN" en tp1
+        if target_open and len(tp_list) == 0:
+            tp1 = "OPEN"
+            tp2 = None
+            tp3 = None
+            tp4 = None
+        else:
+            # Extraer hasta 4 TPs y asignarlos a tp1, tp2, tp3, tp4
+            tp1 = tp_list[0] if len(tp_list) > 0 else None
+            tp2 = tp_list[1] if len(tp_list) > 1 else None
+            tp3 = tp_list[2] if len(tp_list) > 2 else None
+            tp4 = tp_list[3] if len(tp_list) > 3 else None
+    
+    score = int(mejor.get("score", 0))
+
+    # OID: tiempo de ingesta + canal + msg_id + revisión (ver comun/oid.py)
+    oid = oid_desde_evento(evento if isinstance(evento, dict) else {})
+
+    # Extraer nombre del canal de Telegram (prioriza channel_username, luego channel)
+    channel_name = None
+    if isinstance(evento, dict):
+        channel_name = evento.get('channel_username') or evento.get('channel') or None
+
+    # Mapear acciones a los nuevos textos para order_type
+    order_type_map = {
+        'MOVETO': 'SL A',
+        'STOPLOSSESTO': 'VARIOS SL A',
+        'PARTIAL CLOSE': 'PARCIAL',
+        'CLOSE': 'CERRAR'
+    }
+    order_type = order_type_map.get(accion, accion)
+    
+    fila = {
+        'oid': oid,
+        'ts_mt4_queue': datetime.now(timezone.utc).isoformat(),
+        'symbol': symbol,
+        'order_type': order_type,
+        'entry_price': entry_price,
+        'sl': sl,
+        'tp1': tp1,
+        'tp2': tp2,
+        'tp3': tp3,
+        'tp4': tp4,
+        'comment': oid,
+        'estado_operacion': 0,
+        'score': score,
+        'channel': channel_name,
+        'ref_oid': None,     # lo rellena el índice de posiciones (parser/posiciones.py)
+    }
+    return fila
+
+def construir_basico(evento, score: int, oid: str, texto_formateado: Optional[str] = None) -> dict:
+    """Construye los campos básicos para Trazas_Unica a partir del mensaje Redis."""
+    # Fallbacks para texto y ch_id (único cambio solicitado)
+    txt = None
+    ch_id_val = None
+    if isinstance(evento, dict):
+        txt = (evento.get('text')
+               or evento.get('raw')
+               or evento.get('text/raw'))
+        ch_id_val = (evento.get('ch_id')
+                     or evento.get('chat_id')
+                     or evento.get('channel_id')
+                     or evento.get('ch'))
+
+    # Asegurar que ts_utc siempre tenga un valor (formato ISO UTC compatible con visor.py)
+    # visor.py espera formato: "YYYY-MM-DDTHH:MM:SSZ" (sin microsegundos, sin timezone offset)
+    ts_utc_val = None
+    if isinstance(evento, dict):
+        ts_utc_val = evento.get('ts_utc')
+    
+    # Normalizar formato: eliminar microsegundos y timezone offset
+    if ts_utc_val:
+        try:
+            ts_str = str(ts_utc_val).strip()
+            # Eliminar microsegundos si existen (.123456)
+            if '.' in ts_str:
+                ts_str = ts_str.split('.')[0]
+            # Eliminar timezone offset si existe (+00:00 o -05:00)
+            if '+' in ts_str:
+                ts_str = ts_str.split('+')[0]
+            elif len(ts_str) > 10 and ts_str[-6] in '+-':
+                # Formato como "2025-12-14T10:38:02-05:00"
+                ts_str = ts_str[:-6]
+            # Asegurar formato Z al final
+            if not ts_str.endswith('Z'):
+                ts_str += 'Z'
+            ts_utc_val = ts_str
+        except Exception:
+            # Si falla el parsing, usar timestamp actual
+            ts_utc_val = None
+    
+    # Si no hay ts_utc del evento o el formato es incorrecto, usar timestamp actual
+    if not ts_utc_val:
+        ts_utc_val = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    
+    return {
+        'oid': oid,
+        'ts_utc': ts_utc_val,
+        'ts_redis_ingest': (evento.get('ts_redis_ingest') if isinstance(evento, dict) else None),
+        'ch_id': ch_id_val,
+        'msg_id': (evento.get('msg_id') if isinstance(evento, dict) else None),
+        'revision': (int(evento.get('revision') or 1) if isinstance(evento, dict) else 1),
+        'channel': (evento.get('channel') if isinstance(evento, dict) else None),
+        'channel_username': (evento.get('channel_username') if isinstance(evento, dict) else None),
+        'sender_id': (evento.get('sender_id') if isinstance(evento, dict) else None),
+        'text': txt,
+        'texto_formateado': texto_formateado,
+        'score': int(score),
+        'estado_operacion': 0 if int(score) == 10 else 6,
+    }
+
+# =================== SALIDAS ===================
+def fila_a_csv(fila):
+    """
+    Convierte una fila dict a string CSV con el mismo formato que se escribe en el archivo.
+    Retorna la línea CSV como string (sin newline final).
+    """
+    output = io.StringIO()
+    w = csv.DictWriter(output, fieldnames=CSV_FIELDS)
+    w.writerow({k: fila.get(k, "") for k in CSV_FIELDS})
+    return output.getvalue().rstrip('\r\n')
+
+def payload_telegram(data: dict, fila: dict, texto_formateado: Optional[str], disclaimer: Optional[str] = None) -> Optional[str]:
+    """Texto a publicar en Telegram para una señal (None = no hay nada que enviar)."""
+    origen = data.get('channel_username')
+    if origen:
+        origen = origen.strip()
+        if origen and not origen.startswith("@"):
+            origen = f"@{origen.lstrip('@')}"
+    else:
+        alt = data.get('channel') or data.get('channel_title')
+        if alt:
+            alt_clean = alt.strip().replace(" ", "")
+            origen = f"@{alt_clean}" if alt_clean else None
+
+    # Caso especial: PARCIAL (PARTIAL CLOSE) - mensaje simple
+    if fila.get('order_type') == 'PARCIAL':
+        if origen:
+            payload = f"{origen} PARCIAL"
+        else:
+            payload = "PARCIAL"
+    # Caso especial: CERRAR (CLOSE) - mensaje simple
+    elif fila.get('order_type') == 'CERRAR':
+        if origen:
+            payload = f"{origen} CERRAR"
+        else:
+            payload = "CERRAR"
+    # Caso especial: BREAKEVEN - mensaje simple
+    elif fila.get('order_type') == 'BREAKEVEN':
+        if origen:
+            payload = f"{origen} Breakeven"
+        else:
+            payload = "Breakeven"
+    # Caso especial: VARIOS SL A (STOPLOSSESTO) - mensaje con valor numérico
+    elif fila.get('order_type') == 'VARIOS SL A':
+        sl_valor = fila.get('sl')
+        if sl_valor is not None:
+            if origen:
+                payload = f"{origen} VARIOS SL A {sl_valor}"
+            else:
+                payload = f"VARIOS SL A {sl_valor}"
+        else:
+            payload = None
+    # Caso especial: SL A (MOVETO) - mensaje con valor numérico
+    elif fila.get('order_type') == 'SL A':
+        sl_valor = fila.get('sl')
+        if sl_valor is not None:
+            if origen:
+                payload = f"{origen} SL A {sl_valor}"
+            else:
+                payload = f"SL A {sl_valor}"
+        else:
+            payload = None
+    else:
+        # Caso normal: usar texto formateado
+        if texto_formateado:
+            lineas = []
+            if origen:
+                lineas.append(origen)
+            lineas.append(texto_formateado)
+            if disclaimer:
+                lineas.append("")
+                lineas.append(disclaimer)
+            payload = "\n".join(lineas)
+        else:
+            payload = None
+    return payload
+
+# =================== CADUCIDAD ===================
+def caducidad(data: dict, order_type: str, plazo_entrada: float, plazo_gestion: float, ahora: int):
+    """
+    Edad (s) del mensaje según su ts_utc si supera el plazo de su acción; None si está en plazo.
+    Plazo por acción: entradas (BUY/SELL/LIMIT/STOP) plazo_entrada, el resto plazo_gestion. 0 = sin plazo.
+    Sin ts_utc válido no se puede juzgar: en plazo.
+    """
+    plazo = plazo_entrada if order_type in ABRE else plazo_gestion
+    t = iso_a_ms(data.get('ts_utc'))
+    if not plazo or t is None:
+        return None
+    edad = (ahora - t) / 1000.0
+    return edad if edad > plazo else None
+
+def mas_estricto(plazo: float, plazo_recuperado: float) -> float:
+    """Plazo para un mensaje recuperado por el listener (recuperado=1): el menor de los dos (0 = sin plazo)."""
+    plazos = [p for p in (plazo, plazo_recuperado) if p]
+    return min(plazos) if plazos else 0
+
+# =================== SQL (Trazas_Unica) ===================
+def sql_upsert_basico(meta: dict, tabla: str):
+    """(SQL, params) del UPSERT por oid de los campos básicos."""
+    SQL = f"""
+      INSERT INTO {tabla}
+      (oid, ts_utc, ts_redis_ingest, ch_id, msg_id, revision, channel, channel_username, sender_id, text, texto_formateado, score, estado_operacion)
+      VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)
+      ON CONFLICT(oid) DO UPDATE SET
+        ts_utc           = excluded.ts_utc,
+        ts_redis_ingest  = excluded.ts_redis_ingest,
+        ch_id            = excluded.ch_id,
+        msg_id           = excluded.msg_id,
+        revision         = excluded.revision,
+        channel          = excluded.channel,
+        channel_username = excluded.channel_username,
+        sender_id        = excluded.sender_id,
+        text             = excluded.text,
+        texto_formateado = excluded.texto_formateado,
+        score            = excluded.score,
+        estado_operacion = excluded.estado_operacion
+    """
+    params = (
+        meta['oid'], meta.get('ts_utc'), meta.get('ts_redis_ingest'),
+        meta.get('ch_id'), meta.get('msg_id'), meta.get('revision'), meta.get('channel'),
+        meta.get('channel_username'), meta.get('sender_id'), meta.get('text'),
+        meta.get('texto_formateado'),
+        int(meta.get('score', 0)), int(meta.get('estado_operacion', 0)),
+    )
+    return SQL, params
+
+def sql_operativos(oid: str, fila: dict, tabla: str):
+    """(SQL, params) del UPDATE de campos operativos a partir de la fila del CSV."""
+    # Convertir tp1, tp2, tp3, tp4 a un solo campo tp concatenado con " / "
+    tp_val = None
+    tp_list = []
+    for i in range(1, 5):
+        tp_key = f'tp{i}'
+        if fila.get(tp_key) is not None:
+            tp_list.append(str(fila.get(tp_key)))
+    
+    # Si hay TPs, concatenarlos con " / "
+    if tp_list:
+        tp_val = " / ".join(tp_list)
+    
+    SQL = f"""
+        UPDATE {tabla} 
+        SET ts_mt4_queue = ?,
+            symbol = ?,
+            order_type = ?,
+            entry_price = ?,
+            sl = ?,
+            tp = ?,
+            comment = ?,
+            ref_oid = COALESCE(?, ref_oid)
+        WHERE oid = ?
+    """
+    params = (
+        fila.get('ts_mt4_queue'),
+        fila.get('symbol'),
+        fila.get('order_type'),
+        fila.get('entry_price'),
+        fila.get('sl'),
+        tp_val,
+        fila.get('comment'),
+        fila.get('ref_oid'),
+        oid
+    )
+    return SQL, params
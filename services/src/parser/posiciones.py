@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+# posiciones.py — índice en memoria de señales abiertas por canal y símbolo
+# - Un mensaje de gestión (SL A / VARIOS SL A / BREAKEVEN / PARCIAL / CERRAR) se resuelve a los oid
+#   de las señales a las que se refiere; el parseador los manda al EA en ref_oid (CSV/socket) y BBDD.
+# - Resolución, de más a menos precisa:
+#     1) respuesta (reply) en Telegram al mensaje de una señal abierta -> esa señal
+#     2) símbolo del mensaje de gestión -> señales abiertas de ese canal y símbolo
+#     3) sin reply (válido) ni símbolo -> ninguna: no se resuelve. Actuar sobre todas las señales del canal
+#        por un "cerrad" ambiguo es peor que no hacer nada; queda en el log y en métricas (sin_objetivo)
+#   SL A (MOVETO) se queda solo con la más reciente; el resto de acciones aplica a todas.
+# - Se mantiene con los eventos del parseador (señal -> abre; CERRAR -> cierra sus objetivos) y con los
+#   ACK del EA ("ACK <oid> CERRADA|RECHAZADA" -> cierra). Las señales caducan tras POSICIONES_VENTANA_HORAS.
+# - Al arrancar se reconstruye desde Trazas_Unica (misma ventana) en una sola consulta.
+# - Cada gestión aplicada se recuerda por mensaje (clave_mensaje(oid) -> objetivos): si la misma entrada
+#   vuelve a procesarse (sin ACK al parar, reprocesada por _recuperar_pendientes) o llega una edición del
+#   mensaje (otro oid, misma clave), devuelve los mismos objetivos y no vuelve a cerrar nada; resolverla
+#   otra vez caería en el símbolo porque su objetivo ya está cerrado.
+# - Sin bloqueos: se usa solo desde el bucle principal del parseador.
+
+import time
+from collections import OrderedDict
+
+from comun.oid import clave_mensaje
+
+ABRE = ("BUY", "SELL", "BUY LIMIT", "SELL LIMIT", "BUY STOP", "SELL STOP")
+GESTION = ("SL A", "VARIOS SL A", "BREAKEVEN", "PARCIAL", "CERRAR")
+ACK_CIERRA = ("CERRADA", "CLOSED", "RECHAZADA", "REJECTED", "ERROR")
+
+
+class Posicion:
+    __slots__ = ("oid", "canal", "symbol", "order_type", "clave", "t_ms", "confirmada")
+
+    def __init__(self, oid, canal, symbol, order_type, clave, t_ms):
+        self.oid = oid
+        self.canal = canal
+        self.symbol = symbol
+        self.order_type = order_type
+        self.clave = clave            # (canal, msg_id) del mensaje de la señal
+        self.t_ms = t_ms
+        self.confirmada = False       # ACK del EA recibido
+
+
+class IndicePosiciones:
+    def __init__(self, ventana_horas: float = 72):
+        self.ventana_ms = int(ventana_horas * 3_600_000)
+        self._oid = {}                # oid -> Posicion
+        self._simbolo = {}            # (canal, symbol) -> OrderedDict(oid -> None), de antigua a reciente
+        self._mensaje = {}            # (canal, msg_id) -> oid
+        self._gestiones = {}          # clave_mensaje de gestión ya aplicada -> (objetivos, t_ms)
+
+    def __len__(self):
+        return len(self._oid)
+
+    def abrir(self, oid: str, canal, symbol, order_type: str, msg_id=None, t_ms: int = None):
+        """Registra una señal abierta. Una edición (mismo mensaje) no abre otra: el EA tiene la primera."""
+        canal = str(canal or "")
+        clave = (canal, str(msg_id)) if msg_id not in (None, "") else None
+        if oid in self._oid or (clave is not None and clave in self._mensaje):
+            return False
+        symbol = (symbol or "").upper() or None
+        p = Posicion(oid, canal, symbol, order_type, clave, int(t_ms if t_ms is not None else time.time() * 1000))
+        self._oid[oid] = p
+        if symbol:
+            self._simbolo.setdefault((canal, symbol), OrderedDict())[oid] = None
+        if clave is not None:
+            self._mensaje[clave] = oid
+        return True
+
+    def cerrar(self, oid: str) -> bool:
+        p = self._oid.pop(oid, None)
+        if p is None:
+            return False
+        if p.symbol:
+            self._quitar(self._simbolo, (p.canal, p.symbol), oid)
+        if p.clave is not None and self._mensaje.get(p.clave) == oid:
+            del self._mensaje[p.clave]
+        return True
+
+    @staticmethod
+    def _quitar(d: dict, k, oid):
+        od = d.get(k)
+        if od is not None:
+            od.pop(oid, None)
+            if not od:
+                del d[k]
+
+    def ack(self, oid: str, resto: str = "") -> None:
+        """ACK del EA: confirma la señal o, si trae estado de cierre/rechazo, la saca del índice."""
+        p = self._oid.get(oid)
+        if p is None:
+            return
+        estado = (resto or "").split()[:1]
+        if estado and estado[0].upper() in ACK_CIERRA:
+            self.cerrar(oid)
+        else:
+            p.confirmada = True
+
+    def podar(self, ahora_ms: int = None) -> int:
+        """Quita las señales más antiguas que la ventana. Devuelve cuántas."""
+        limite = int(ahora_ms if ahora_ms is not None else time.time() * 1000) - self.ventana_ms
+        viejas = [oid for oid, p in self._oid.items() if p.t_ms < limite]
+        for oid in viejas:
+            self.cerrar(oid)
+        for clave in [clave for clave, (_, t) in self._gestiones.items() if t < limite]:
+            del self._gestiones[clave]
+        return len(viejas)
+
+    def resolver(self, canal, order_type: str, symbol=None, reply_to=None) -> list:
+        """oids (de antigua a reciente) a los que se refiere un mensaje de gestión; [] si ninguno o sin reply ni símbolo."""
+        canal = str(canal or "")
+        objetivos = []
+        if reply_to not in (None, "", "0"):
+            oid = self._mensaje.get((canal, str(reply_to)))
+            if oid is not None:
+                objetivos = [oid]
+        if not objetivos:
+            symbol = (symbol or "").upper() or None
+            od = self._simbolo.get((canal, symbol)) if symbol else None
+            objetivos = list(od) if od else []
+        if order_type == "SL A":
+            objetivos = objetivos[-1:]
+        return objetivos
+
+    def aplicar(self, oid: str, canal, order_type: str, symbol=None, msg_id=None, reply_to=None, t_ms=None) -> list:
+        """
+        Un mensaje ya clasificado (score=10): si abre, se indexa; si gestiona, se resuelve a sus objetivos
+        (y CERRAR los cierra). Devuelve los oid objetivo ([] para señales nuevas o sin objetivo).
+        """
+        if order_type in ABRE:
+            self.abrir(oid, canal, symbol, order_type, msg_id, t_ms)
+            return []
+        if order_type not in GESTION:
+            return []
+        clave = clave_mensaje(oid)
+        if clave in self._gestiones:
+            return list(self._gestiones[clave][0])    # reprocesada o editada: mismo resultado, sin efectos
+        objetivos = self.resolver(canal, order_type, symbol, reply_to)
+        if order_type == "CERRAR":
+            for o in objetivos:
+                self.cerrar(o)
+        self._gestiones[clave] = (objetivos, int(t_ms if t_ms is not None else time.time() * 1000))
+        return objetivos
+
+    def reconstruir(self, filas) -> int:
+        """
+        filas: (oid, canal, msg_id, symbol, order_type, ref_oid, t_ms) en orden cronológico, solo score=10.
+        Repite la historia: abre señales y aplica los CERRAR (por ref_oid si consta; si no, como en vivo).
+        """
+        for oid, canal, msg_id, symbol, order_type, ref_oid, t_ms in filas:
+            if order_type in GESTION and ref_oid:
+                objetivos = str(ref_oid).split(";")
+                if order_type == "CERRAR":
+                    for o in objetivos:
+                        self.cerrar(o)
+                self._gestiones[clave_mensaje(oid)] = (objetivos, int(t_ms if t_ms is not None else time.time() * 1000))
+            else:
+                self.aplicar(oid, canal, order_type, symbol, msg_id, t_ms=t_ms)
+        self.podar()
+        return len(self)
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+# replay.py — banco de pruebas del parseador: reproduce tráfico real a máxima velocidad
+# - Fuentes: XRANGE de pasarela:parse, volcado JSONL (un evento del stream por línea) o consulta a Trazas_Unica.
+# - Misma clasificación que en vivo (pipeline.clasificar_evento); sin BBDD, CSV, socket ni Telegram:
+#     --sinks nulo     solo clasificar (por defecto)
+#     --sinks memoria  además construye CSV / línea EA / texto Telegram y los pasa por el Despachador
+#                      con sinks que guardan en listas (mide el coste de formateo + carriles)
+# - Informe: throughput, percentiles de latencia por mensaje y diferencias con las filas guardadas
+#   (score, order_type, symbol, entry_price, sl, tp) — útil para ver el efecto de cambiar reglas.
+#
+# Uso:
+#   python parseador_local.py --replay --stream                           # todo el stream
+#   python parseador_local.py --replay --stream 1734170000000 + --limite 5000 --volcar trafico.jsonl
+#   python parseador_local.py --replay --jsonl trafico.jsonl --repetir 5 --sinks memoria
+#   python parseador_local.py --replay --bbdd "ts_utc >= '2026-01-01'" --informe informe.json
+
+import os, sys, json, time, sqlite3, argparse
+from collections import Counter
+
+# --- PATH robusto para imports locales ---
+PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # .../services/src
+if PARENT_DIR not in sys.path:
+    sys.path.insert(0, PARENT_DIR)
+
+from comun.trazado import percentiles
+from comun.formato_stream import decodificar, DiccionarioCanales
+from parser import pipeline
+
+_COLUMNAS_EVENTO = ("oid", "ts_utc", "ts_redis_ingest", "ch_id", "msg_id", "revision",
+                    "channel", "channel_username", "sender_id", "text")
+_CAMPOS_DIFF = ("score", "order_type", "symbol", "entry_price", "sl", "tp")
+
+
+# =================== FUENTES ===================
+def eventos_stream(r, stream: str, inicio: str = "-", fin: str = "+", lote: int = 1000):
+    """Entradas de XRANGE paginado; cada evento lleva _entry_id."""
+    desde = inicio
+    canales = DiccionarioCanales(r)
+    while True:
+        msgs = r.xrange(stream, min=desde, max=fin, count=lote)
+        for entry_id, fields in msgs:
+            ev = decodificar(entry_id, fields, canales)
+            ev["_entry_id"] = entry_id.decode()
+            yield ev
+        if len(msgs) < lote:
+            return
+        desde = "(" + msgs[-1][0].decode()
+
+
+def eventos_jsonl(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        for linea in f:
+            linea = linea.strip()
+            if linea:
+                yield json.loads(linea)
+
+
+def eventos_bbdd(db_path: str, tabla: str, where: str = None):
+    """Filas guardadas como eventos del stream; _oid = oid guardado (para comparar aunque sea legacy)."""
+    con = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        sql = f"SELECT {', '.join(_COLUMNAS_EVENTO)} FROM {tabla}"
+        if where:
+            sql += f" WHERE {where}"
+        for fila in con.execute(sql + " ORDER BY rowid"):
+            d = dict(zip(_COLUMNAS_EVENTO, fila))
+            ev = {k: str(v) for k, v in d.items() if v is not None and k != "oid"}
+            ev["_oid"] = d["oid"]
+            yield ev
+    finally:
+        con.close()
+
+
+# =================== SINKS EN MEMORIA ===================
+class SinksMemoria:
+    """Salidas que irían a MT4/EA/Telegram, guardadas en listas (por carril del Despachador)."""
+
+    def __init__(self, pl):
+        self.pl = pl
+        self.desp = pl.Despachador(("mt4", "socket", "telegram"))
+        self.csv, self.socket, self.telegram = [], [], []
+
+    def lanzar(self, data: dict, fila: dict, texto_formateado):
+        Sink = self.pl.Sink
+        linea = pipeline.fila_a_csv(fila)
+        texto = self.pl._payload_telegram(data, fila, texto_formateado)
+        sinks = [Sink("csv", "mt4", lambda: self.csv.append(linea)),
+                 Sink("socket", "socket", lambda: self.socket.append(linea))]
+        if texto:
+            sinks.append(Sink("telegram", "telegram", lambda: self.telegram.append(texto)))
+        return self.desp.lanzar(sinks).esperar()
+
+    def cerrar(self):
+        self.desp.cerrar()
+
+
+# =================== COMPARACIÓN ===================
+def _tp_texto(fila: dict):
+    tps = [str(fila.get(f"tp{i}")) for i in range(1, 5) if fila.get(f"tp{i}") is not None]
+    return " / ".join(tps) if tps else None
+
+
+def _igual(a, b) -> bool:
+    if a in (None, "") and b in (None, ""):
+        return True
+    try:
+        return abs(float(a) - float(b)) < 1e-9
+    except (TypeError, ValueError):
+        return str(a).strip() == str(b).strip()
+
+
+class Guardadas:
+    """Búsqueda de la fila guardada de un evento: por oid y, si no, por (ch_id, msg_id, revision)."""
+
+    def __init__(self, db_path: str, tabla: str):
+        self.tabla = tabla
+        self.con = None
+        if db_path and os.path.exists(db_path):
+            self.con = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+            self.con.row_factory = sqlite3.Row
+
+    def buscar(self, ev: dict, oid: str):
+        if self.con is None:
+            return None
+        cols = "oid, score, order_type, symbol, entry_price, sl, tp"
+        row = self.con.execute(f"SELECT {cols} FROM {self.tabla} WHERE oid = ?", (ev.get("_oid") or oid,)).fetchone()
+        if row is None and ev.get("msg_id"):
+            ch = ev.get("ch_id") or ev.get("chat_id") or ev.get("channel_id") or ev.get("ch")
+            row = self.con.execute(
+                f"SELECT {cols} FROM {self.tabla} WHERE ch_id = ? AND msg_id = ? AND COALESCE(revision, 1) = ?",
+                (str(ch), str(ev["msg_id"]), int(ev.get("revision") or 1))).fetchone()
+        return row
+
+    def cerrar(self):
+        if self.con is not None:
+            self.con.close()
+
+
+def diferencias(guardada, score: int, fila: dict) -> dict:
+    """{campo: (guardado, ahora)}; los campos operativos solo se comparan si ambos son señal (score=10)."""
+    ahora = {"score": score, "order_type": fila.get("order_type"), "symbol": fila.get("symbol"),
+             "entry_price": fila.get("entry_price"), "sl": fila.get("sl"), "tp": _tp_texto(fila)}
+    campos = _CAMPOS_DIFF if score == 10 and guardada["score"] == 10 else ("score",)
+    return {c: (guardada[c], ahora[c]) for c in campos if not _igual(guardada[c], ahora[c])}
+
+
+# =================== EJECUCIÓN ===================
+def ejecutar(eventos, pl, sinks: str = "nulo", guardadas: Guardadas = None, repetir: int = 1) -> dict:
+    """Reproduce los eventos (lista) y devuelve el informe."""
+    memoria = SinksMemoria(pl) if sinks == "memoria" else None
+    lat_ms, resultados, diffs = [], Counter(), []
+    comparadas = sin_fila = 0
+    t0 = time.perf_counter()
+    try:
+        for vuelta in range(repetir):
+            for ev in eventos:
+                t = time.perf_counter_ns()
+                clasif = pipeline.clasificar_evento(ev)
+                if clasif is not None and memoria is not None and clasif[1] == 10:
+                    memoria.lanzar(ev, clasif[3], clasif[2])
+                lat_ms.append((time.perf_counter_ns() - t) / 1e6)
+
+                if clasif is None:
+                    resultados["sin_resultados"] += 1
+                    score, fila = 0, {}
+                else:
+                    _mejor, score, _txt, fila = clasif
+                    resultados["senal" if score == 10 else "rechazado"] += 1
+                if vuelta or guardadas is None:
+                    continue
+                g = guardadas.buscar(ev, fila.get("oid") or ev.get("_oid"))
+                if g is None:
+                    sin_fila += 1
+                    continue
+                comparadas += 1
+                d = diferencias(g, score, fila)
+                if d:
+                    diffs.append({"oid": g["oid"], "msg_id": ev.get("msg_id"),
+                                  "texto": (ev.get("text") or ev.get("raw") or ev.get("text/raw") or "")[:120],
+                                  "cambios": d})
+    finally:
+        if memoria is not None:
+            memoria.cerrar()
+    total = time.perf_counter() - t0
+
+    n = len(lat_ms)
+    p = percentiles(lat_ms, (50, 90, 99, 99.9))
+    informe = {
+        "mensajes": n,
+        "segundos": round(total, 4),
+        "msg_por_seg": round(n / total, 1) if total > 0 else None,
+        "latencia_ms": {f"p{k:g}": round(v, 4) for k, v in p.items()},
+        "latencia_max_ms": round(max(lat_ms), 4) if lat_ms else None,
+        "resultados": dict(resultados),
+        "comparadas": comparadas,
+        "sin_fila_guardada": sin_fila,
+        "diferencias": len(diffs),
+        "detalle_diferencias": diffs,
+    }
+    if memoria is not None:
+        informe["salidas_memoria"] = {"csv": len(memoria.csv), "socket": len(memoria.socket),
+                                      "telegram": len(memoria.telegram)}
+    return informe
+
+
+def imprimir(informe: dict, max_diffs: int = 20):
+    print(f"[replay] {informe['mensajes']} mensajes en {informe['segundos']:.3f}s "
+          f"→ {informe['msg_por_seg']} msg/s")
+    lat = "  ".join(f"{k}={v:.3f}" for k, v in informe["latencia_ms"].items())
+    print(f"[replay] latencia ms: {lat}  max={informe['latencia_max_ms']}")
+    print(f"[replay] resultados: {informe['resultados']}")
+    if "salidas_memoria" in informe:
+        print(f"[replay] salidas en memoria: {informe['salidas_memoria']}")
+    print(f"[replay] comparadas con BBDD: {informe['comparadas']} "
+          f"(sin fila: {informe['sin_fila_guardada']}) → {informe['diferencias']} con cambios")
+    for d in informe["detalle_diferencias"][:max_diffs]:
+        cambios = ", ".join(f"{c}: {a!r} → {b!r}" for c, (a, b) in d["cambios"].items())
+        print(f"  {d['oid']} msg_id={d['msg_id']}  {cambios}  | {d['texto']!r}")
+    if informe["diferencias"] > max_diffs:
+        print(f"  … {informe['diferencias'] - max_diffs} más (ver --informe)")
+
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(prog="parseador_local.py --replay",
+                                 description="Reproduce tráfico por el parseador sin Telegram ni MT4 y mide.")
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument("--stream", nargs="*", metavar=("INICIO", "FIN"),
+                     help="XRANGE de REDIS_STREAM (por defecto - +).")
+    src.add_argument("--jsonl", help="Volcado JSONL de eventos del stream.")
+    src.add_argument("--bbdd", nargs="?", const="", metavar="WHERE",
+                     help="Filas de Trazas_Unica (condición SQL opcional).")
+    ap.add_argument("--limite", type=int, default=0, help="Máximo de eventos a cargar (0 = todos).")
+    ap.add_argument("--repetir", type=int, default=1, help="Vueltas sobre el mismo conjunto (throughput estable).")
+    ap.add_argument("--sinks", choices=("nulo", "memoria"), default="nulo")
+    ap.add_argument("--sin-comparar", action="store_true", help="No comparar con las filas guardadas.")
+    ap.add_argument("--volcar", help="Guardar los eventos cargados en JSONL (para repetir la prueba).")
+    ap.add_argument("--informe", help="Guardar el informe completo en JSON.")
+    ap.add_argument("--max-diffs", type=int, default=20, help="Diferencias a listar en consola.")
+    return ap.parse_args(argv)
+
+
+def main(argv=None, pl=None):
+    args = parse_args(argv)
+    if pl is None:
+        from parser import parseador_local as pl
+
+    if args.jsonl:
+        fuente = eventos_jsonl(args.jsonl)
+    elif args.bbdd is not None:
+        if not os.path.exists(pl.DB_FILE):
+            raise SystemExit(f"[ERROR] No existe la BBDD: {pl.DB_FILE}")
+        fuente = eventos_bbdd(pl.DB_FILE, pl.TABLE, args.bbdd or None)
+    else:
+        import redis
+        inicio, fin = (args.stream + ["-", "+"][len(args.stream):])[:2]
+        fuente = eventos_stream(redis.Redis.from_url(pl.REDIS_URL), pl.REDIS_STREAM, inicio, fin)
+
+    eventos = []
+    for ev in fuente:
+        eventos.append(ev)
+        if args.limite and len(eventos) >= args.limite:
+            break
+    print(f"[replay] {len(eventos)} eventos cargados")
+    if args.volcar:
+        with open(args.volcar, "w", encoding="utf-8") as f:
+            for ev in eventos:
+                f.write(json.dumps(ev, ensure_ascii=False) + "\n")
+        print(f"[replay] volcados en {args.volcar}")
+    if not eventos:
+        return
+
+    guardadas = None if args.sin_comparar else Guardadas(pl.DB_FILE, pl.TABLE)
+    try:
+        informe = ejecutar(eventos, pl, args.sinks, guardadas, max(1, args.repetir))
+    finally:
+        if guardadas is not None:
+            guardadas.cerrar()
+    imprimir(informe, args.max_diffs)
+    if args.informe:
+        with open(args.informe, "w", encoding="utf-8") as f:
+            json.dump(informe, f, ensure_ascii=False, indent=2, default=str)
+        print(f"[replay] informe en {args.informe}")
+
+
+if __name__ == "__main__":
+    main()
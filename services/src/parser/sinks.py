@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+# sinks.py — despachador de destinos (sinks) del parseador tras clasificar un mensaje
+# - Cada sink corre en su "carril": un hilo propio y FIFO (mismo orden entre mensajes, sin
+#   compartir conexión SQLite / event loop de Telegram entre hilos).
+# - Dependencias declaradas: un sink se encola en su carril cuando terminaron sus dependencias
+#   (sin ocupar ningún hilo mientras espera); si alguna falló o se omitió, se omite.
+# - Reintentos por sink (nº y backoff exponencial) y aislamiento: la excepción queda en su resultado.
+# - Tiempo de cada sink -> Traza (spans) + histograma pasarela_parser_sink_seconds{sink,resultado}.
+# - esperar=False: el bucle principal no lo espera (p.ej. Telegram), pero sí cuenta para sus dependientes.
+#
+# Uso:
+#   desp = Despachador(("mt4", "socket", "bbdd", "telegram"))
+#   lote = desp.lanzar([
+#       Sink("csv", "mt4", lambda: csv_write_row(fila), reintentos=2, reintentar_en=(OSError,)),
+#       Sink("bbdd_basico", "bbdd", lambda: db_upsert_basico(basico)),
+#       Sink("bbdd_operativos", "bbdd", lambda: db_update_operativos(oid, fila), depende=("bbdd_basico",)),
+#   ], traza)
+#   resultados = lote.esperar()
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from comun import metricas
+from comun import logs
+
+log = logs.obtener("parseador.sinks")
+
+SINK_SEG        = metricas.histograma("pasarela_parser_sink_seconds", "Duración de cada sink (incluye reintentos)", ("sink", "resultado"))
+SINK_REINTENTOS = metricas.contador("pasarela_parser_sink_reintentos_total", "Reintentos por sink", ("sink",))
+
+
+class Sink:
+    """Un destino: función sin argumentos + carril + política de reintentos + dependencias."""
+    __slots__ = ("nombre", "carril", "funcion", "depende", "reintentos", "espera", "reintentar_en", "esperar")
+
+    def __init__(self, nombre: str, carril: str, funcion, depende=(), reintentos: int = 0,
+                 espera: float = 0.05, reintentar_en=(Exception,), esperar: bool = True):
+        self.nombre = nombre
+        self.carril = carril
+        self.funcion = funcion
+        self.depende = tuple(depende)
+        self.reintentos = int(reintentos)
+        self.espera = float(espera)
+        self.reintentar_en = tuple(reintentar_en)
+        self.esperar = esperar
+
+
+class Resultado:
+    __slots__ = ("estado", "valor", "error", "intentos", "ms")
+
+    def __init__(self, estado: str, valor=None, error=None, intentos: int = 0, ms: float = 0.0):
+        self.estado = estado        # "ok" | "error" | "omitido"
+        self.valor = valor
+        self.error = error
+        self.intentos = intentos
+        self.ms = ms
+
+    @property
+    def ok(self) -> bool:
+        return self.estado == "ok"
+
+    def __repr__(self):
+        return f"Resultado({self.estado}, intentos={self.intentos}, ms={self.ms:.2f}, error={self.error!r})"
+
+
+class Lote:
+    """Sinks de un mensaje en vuelo. esperar() bloquea hasta que terminan los sinks con esperar=True."""
+
+    def __init__(self, sinks, traza=None):
+        self.sinks = {s.nombre: s for s in sinks}
+        self.traza = traza
+        self.resultados = {}
+        self._lock = threading.Lock()
+        self._hechos = {n: threading.Event() for n in self.sinks}
+        self._avisar = {}           # nombre -> [cb()] pendientes de ese resultado
+        self._al_terminar = []
+
+    def _fijar(self, nombre: str, res: Resultado):
+        with self._lock:
+            self.resultados[nombre] = res
+            avisar = self._avisar.pop(nombre, [])
+            todos = len(self.resultados) == len(self.sinks)
+            fin = list(self._al_terminar) if todos else []
+        self._hechos[nombre].set()
+        for cb, args in [(cb, ()) for cb in avisar] + [(cb, (self,)) for cb in fin]:
+            try:
+                cb(*args)
+            except Exception as e:
+                log.warning(f"callback tras {nombre}: {e}")
+
+    def _cuando(self, nombre: str, cb):
+        """cb() en cuanto 'nombre' tenga resultado (ya, si lo tiene)."""
+        with self._lock:
+            if nombre not in self.resultados:
+                self._avisar.setdefault(nombre, []).append(cb)
+                return
+        cb()
+
+    def al_terminar(self, cb):
+        """cb(lote) cuando terminan TODOS los sinks (también los que no se esperan)."""
+        with self._lock:
+            todos = len(self.resultados) == len(self.sinks)
+            if not todos:
+                self._al_terminar.append(cb)
+                return
+        cb(self)
+
+    def esperar(self, timeout: float = None) -> dict:
+        limite = None if timeout is None else time.monotonic() + timeout
+        for n, s in self.sinks.items():
+            if not s.esperar:
+                continue
+            resto = None if limite is None else max(0.0, limite - time.monotonic())
+            self._hechos[n].wait(resto)
+        with self._lock:
+            return dict(self.resultados)
+
+
+class Despachador:
+    def __init__(self, carriles):
+        self._carriles = {c: ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"sink-{c}") for c in carriles}
+        self._pendientes = {c: 0 for c in carriles}   # trabajos en cola + en curso por carril
+        self._lock = threading.Lock()
+
+    def pendientes(self, carril: str) -> int:
+        """Profundidad del carril: trabajos encolados aún sin terminar (incluye el que está en curso)."""
+        return self._pendientes.get(carril, 0)
+
+    def _encolar(self, carril: str, funcion, *args):
+        with self._lock:
+            self._pendientes[carril] += 1
+        fut = self._carriles[carril].submit(funcion, *args)
+        fut.add_done_callback(lambda _f: self._terminado(carril))
+        return fut
+
+    def _terminado(self, carril: str):
+        with self._lock:
+            self._pendientes[carril] -= 1
+
+    def enviar(self, carril: str, funcion, *args):
+        """Trabajo suelto en un carril (p.ej. alertas por el carril de Telegram). Devuelve el Future."""
+        return self._encolar(carril, funcion, *args)
+
+    def lanzar(self, sinks, traza=None) -> Lote:
+        """Encola los sinks respetando dependencias. El orden de la lista es la prioridad dentro de cada carril."""
+        lote = Lote(sinks, traza)
+        for s in sinks:
+            if s.carril not in self._carriles:
+                raise ValueError(f"carril desconocido {s.carril!r} (sink {s.nombre!r})")
+            for d in s.depende:
+                if d not in lote.sinks:
+                    raise ValueError(f"sink {s.nombre!r} depende de {d!r}, que no está en el lote")
+        for s in sinks:
+            if s.depende:
+                self._tras_dependencias(lote, s)
+            else:
+                self._encolar(s.carril, self._correr, lote, s)
+        return lote
+
+    def _tras_dependencias(self, lote: Lote, s: Sink):
+        faltan = [len(s.depende)]
+        lock = threading.Lock()
+
+        def una_menos():
+            with lock:
+                faltan[0] -= 1
+                if faltan[0]:
+                    return
+            fallidas = [d for d in s.depende if not lote.resultados[d].ok]
+            if fallidas:
+                SINK_SEG.observe(0.0, s.nombre, "omitido")
+                lote._fijar(s.nombre, Resultado("omitido", error=f"dependencia fallida: {','.join(fallidas)}"))
+            else:
+                self._encolar(s.carril, self._correr, lote, s)
+
+        for d in s.depende:
+            lote._cuando(d, una_menos)
+
+    def _correr(self, lote: Lote, s: Sink):
+        t0 = time.perf_counter_ns()
+        intentos = 0
+        espera = s.espera
+        while True:
+            intentos += 1
+            try:
+                res = Resultado("ok", valor=s.funcion(), intentos=intentos)
+                break
+            except s.reintentar_en as e:
+                if intentos > s.reintentos:
+                    res = Resultado("error", error=e, intentos=intentos)
+                    break
+                SINK_REINTENTOS.inc(s.nombre)
+                time.sleep(espera)
+                espera = min(espera * 2, 2.0)
+            except Exception as e:
+                res = Resultado("error", error=e, intentos=intentos)
+                break
+        t1 = time.perf_counter_ns()
+        res.ms = (t1 - t0) / 1e6
+        if lote.traza is not None:
+            lote.traza.registrar(s.nombre, t0, t1)
+        SINK_SEG.observe(res.ms / 1000.0, s.nombre, res.estado)
+        lote._fijar(s.nombre, res)
+
+    def cerrar(self, esperar: bool = True):
+        for ex in self._carriles.values():
+            ex.shutdown(wait=esperar)
@@ -4,7 +4,7 @@
 #   TELEGRAM_API_ID=...
 #   TELEGRAM_API_HASH=...
 #   TELEGRAM_PHONE=+34...
-#   TELEGRAM_SESSION=telethon_session
+#   TELEGRAM_SESSION=telethon_session      (el publicador tiene su propio login, ver comun/sesiones.py)
 #   TELEGRAM_TARGETS=@JBMSignals|https://t.me/JBMSignals|JBM Signals   (separar por '|')
 #
 # Uso:
@@ -20,6 +20,14 @@ from getpass import getpass
 from dotenv import load_dotenv, find_dotenv
 from telethon import TelegramClient, errors
 
+# --- PATH robusto para imports locales ---
+PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))   # .../services/src
+if PARENT_DIR not in sys.path:
+    sys.path.insert(0, PARENT_DIR)
+
+from comun import entidades
+from comun import sesiones
+
 APP_NAME = "publicador_v1_3"
 
 # ---------- Utilidades ----------
@@ -73,7 +81,8 @@ async def ensure_session(client: TelegramClient, phone: str):
 # ---------- Resolución de destino ----------
 async def resolve_target(client: TelegramClient, override_target: str = ""):
     """
-    Resuelve el destino probando:
+    Resuelve el destino probando (tras la caché de entidades compartida, que evita toda llamada
+    si el destino ya se resolvió dentro de ENTIDADES_TTL_SEC):
     1) Link t.me (público o invitación)
     2) @username (con/sin @)
     3) Título EXACTO de un diálogo donde seas miembro
@@ -88,30 +97,14 @@ async def resolve_target(client: TelegramClient, override_target: str = ""):
         )
     candidates = [c.strip() for c in raw.split("|") if c.strip()]
 
-    # 1) Links t.me
-    for c in candidates:
-        if c.startswith(("http://", "https://")) or "t.me/" in c:
-            try:
-                return await client.get_entity(c)
-            except Exception:
-                pass
-
-    # 2) @username
-    for c in candidates:
-        u = c.lstrip("@")
-        if not u or any(ch.isspace() for ch in u):
-            continue
-        try:
-            return await client.get_entity(u)
-        except Exception:
-            pass
-
-    # 3) Título exacto
-    titles_seen = []
-    async for d in client.iter_dialogs():
-        titles_seen.append(d.name)
-        if d.name in candidates:
-            return d.entity
+    cache = entidades.CacheEntidades()
+    try:
+        entity = await entidades.resolver_destino(client, cache, candidates)
+        if entity is not None:
+            return entity
+        titles_seen = cache.titulos()
+    finally:
+        cache.cerrar()
 
     # Nada funcionó
     raise SystemExit(
@@ -128,7 +121,7 @@ async def resolve_target(client: TelegramClient, override_target: str = ""):
 # ---------- Envío ----------
 async def send_once(message: str, target_override: str = ""):
     api_id, api_hash, phone, session = get_credentials()
-    client = TelegramClient(session, api_id, api_hash)
+    client = TelegramClient(sesiones.sesion("publicador", session), api_id, api_hash)
     try:
         await ensure_session(client, phone)
         entity = await resolve_target(client, target_override)
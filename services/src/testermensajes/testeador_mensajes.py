@@ -19,29 +19,35 @@ if PARENT_DIR not in sys.path:
 if BASE_DIR not in sys.path:
     sys.path.insert(0, BASE_DIR)
 
-# Importar funciones del parseador y reglas de negocio
+# Cargar .env (antes de leer PASARELA_DB / PASARELA_TABLE)
+from dotenv import load_dotenv, find_dotenv
+ENV_PATH = find_dotenv(usecwd=True) or str(Path(__file__).resolve().parents[2] / ".env")
+load_dotenv(ENV_PATH, override=True)
+
+# Pasos puros del parseador (sin Telethon/Redis ni el arranque del parseador completo)
 from reglasnegocio.reglasnegocio import clasificar_mensajes, formatear_senal, formatear_motivo_rechazo
+from parser import pipeline
 
-# Importar funciones del parseador (necesitamos importar el módulo completo)
-import importlib.util
-parser_path = os.path.join(PARENT_DIR, "parser", "parseador_local.py")
-spec = importlib.util.spec_from_file_location("parseador_local", parser_path)
-parseador = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(parseador)
+_best_result = pipeline.mejor_resultado
+_build_fila_desde_resultado = pipeline.construir_fila
+_build_basico_desde_evento = pipeline.construir_basico
+DB_FILE = os.getenv("PASARELA_DB", r"C:\Pasarela\services\pasarela.db")
+TABLE = os.getenv("PASARELA_TABLE", "Trazas_Unica")
 
-# Usar funciones del parseador
-_best_result = parseador._best_result
-_build_fila_desde_resultado = parseador._build_fila_desde_resultado
-_build_basico_desde_evento = parseador._build_basico_desde_evento
-db_upsert_basico = parseador.db_upsert_basico
-db_update_operativos = parseador.db_update_operativos
-DB_FILE = parseador.DB_FILE
-TABLE = parseador.TABLE
+def _db_escribir(SQL: str, params: tuple):
+    conn = sqlite3.connect(DB_FILE, timeout=5.0)
+    try:
+        conn.execute("PRAGMA busy_timeout=5000;")
+        conn.execute(SQL, params)
+        conn.commit()
+    finally:
+        conn.close()
 
-# Cargar .env
-from dotenv import load_dotenv, find_dotenv
-ENV_PATH = find_dotenv(usecwd=True) or str(Path(__file__).resolve().parents[2] / ".env")
-load_dotenv(ENV_PATH, override=True)
+def db_upsert_basico(basico: dict):
+    _db_escribir(*pipeline.sql_upsert_basico(basico, TABLE))
+
+def db_update_operativos(oid: str, fila: dict):
+    _db_escribir(*pipeline.sql_operativos(oid, fila, TABLE))
 
 # Nombre de la tabla para resultados de testing
 TEST_TABLE = "Mensajes_testados"
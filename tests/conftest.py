@@ -0,0 +1,8 @@
+import sys
+from pathlib import Path
+
+# Los módulos se importan como paquetes de services/src (parser.*, comun.*, listener.*), igual que al
+# ejecutarlos con el "PATH robusto" de cada script: así basta con  python -m pytest tests
+SRC = str(Path(__file__).resolve().parents[1] / "services" / "src")
+if SRC not in sys.path:
+    sys.path.insert(0, SRC)
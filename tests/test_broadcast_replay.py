@@ -0,0 +1,131 @@
+import socket
+import time
+
+from parser.broadcast_server import BroadcastWorker
+from parser.broadcast_client import ClienteReplay
+
+
+def _arrancar(replay_file, size=5):
+    w = BroadcastWorker("127.0.0.1", 0, replay_size=size, replay_file=str(replay_file))
+    w.start()
+    assert w.listo.wait(5)
+    return w
+
+
+def _parar(w):
+    w.stop()
+    w.join(5)
+
+
+def _recibir(cli, n):
+    out = []
+    for seq, linea in cli.recibir():
+        out.append((seq, linea))
+        if len(out) == n:
+            break
+    return out
+
+
+def test_replay_solo_lo_perdido(tmp_path):
+    w = _arrancar(tmp_path / "replay.log")
+    estado = str(tmp_path / "cliente.json")
+    try:
+        cli = ClienteReplay("127.0.0.1", w.port, estado)
+        cli.conectar()
+        assert cli.esperar_hello()
+        for i in range(1, 4):
+            w.broadcast(f"oid{i},BUY")
+        assert _recibir(cli, 3) == [(1, "oid1,BUY"), (2, "oid2,BUY"), (3, "oid3,BUY")]
+        cli.cerrar()
+
+        # Offline: se difunden 4 y 5; al reconectar solo llega lo perdido
+        w.broadcast("oid4,SELL")
+        w.broadcast("oid5,SELL")
+        cli = ClienteReplay("127.0.0.1", w.port, estado)
+        assert cli.last_seq == 3
+        cli.conectar()
+        assert list(cli.recibir(hasta_replay_end=True)) == [(4, "oid4,SELL"), (5, "oid5,SELL")]
+        cli.cerrar()
+
+        # Más líneas que el buffer: se anuncia el hueco y llega lo que queda
+        for i in range(6, 13):
+            w.broadcast(f"oid{i},BUY")
+        cli = ClienteReplay("127.0.0.1", w.port, estado)
+        cli.conectar()
+        got = list(cli.recibir(hasta_replay_end=True))
+        assert [s for s, _ in got] == [8, 9, 10, 11, 12]
+        assert cli.huecos == [(6, 7)]
+        cli.cerrar()
+    finally:
+        _parar(w)
+
+
+def test_replay_persistido_sobrevive_reinicio(tmp_path):
+    fichero = tmp_path / "replay.log"
+    w = _arrancar(fichero)
+    epoch = w.epoch
+    w.broadcast("a")
+    w.broadcast("b")
+    cli = ClienteReplay("127.0.0.1", w.port)
+    cli.conectar()
+    assert cli.esperar_hello()
+    cli.cerrar()
+    _parar(w)
+
+    w = _arrancar(fichero)
+    try:
+        assert (w.epoch, w.ultimo_seq) == (epoch, 2)
+        w.broadcast("c")
+        cli = ClienteReplay("127.0.0.1", w.port)
+        cli.epoch, cli.last_seq = epoch, 1
+        cli.conectar()
+        assert list(cli.recibir(hasta_replay_end=True)) == [(2, "b"), (3, "c")]
+        cli.cerrar()
+    finally:
+        _parar(w)
+
+
+def test_cliente_antiguo_recibe_lineas_sin_prefijo(tmp_path):
+    w = _arrancar(tmp_path / "replay.log")
+    try:
+        s = socket.create_connection(("127.0.0.1", w.port), timeout=5)
+        for _ in range(50):
+            if w.clientes_conectados:
+                break
+            time.sleep(0.02)
+        w.broadcast("oid1,BUY")
+        assert s.recv(100) == b"oid1,BUY\n"
+        s.close()
+    finally:
+        _parar(w)
+
+
+def test_hello_conserva_lo_difundido_antes(tmp_path):
+    import selectors
+    from parser.broadcast_server import _Cliente
+
+    w = BroadcastWorker("127.0.0.1", 0)
+    a, b = socket.socketpair()
+    try:
+        w.sel = selectors.DefaultSelector()
+        cli = _Cliente(a, ("ea", 0))
+        w.clientes[cli.fd] = cli
+        w.sel.register(a, selectors.EVENT_READ, cli)
+        w.broadcast("oid1,BUY")
+        w._repartir()                                   # enviada sin prefijo
+        w._enviar = lambda c: None                      # socket sin hueco: las dos siguientes quedan en cola
+        w.broadcast("oid2,BUY")
+        w.broadcast("oid3,SELL")
+        w._repartir()
+        del w._enviar
+        w._comando(cli, "HELLO")
+        b.settimeout(5)
+        esperado = f"oid1,BUY\n#HELLO {w.epoch} 1\n2|oid2,BUY\n3|oid3,SELL\n".encode()
+        got = b""
+        while len(got) < len(esperado):
+            got += b.recv(4096)
+        assert got == esperado
+    finally:
+        w.sel.close()
+        for s in (a, b, w._wake_r, w._wake_w):
+            s.close()
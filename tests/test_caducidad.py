@@ -0,0 +1,23 @@
+from comun.trazado import iso_a_ms
+from parser.pipeline import caducidad, mas_estricto
+
+T0 = iso_a_ms("2026-01-01T10:00:00Z")
+
+
+def test_plazo_por_accion():
+    data = {"ts_utc": "2026-01-01T10:00:00Z"}
+    assert caducidad(data, "BUY", 60, 300, T0 + 59_000) is None
+    assert caducidad(data, "BUY LIMIT", 60, 300, T0 + 61_000) == 61.0
+    assert caducidad(data, "BREAKEVEN", 60, 300, T0 + 61_000) is None
+    assert caducidad(data, "CERRAR", 60, 300, T0 + 301_000) == 301.0
+
+
+def test_sin_plazo_o_sin_ts():
+    assert caducidad({"ts_utc": "2026-01-01T10:00:00Z"}, "SELL", 0, 300, T0 + 10**9) is None
+    assert caducidad({"ts_utc": "basura"}, "SELL", 60, 300, T0 + 10**9) is None
+    assert caducidad({}, "SELL", 60, 300, T0 + 10**9) is None
+
+
+def test_plazo_mas_estricto_para_recuperados():
+    assert mas_estricto(60, 20) == 20 and mas_estricto(0, 20) == 20
+    assert mas_estricto(60, 0) == 60 and mas_estricto(0, 0) == 0
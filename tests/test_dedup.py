@@ -0,0 +1,76 @@
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "services" / "src" / "listener"))
+
+TTL = 1000
+
+
+def _publicar(r, tipo, msg, ch=10):
+    from publicacion import publicar
+    return asyncio.run(publicar(r, "s", tipo, ch, msg, {"text/raw": "BUY"}, 1000, TTL))
+
+
+@pytest.fixture
+def servidor():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    from fakeredis import aioredis
+    server = fakeredis.FakeServer()
+    return fakeredis.FakeRedis(server=server), aioredis.FakeRedis(server=server)
+
+
+def test_misma_semantica_que_las_claves_por_mensaje(servidor):
+    r, ar = servidor
+    assert _publicar(ar, "new", 5)[0] == 1
+    assert _publicar(ar, "new", 5) == (1, None)               # repetido
+    assert [_publicar(ar, "edit", 5)[0] for _ in range(2)] == [2, 3]
+    assert _publicar(ar, "new", 5) == (3, None)               # un 'new' tardío no republica
+    assert _publicar(ar, "edit", 6)[0] == 2                   # edición antes que el 'new'
+    assert _publicar(ar, "new", 6) == (2, None)
+    assert _publicar(ar, "new", 5, ch=11)[0] == 1             # otro canal
+    # Dos claves por canal en vez de dos por mensaje, con caducidad
+    assert sorted(k.decode() for k in r.keys("tg:*")) == ["tg:revs:10", "tg:revs:11", "tg:vistos:10", "tg:vistos:11"]
+    assert 0 < r.ttl("tg:revs:10") <= TTL and r.hgetall("tg:revs:10") == {b"5": b"3", b"6": b"2"}
+
+
+def test_caducidad_y_recorte(servidor):
+    r, ar = servidor
+    for msg in range(1, 101):
+        _publicar(ar, "new", msg)
+    viejo = int(time.time()) - TTL - 1
+    r.zadd("tg:vistos:10", {str(m): viejo for m in range(1, 91)})   # 90 asignados hace más de TTL
+    from publicacion import RECORTE_LOTE
+    # Caducado = como si su tg:dedup hubiera expirado: un 'new' vuelve a publicarse
+    assert _publicar(ar, "new", 90)[0] == 1
+    assert r.hlen("tg:revs:10") == 100 - RECORTE_LOTE           # cada llamada recorta un lote
+    assert _publicar(ar, "new", 95) == (1, None)
+    assert r.hlen("tg:revs:10") == r.zcard("tg:vistos:10") == 11 # 91..100 + el 90 republicado
+
+
+def test_migracion_desde_claves_por_mensaje(servidor):
+    r, ar = servidor
+    from migrar_dedup import migrar
+    r.set("tg:rev:10:5", 3)
+    r.set("tg:dedup:10:5:3", 1, ex=TTL - 100)
+    r.set("tg:dedup:10:5:2", 1, ex=TTL - 200)
+    r.set("tg:rev:10:7", 1)                                       # su dedup ya caducó
+    r.set("tg:rev:12:1", 1)
+    r.set("tg:dedup:12:1:1", 1, ex=TTL)
+
+    assert migrar(r, TTL) == {"antiguas": 3, "migrados": 2, "caducados": 1, "canales": 2, "borradas": 0}
+    assert r.exists("tg:rev:10:5") and not r.exists("tg:revs:10")  # simulación: nada cambia
+    res = migrar(r, TTL, aplicar=True)
+    assert res["migrados"] == 2 and res["borradas"] == 6
+    assert sorted(k.decode() for k in r.keys("tg:*")) == ["tg:revs:10", "tg:revs:12", "tg:vistos:10", "tg:vistos:12"]
+    assert int(time.time()) - TTL + 90 <= r.zscore("tg:vistos:10", "5") <= int(time.time()) - 90
+
+    # Mismas decisiones que con las claves antiguas
+    assert _publicar(ar, "new", 5) == (3, None)
+    assert _publicar(ar, "edit", 5)[0] == 4
+    assert _publicar(ar, "new", 7)[0] == 1
+    assert _publicar(ar, "new", 1, ch=12) == (1, None)
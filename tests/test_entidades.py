@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+from comun.entidades import CacheEntidades, enlazado, resolver_canales, resolver_destino
+
+
+def test_resolucion_en_frio_y_refresco_por_ttl(tmp_path):
+    pytest.importorskip("telethon")
+    from telethon.tl.types import Channel, ChatPhotoEmpty
+
+    def canal(i, title):
+        return Channel(id=i, title=title, photo=ChatPhotoEmpty(), date=None, broadcast=True,
+                       username=f"c{i}", access_hash=1000 + i)
+
+    llamadas = []
+
+    class ClienteFalso:
+        async def get_entity(self, peer):
+            llamadas.append("get_entity")
+            if isinstance(peer, list):
+                return [canal(p.channel_id, "T") for p in peer]
+            if isinstance(peer, str) and peer == "destino":
+                return canal(7, "Destino")
+            raise ValueError(peer)
+
+        async def __call__(self, req):
+            llamadas.append(type(req).__name__)
+            if type(req).__name__ == "GetChannelsRequest":
+                return type("R", (), {"chats": [canal(c.channel_id, "T2") for c in req.id]})()
+            return type("F", (), {"full_chat": type("C", (), {"linked_chat_id": 55})()})()
+
+        async def iter_dialogs(self):
+            raise AssertionError("recorrido de diálogos")
+            yield
+
+    cache = CacheEntidades(str(tmp_path / "entidades.db"), ttl_sec=3600)
+    cli = ClienteFalso()
+
+    res = asyncio.run(resolver_canales(cli, cache, [1, 2]))
+    assert set(res) == {1, 2} and res[1].access_hash == 1001 and llamadas == ["get_entity"]
+    asyncio.run(resolver_canales(cli, cache, [1, 2]))
+    assert llamadas == ["get_entity"]                       # frescos: ninguna llamada
+
+    assert asyncio.run(enlazado(cli, cache, cache.obtener(1))) == 55
+    assert asyncio.run(enlazado(cli, cache, cache.obtener(1))) == 55 and llamadas.count("GetFullChannelRequest") == 1
+
+    cache.ttl_sec = 0                                       # caducados: un GetChannels por lote
+    res = asyncio.run(resolver_canales(cli, cache, [1, 2]))
+    assert llamadas[-1] == "GetChannelsRequest" and res[2].title == "T2" and res[1].linked_chat_id == 55
+
+    cache.ttl_sec = 3600
+    assert asyncio.run(resolver_destino(cli, cache, ["destino"])).id == 7
+    n = len(llamadas)
+    peer = asyncio.run(resolver_destino(ClienteFalso(), cache, ["destino"]))   # alias en caché
+    assert peer.channel_id == 7 and peer.access_hash == 1007 and len(llamadas) == n
@@ -0,0 +1,90 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "services" / "src" / "listener"))
+
+from comun.formato_stream import decodificar
+
+
+def test_handlers_del_listener_con_eventos_falsos(monkeypatch):
+    pytest.importorskip("telethon")
+    aioredis = pytest.importorskip("fakeredis.aioredis")
+    monkeypatch.setenv("LOG_DIR", "")
+    monkeypatch.setenv("LOG_CONSOLE", "0")
+    import listener as ls
+    import fake_telegram as ft
+
+    args = ft.parse_args(["--mensajes", "40", "--ritmo", "10000", "--canales", "3",
+                          "--ediciones", "0.5", "--tormenta", "2", "--concurrencia", "4"])
+    r = aioredis.FakeRedis(decode_responses=True)
+    inf = asyncio.run(ft.ejecutar(args, ls, r))
+
+    assert inf["mensajes"] == 40 and inf["ediciones"] % 2 == 0 and inf["ediciones"] > 0
+    assert sum(inf["publicados"].values()) == 40 + inf["ediciones"] and inf["descartados"] == 0
+    assert inf["lotes"] >= 1 and inf["latencia_listener_max_ms"] > 0
+    ultimo = decodificar(*asyncio.run(r.xrevrange(ls.PARSE_STREAM, count=1))[0])
+    assert int(ultimo["channel_id"]) in inf["canales"] and ultimo["ts_utc"].endswith("Z")
+
+
+def test_filtro_por_id_y_cache_sin_get_chat(monkeypatch):
+    pytest.importorskip("telethon")
+    aioredis = pytest.importorskip("fakeredis.aioredis")
+    monkeypatch.setenv("LOG_DIR", "")
+    monkeypatch.setenv("LOG_CONSOLE", "0")
+    import listener as ls
+    import fake_telegram as ft
+
+    canal, = ft.canales_falsos(1)
+    monkeypatch.setattr(ls, "CHANNEL_IDS", {canal.id})
+    monkeypatch.setattr(ls, "CHANNEL_CONFIG", {canal.id: {}})
+    monkeypatch.setattr(ls, "CANALES_META", {canal.id: ls.meta_canal(canal)})
+
+    class SinRed(ft.EventoFalso):
+        async def get_chat(self):
+            raise AssertionError("get_chat() en el camino común")
+
+    async def _prueba():
+        r = aioredis.FakeRedis(decode_responses=True)
+        publicador = ls.iniciar_publicador(r)
+        otro = ft.canales_falsos(2)[1]
+        await ls.on_new(SinRed(ft.MensajeFalso(1, "BUY XAUUSD 2000 SL 1990"), otro))   # canal no configurado
+        await ls.on_new(SinRed(ft.MensajeFalso(2, "BUY XAUUSD 2000 SL 1990"), canal))
+        await ls.vaciar_cola()
+        publicador.cancel()
+        return await r.xlen(ls.PARSE_STREAM)
+
+    assert asyncio.run(_prueba()) == 1
+
+
+def test_rafaga_en_lotes_y_prio_detras_de_su_senal(monkeypatch):
+    pytest.importorskip("telethon")
+    aioredis = pytest.importorskip("fakeredis.aioredis")
+    monkeypatch.setenv("LOG_DIR", "")
+    monkeypatch.setenv("LOG_CONSOLE", "0")
+    import listener as ls
+    import fake_telegram as ft
+
+    canal, = ft.canales_falsos(1)
+    monkeypatch.setattr(ls, "CHANNEL_IDS", {canal.id})
+    monkeypatch.setattr(ls, "CANALES_META", {canal.id: ls.meta_canal(canal)})
+    monkeypatch.setattr(ls, "_ULTIMO_NORMAL", {})
+
+    async def _prueba():
+        r = aioredis.FakeRedis(decode_responses=True)
+        publicador = ls.iniciar_publicador(r)
+        # Ráfaga encolada antes de que la tarea publicadora despierte: sale en un solo lote,
+        # cortado antes del cierre (su dep_id es la señal del mismo canal)
+        for i in range(1, 11):
+            await ls.on_new(ft.EventoFalso(ft.MensajeFalso(i, f"BUY XAUUSD 20{i:02d} SL 1990"), canal))
+        await ls.on_new(ft.EventoFalso(ft.MensajeFalso(11, "Close all XAUUSD now"), canal))
+        antes = ls.LST_LOTE.resumen()[0]
+        await ls.vaciar_cola()
+        publicador.cancel()
+        return ls.LST_LOTE.resumen()[0] - antes, await r.xrange(ls.PARSE_STREAM), await r.xrange(ls.PRIO_STREAM)
+
+    lotes, normal, prio = asyncio.run(_prueba())
+    assert lotes == 2 and [int(decodificar(i, f)["msg_id"]) for i, f in normal] == list(range(1, 11))
+    assert len(prio) == 1 and prio[0][1]["dep_id"] == normal[-1][0]
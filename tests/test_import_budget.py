@@ -0,0 +1,37 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+SRC = Path(__file__).resolve().parents[1] / "services" / "src"
+
+# Presupuesto (ms, acumulado del propio módulo en -X importtime) con margen amplio para máquinas lentas.
+# Referencia: pipeline ~25 ms, parseador_local ~110 ms (antes ~430 ms con Telethon + redis).
+PRESUPUESTO_MS = {"parser.pipeline": 150, "parser.parseador_local": 350}
+PESADOS = ("telethon", "redis", "asyncio")
+
+
+def _importar(modulo: str):
+    codigo = (f"import sys, {modulo}; "
+              f"print(','.join(m for m in {PESADOS!r} if m in sys.modules))")
+    env = dict(os.environ, PYTHONPATH=str(SRC), LOG_DIR="", LOG_CONSOLE="0")
+    p = subprocess.run([sys.executable, "-X", "importtime", "-c", codigo],
+                       capture_output=True, text=True, env=env, timeout=60)
+    assert p.returncode == 0, p.stderr[-2000:]
+    acumulado_us = None
+    for linea in p.stderr.splitlines():
+        partes = [x.strip() for x in linea.split("|")]
+        if len(partes) == 3 and partes[2] == modulo:
+            acumulado_us = int(partes[1])
+    return p.stdout.strip(), acumulado_us / 1000
+
+
+@pytest.mark.parametrize("modulo", sorted(PRESUPUESTO_MS))
+def test_import_sin_dependencias_pesadas_y_en_presupuesto(modulo):
+    if modulo == "parser.parseador_local":
+        pytest.importorskip("dotenv")
+    pesados, ms = _importar(modulo)
+    assert pesados == "", f"{modulo} importa {pesados} al cargarse"
+    assert ms < PRESUPUESTO_MS[modulo], f"{modulo}: {ms:.0f} ms > {PRESUPUESTO_MS[modulo]} ms"
@@ -0,0 +1,40 @@
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from parser.lag_monitor import MonitorLag, medir_lag
+
+
+def _stream(n):
+    r = fakeredis.FakeRedis()
+    r.xgroup_create("s", "g", id="0", mkstream=True)
+    for i in range(n):
+        r.xadd("s", {"ts_redis_ingest": "2020-01-01T00:00:00.000Z", "i": i})
+    return r
+
+
+def test_medir_lag_entradas_y_tiempo():
+    r = _stream(5)
+    m = medir_lag(r, "s", "g")
+    assert m["lag_entradas"] == 5 and m["pendientes"] == 0
+    assert m["lag_segundos"] > 3600      # usa ts_redis_ingest, no el ID
+
+    r.xreadgroup("g", "c", {"s": ">"}, count=2)
+    m = medir_lag(r, "s", "g")
+    assert m["lag_entradas"] == 3 and m["pendientes"] == 2
+
+
+def test_alerta_con_cooldown_y_recuperacion():
+    r = _stream(3)
+    alertas = []
+    mon = MonitorLag(r, "s", "g", alertar=alertas.append,
+                     umbral_entradas=2, umbral_sec=0, cooldown_sec=3600)
+    mon.comprobar()
+    mon.comprobar()
+    assert len(alertas) == 1
+
+    r.xreadgroup("g", "c", {"s": ">"})
+    for p in r.xpending_range("s", "g", "-", "+", 10):
+        r.xack("s", "g", p["message_id"])
+    mon.comprobar()
+    assert len(alertas) == 2 and alertas[1].startswith("✅")
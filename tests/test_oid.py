@@ -0,0 +1,20 @@
+from comun.oid import clave_mensaje, descomponer, es_legacy, generar_oid, oid_desde_evento, rango_oid
+
+
+def test_unico_por_canal_mensaje_revision():
+    base = {"ts_redis_ingest": "2026-01-01T10:00:00.000Z", "msg_id": "12345", "revision": "1"}
+    a = oid_desde_evento(dict(base, channel_id="1001"))
+    b = oid_desde_evento(dict(base, channel_id="2001"))
+    c = oid_desde_evento(dict(base, channel_id="1001", revision="2"))
+    assert len({a, b, c}) == 3
+    assert clave_mensaje(a) == clave_mensaje(c) != clave_mensaje(b)
+    assert descomponer(c) == {"t_ms": 1767261600000, "ch_id": 1001, "msg_id": 12345, "revision": 2}
+
+
+def test_orden_temporal_y_rango():
+    oids = [generar_oid(t, 9_999_999_999, 1, 1) for t in (1_700_000_000_000, 1_700_000_000_001, 1_800_000_000_000)]
+    assert oids == sorted(oids)
+    lo, hi = rango_oid(1_700_000_000_000, 1_700_000_000_002)
+    assert [o for o in oids if lo <= o < hi] == oids[:2]
+    assert max(len(o) for o in oids) <= 27      # comment MT4 (31) con sufijo "-<código>"
+    assert es_legacy("20260101-00012") and not es_legacy(oids[0])
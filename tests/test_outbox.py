@@ -0,0 +1,38 @@
+import sqlite3
+
+from parser import outbox
+
+
+def _cur():
+    con = sqlite3.connect(":memory:", isolation_level=None)
+    cur = con.cursor()
+    outbox.asegurar_tabla(cur)
+    return cur
+
+
+def test_clave_oid_sink_y_reclamar_una_vez():
+    cur = _cur()
+    outbox.insertar(cur, "oid1", "pasarela:parse", "1-0", {"csv": {"fila": {"oid": "oid1"}}, "socket": {"linea": "x"}})
+    # Reproceso de la misma entrada (o duplicado del listener): no crea otra salida
+    outbox.insertar(cur, "oid1", "pasarela:parse", "2-0", {"csv": {"fila": {"oid": "otro"}}})
+    reclamadas = outbox.reclamar(cur, oid="oid1")
+    assert [(s, p) for _o, s, p, _i in reclamadas] == [("csv", {"fila": {"oid": "oid1"}}), ("socket", {"linea": "x"})]
+    assert outbox.reclamar(cur, oid="oid1") == []
+    outbox.marcar(cur, "oid1", "csv", outbox.HECHO)
+    assert outbox.resumen(cur) == {"hecho": 1, "en_curso": 1}
+
+
+def test_arranque_interrumpidas_y_caducadas():
+    cur = _cur()
+    outbox.insertar(cur, "viejo", "s", "1-0", {"telegram": {"texto": "t"}})
+    cur.execute("UPDATE Outbox SET ts_creado = 0")
+    outbox.insertar(cur, "nuevo", "s", "2-0", {"csv": {}})
+    outbox.reclamar(cur, oid="nuevo")                      # proceso anterior cae a mitad
+    assert outbox.recuperar_interrumpidas(cur) == 1
+    assert outbox.caducar(cur, antes_ms=1) == 1
+    assert [(o, s, i) for o, s, _p, i in outbox.reclamar(cur, desde_ms=1)] == [("nuevo", "csv", True)]
+    outbox.insertar(cur, "fallo", "s", "3-0", {"socket": {}})
+    outbox.marcar(cur, "fallo", "socket", outbox.ERROR, "sin EA")
+    cur.execute("UPDATE Outbox SET ts_creado = 0 WHERE oid = 'fallo'")
+    assert outbox.purgar(cur, antes_ms=1) == 2                 # caducada + error fuera de la retención
+    assert outbox.resumen(cur) == {"en_curso": 1}
@@ -0,0 +1,54 @@
+import sqlite3
+
+import pytest
+
+
+@pytest.fixture
+def pl(monkeypatch):
+    pytest.importorskip("fakeredis")
+    pytest.importorskip("dotenv")
+    monkeypatch.setenv("LOG_DIR", "")
+    monkeypatch.setenv("LOG_CONSOLE", "0")
+    from parser import parseador_local
+    return parseador_local
+
+
+def _entrada(pl, texto="BUY XAUUSD"):
+    import fakeredis
+    r = fakeredis.FakeRedis()
+    r.xgroup_create("s", pl.REDIS_GROUP, id="0", mkstream=True)
+    r.xadd("s", {"type": "new", "channel_id": "10", "msg_id": "5", "text/raw": texto, "revision": "1",
+                 "ts_redis_ingest": "2026-03-01T10:00:00.000Z"})
+    (entry_id, fields), = r.xreadgroup(pl.REDIS_GROUP, pl.CONSUMER, {"s": ">"})[0][1]
+    return r, entry_id, fields
+
+
+def test_bbdd_bloqueada_no_confirma_la_entrada(pl, monkeypatch):
+    fila = {"oid": "x", "symbol": "XAUUSD", "order_type": "BUY", "entry_price": None, "sl": None,
+            "tp1": None, "tp2": None, "tp3": None, "tp4": None, "estado_operacion": 6}
+    monkeypatch.setattr(pl.pipeline, "clasificar_evento", lambda data: (None, 5, "BUY XAUUSD", dict(fila)))
+
+    def bloqueada(*a, **k):
+        raise sqlite3.OperationalError("database is locked")
+    monkeypatch.setattr(pl, "db_registrar_mensaje", bloqueada)
+    monkeypatch.setattr(pl, "_BBDD_FALLO", None)
+
+    r, entry_id, fields = _entrada(pl)
+    pl._procesar_entrada(r, "s", entry_id, fields)
+    assert r.xpending("s", pl.REDIS_GROUP)["pending"] == 1        # sigue pendiente: se reprocesará
+    assert pl._BBDD_FALLO is not None
+
+
+def test_edicion_no_repite_la_linea_del_socket(pl, monkeypatch, tmp_path):
+    from comun.oid import generar_oid
+    monkeypatch.setattr(pl, "DB_FILE", str(tmp_path / "pasarela.db"))
+    pl.db_connect().close()
+
+    def registrar(revision):
+        oid = generar_oid(1772359200000 + revision, 10, 5, revision)
+        basico = {"oid": oid, "ch_id": 10, "msg_id": 5, "revision": revision, "score": 10}
+        salidas = {"csv": {"fila": {"oid": oid}}, "socket": {"linea": oid}, "telegram": {"texto": "t"}}
+        return [s for _o, s, _p, _i in pl.db_registrar_mensaje(basico, None, "s", f"{revision}-0", salidas)]
+
+    assert registrar(1) == ["csv", "socket", "telegram"]
+    assert registrar(2) == ["csv"]          # la edición no abre otra operación en el EA ni repite la alerta
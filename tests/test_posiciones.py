@@ -0,0 +1,63 @@
+import time
+
+from parser.posiciones import IndicePosiciones
+
+
+def test_resolucion_reply_y_simbolo():
+    idx = IndicePosiciones()
+    idx.aplicar("a", "1001", "BUY", "XAUUSD", msg_id=10)
+    idx.aplicar("b", "1001", "SELL", "EURUSD", msg_id=11)
+    idx.aplicar("c", "1001", "BUY", "XAUUSD", msg_id=12)
+    idx.aplicar("x", "2002", "BUY", "XAUUSD", msg_id=10)
+    assert idx.aplicar("c2", "1001", "BUY", "XAUUSD", msg_id=12) == [] and len(idx) == 4   # edición: no abre otra
+
+    assert idx.resolver("1001", "BREAKEVEN", reply_to=11) == ["b"]
+    assert idx.resolver("1001", "BREAKEVEN", "xauusd") == ["a", "c"]
+    assert idx.resolver("1001", "SL A", "XAUUSD") == ["c"]                # MOVETO: solo la más reciente
+    assert idx.resolver("1001", "PARCIAL") == []                          # sin reply ni símbolo: nada
+    assert idx.resolver("1001", "PARCIAL", reply_to=99) == []              # reply a algo que no es una señal
+    assert idx.aplicar("z", "1001", "CERRAR", "XAUUSD") == ["a", "c"]
+    assert idx.resolver("1001", "CERRAR", "EURUSD") == ["b"] and idx.resolver("2002", "CERRAR", "XAUUSD") == ["x"]
+
+
+def test_ack_poda_y_reconstruccion():
+    idx = IndicePosiciones(ventana_horas=1)
+    idx.abrir("a", "1", "XAUUSD", "BUY", t_ms=0)
+    idx.abrir("b", "1", "EURUSD", "SELL", t_ms=10_000_000)
+    idx.ack("b", "")
+    assert idx._oid["b"].confirmada
+    assert idx.podar(ahora_ms=3_700_000 + 1) == 1 and list(idx._oid) == ["b"]
+    idx.ack("b", "CERRADA 12345")
+    assert len(idx) == 0
+
+    ahora = int(time.time() * 1000)
+    nuevo = IndicePosiciones()
+    filas = [("a", "1", "10", "XAUUSD", "BUY", None, ahora), ("b", "1", "11", "EURUSD", "SELL", None, ahora),
+             ("c", "1", "12", None, "CERRAR", "a", ahora), ("d", "1", "13", "GBPUSD", "BUY", None, ahora)]
+    assert nuevo.reconstruir(filas) == 2
+    assert sorted(nuevo._oid) == ["b", "d"]
+
+
+def test_gestion_reprocesada_no_se_resuelve_otra_vez():
+    t = int(time.time() * 1000)
+    idx = IndicePosiciones()
+    idx.reconstruir([("a", "1001", 10, "XAUUSD", "BUY", None, t),
+                     ("b", "1001", 11, "XAUUSD", "BUY", None, t),
+                     ("g", "1001", 12, None, "CERRAR", "a", t)])          # CERRAR ya guardado, en reply a 'a'
+    # La misma entrada, sin ACK, se reprocesa al arrancar: no cae al símbolo
+    assert idx.aplicar("g", "1001", "CERRAR", "XAUUSD", reply_to=10) == ["a"] and len(idx) == 1
+    assert idx.aplicar("h", "1001", "CERRAR", "XAUUSD") == ["b"] and len(idx) == 0
+    assert idx.aplicar("h", "1001", "CERRAR", "XAUUSD") == ["b"]
+
+
+def test_gestion_editada_no_se_resuelve_otra_vez():
+    from comun.oid import generar_oid
+    t = int(time.time() * 1000)
+    idx = IndicePosiciones()
+    for msg in (10, 11):
+        idx.aplicar(generar_oid(t, 1001, msg, 1), "1001", "BUY", "XAUUSD", msg_id=msg)
+    a, b = list(idx._oid)
+    assert idx.aplicar(generar_oid(t, 1001, 12, 1), "1001", "CERRAR", "XAUUSD", reply_to=10) == [a]
+    # Edición del CERRAR (otro oid, mismo mensaje): mismos objetivos, 'b' sigue abierta
+    assert idx.aplicar(generar_oid(t + 5, 1001, 12, 2), "1001", "CERRAR", "XAUUSD", reply_to=10) == [a]
+    assert list(idx._oid) == [b]
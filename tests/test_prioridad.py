@@ -0,0 +1,16 @@
+from comun.prioridad import es_gestion, id_menor_igual, stream_prio
+
+
+def test_prefiltro_gestion():
+    for t in ("Close all XAUUSD now", "Cerramos la mitad", "Partial close TP1", "Move SL to entry",
+              "SL a BE", "Ponemos break even", "stoploss to 1990"):
+        assert es_gestion(t), t
+    for t in ("BUY XAUUSD 2000 SL 1990 TP 2010", "sell gold now", "Buenos días", "", None):
+        assert not es_gestion(t), t
+
+
+def test_orden_ids_y_stream():
+    assert id_menor_igual("1712345678901-0", "1712345678901-0")
+    assert id_menor_igual(b"1712345678901-2", "1712345678901-10")
+    assert not id_menor_igual("1712345678902-0", "1712345678901-99")
+    assert stream_prio("pasarela:parse") == "pasarela:parse:prio"
@@ -0,0 +1,91 @@
+import asyncio
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "services" / "src" / "listener"))
+
+
+def test_revision_dedup_y_xadd_en_un_script():
+    aioredis = pytest.importorskip("fakeredis.aioredis")
+    pytest.importorskip("lupa")
+    from publicacion import publicar
+
+    async def _prueba():
+        r = aioredis.FakeRedis(decode_responses=True)
+        nuevo = await publicar(r, "s", "new", 10, 5, {"text/raw": "BUY", "t_cap": 1}, 1000, 60, formato="1")
+        repetido = await publicar(r, "s", "new", 10, 5, {"text/raw": "BUY"}, 1000, 60, formato="1")
+        # Ediciones simultáneas del mismo mensaje: revisiones distintas, sin huecos ni duplicados
+        ediciones = await asyncio.gather(*[publicar(r, "s", "edit", 10, 5, {"text/raw": "SELL"}, 1000, 60, formato="1")
+                                           for _ in range(4)])
+        return nuevo, repetido, ediciones, await r.xrange("s")
+
+    nuevo, repetido, ediciones, entradas = asyncio.run(_prueba())
+    assert nuevo[0] == 1 and nuevo[1] == entradas[0][0]
+    assert repetido == (1, None)
+    assert sorted(rev for rev, _ in ediciones) == [2, 3, 4, 5]
+    assert len(entradas) == 5
+    campos = entradas[0][1]
+    assert campos["revision"] == "1" and campos["text/raw"] == "BUY" and campos["t_cap"] == "1"
+    ingest = datetime.strptime(campos["ts_redis_ingest"], "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=timezone.utc)
+    assert abs((datetime.now(timezone.utc) - ingest).total_seconds()) < 60
+
+
+def test_formato_compacto_y_diccionario_de_canales():
+    aioredis = pytest.importorskip("fakeredis.aioredis")
+    pytest.importorskip("lupa")
+    from publicacion import publicar
+    from comun.formato_stream import CANALES_KEY, decodificar
+
+    campos = {"channel_username": "senales", "channel_title": "Señales VIP", "ts_utc": "2026-03-01T10:00:00.250Z",
+              "sender_id": "", "text/raw": "BUY XAUUSD 2000", "estado_operacion": "0", "reply_to": 7,
+              "t_cap": 1772359200300, "d_lst": "0.5", "recuperado": "1"}
+
+    async def _prueba():
+        r = aioredis.FakeRedis(decode_responses=True)
+        await publicar(r, "s", "new", 10, 5, campos, 1000, 60, formato="2")
+        await publicar(r, "s", "edit", 10, 5, {**campos, "channel_title": "Señales VIP 2"}, 1000, 60, formato="2")
+        return await r.xrange("s"), await r.hgetall(CANALES_KEY)
+
+    entradas, diccionario = asyncio.run(_prueba())
+    assert set(entradas[0][1]) == {"v", "r", "c", "m", "ts", "x", "rt", "tc", "dl", "rc"}
+    assert diccionario == {"10": '{"u":"senales","t":"Señales VIP 2"}'}
+    nuevo, edicion = (decodificar(i, f, {"10": ("senales", "Señales VIP")}) for i, f in entradas)
+    assert nuevo == {**campos, "type": "new", "channel_id": "10", "msg_id": "5", "reply_to": "7",
+                     "t_cap": "1772359200300", "revision": "1", "ts_redis_ingest": nuevo["ts_redis_ingest"]}
+    assert nuevo["ts_redis_ingest"] == datetime.fromtimestamp(int(entradas[0][0].split("-")[0]) / 1000, timezone.utc) \
+        .strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+    assert edicion["type"] == "edit" and edicion["revision"] == "2"
+
+
+def test_decodificar_msgpack_y_v1_en_bytes():
+    pytest.importorskip("msgpack")
+    from comun.formato_stream import codificar, decodificar
+
+    v1 = {"type": "edit", "channel_id": "10", "msg_id": "5", "ts_utc": "2026-03-01T10:00:00.250Z",
+          "text/raw": "SELL", "revision": "2", "ts_redis_ingest": "2026-03-01T10:00:01.000Z"}
+    crudo = {k.encode(): v.encode() for k, v in v1.items()}
+    assert decodificar(b"1772359201000-0", crudo) == v1
+
+    binario = codificar({**v1, "dep_id": ""}, msgpack_=True)
+    assert set(binario) == {"v", "b", "dep_id"}
+    crudo = {k.encode(): v if isinstance(v, bytes) else str(v).encode() for k, v in binario.items()}
+    data = decodificar(b"1772359201000-0", {**crudo, b"r": b"2"})
+    assert {k: data[k] for k in v1} == v1 and data["dep_id"] == ""
+
+
+def test_parser_confirma_entrada_v2_ilegible(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("dotenv")
+    monkeypatch.setenv("LOG_DIR", "")
+    monkeypatch.setenv("LOG_CONSOLE", "0")
+    from parser import parseador_local as pl
+
+    r = fakeredis.FakeRedis()
+    r.xgroup_create("s", pl.REDIS_GROUP, id="0", mkstream=True)
+    entry_id = r.xadd("s", {"v": "2", "c": "10", "m": "5", "ts": "notanint", "x": "BUY", "r": "1"})
+    r.xreadgroup(pl.REDIS_GROUP, pl.CONSUMER, {"s": ">"})
+    pl._procesar_entrada(r, "s", entry_id, r.xrange("s")[0][1])          # no lanza
+    assert r.xpending("s", pl.REDIS_GROUP)["pending"] == 0
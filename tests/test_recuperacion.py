@@ -0,0 +1,64 @@
+import asyncio
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "services" / "src" / "listener"))
+
+from comun.formato_stream import decodificar
+
+
+def test_hueco_desde_la_marca_en_paralelo(monkeypatch, tmp_path):
+    pytest.importorskip("telethon")
+    aioredis = pytest.importorskip("fakeredis.aioredis")
+    monkeypatch.setenv("LOG_DIR", "")
+    monkeypatch.setenv("LOG_CONSOLE", "0")
+    import listener as ls
+    import fake_telegram as ft
+    from marcas import MarcasAgua
+
+    a, b, c = ft.canales_falsos(3)
+    ahora = datetime.now(timezone.utc)
+    historia = {a.id: [ft.MensajeFalso(i, f"BUY XAUUSD 20{i:02d} SL 1990", date=ahora - timedelta(minutes=30))
+                       for i in range(1, 6)],
+                b.id: [ft.MensajeFalso(7, "Close all XAUUSD now", date=ahora)]}
+    pedidos = {}
+
+    class ClienteFalso:
+        async def iter_messages(self, peer, limit=None, min_id=0, offset_date=None, reverse=False):
+            pedidos[peer.channel_id] = min_id
+            for m in historia.get(peer.channel_id, []):
+                if m.id > min_id and m.date >= offset_date:
+                    yield m
+
+    marcas = MarcasAgua(str(tmp_path / "marcas.db"))
+    marcas.ver(a.id, 2)
+    marcas.ver(b.id, 6)
+    monkeypatch.setattr(ls, "client", ClienteFalso())
+    monkeypatch.setattr(ls, "MARCAS", marcas)
+    monkeypatch.setattr(ls, "CHANNEL_IDS", {a.id, b.id, c.id})
+    monkeypatch.setattr(ls, "CANALES_META", {x.id: ls.meta_canal(x) for x in (a, b, c)})
+    monkeypatch.setattr(ls, "_ULTIMO_NORMAL", {})
+
+    async def _prueba():
+        r = aioredis.FakeRedis(decode_responses=True)
+        publicador = ls.iniciar_publicador(r)
+        # El 3 del canal a llega en vivo: su marca avanza y ya no se pide
+        await ls.on_new(ft.EventoFalso(ft.MensajeFalso(3, "BUY XAUUSD 2003 SL 1990"), a))
+        await ls.vaciar_cola()
+        n = await ls.recuperar_huecos("reconexion")
+        await ls.vaciar_cola()
+        publicador.cancel()
+        return n, await r.xrange(ls.PARSE_STREAM), await r.xrange(ls.PRIO_STREAM)
+
+    n, normal, prio = asyncio.run(_prueba())
+    assert pedidos == {a.id: 3, b.id: 6}                   # c sin marca: nada que pedir
+    assert n == 3                                          # 4 y 5 de a, 7 de b
+    normal = [decodificar(i, f) for i, f in normal]
+    assert [(f["msg_id"], f.get("recuperado")) for f in normal] == [("3", None), ("4", "1"), ("5", "1")]
+    assert decodificar(*prio[0])["recuperado"] == "1"
+    assert marcas.get(a.id) == 5 and marcas.get(b.id) == 7
+    marcas.cerrar()
+    assert MarcasAgua(str(tmp_path / "marcas.db")).get(a.id) == 5
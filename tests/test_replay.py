@@ -0,0 +1,20 @@
+import pytest
+
+from parser.replay import diferencias, eventos_stream
+
+
+def test_xrange_paginado():
+    fakeredis = pytest.importorskip("fakeredis")
+    r = fakeredis.FakeRedis()
+    ids = [r.xadd("s", {"msg_id": str(i), "text": f"m{i}"}).decode() for i in range(5)]
+    evs = list(eventos_stream(r, "s", lote=2))
+    assert [e["_entry_id"] for e in evs] == ids
+    assert [e["msg_id"] for e in eventos_stream(r, "s", ids[1], ids[3], lote=2)] == ["1", "2", "3"]
+
+
+def test_diferencias_con_fila_guardada():
+    guardada = {"score": 10, "order_type": "BUY", "symbol": "XAUUSD", "entry_price": 2000.0, "sl": 1980.0, "tp": "2010.0 / 2020"}
+    fila = {"order_type": "BUY", "symbol": "XAUUSD", "entry_price": 2000, "sl": 1990.0, "tp1": 2010.0, "tp2": 2020}
+    assert diferencias(guardada, 10, fila) == {"sl": (1980.0, 1990.0)}
+    # Rechazada antes (sin campos operativos guardados): solo cuenta el score
+    assert diferencias(dict(guardada, score=6, sl=None), 10, fila) == {"score": (6, 10)}
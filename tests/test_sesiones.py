@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+from comun import sesiones
+
+
+def _login(nombre, dato):
+    from telethon.crypto import AuthKey
+    from telethon.sessions import SQLiteSession
+    s = SQLiteSession(nombre)
+    s.set_dc(2, "149.154.167.51", 443)
+    s.auth_key = AuthKey(data=bytes([dato]) * 256)
+    s.save()
+    s.close()
+
+
+def test_cada_rol_con_su_propia_autorizacion(monkeypatch, tmp_path):
+    pytest.importorskip("telethon")
+    from telethon.sessions import StringSession
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("TELEGRAM_SESSION_MEMORIA", "parser")
+    assert sesiones.sesion("listener", "base") == "base_listener"          # sin login: archivo propio
+    _login("base", 1)
+    assert sesiones.sesion("parser", "base") == "base_parser"              # la clave base no se reparte
+    assert not os.path.exists("base_parser.session")
+
+    assert sesiones.heredar_base("base")                                   # la base pasa al listener
+    assert not os.path.exists("base.session")
+    assert sesiones.leer_clave("base_listener")[3] == bytes([1]) * 256
+    assert not sesiones.heredar_base("base")
+
+    _login("base_parser", 2)
+    mem = sesiones.sesion("parser", "base")
+    assert isinstance(mem, StringSession) and mem.auth_key.key == bytes([2]) * 256 and mem.dc_id == 2
+
+
+def test_listener_hereda_la_base_al_arrancar(monkeypatch, tmp_path):
+    pytest.importorskip("telethon")
+    monkeypatch.chdir(tmp_path)
+    _login("base", 1)
+    assert sesiones.sesion("listener", "base") == "base_listener"         # sin pasar por 'login'
+    assert not os.path.exists("base.session")
+    assert sesiones.leer_clave("base_listener")[3] == bytes([1]) * 256
@@ -0,0 +1,50 @@
+import threading
+
+from parser.sinks import Despachador, Sink
+
+
+def test_dependencias_reintentos_y_aislamiento():
+    desp = Despachador(("mt4", "bbdd", "telegram"))
+    fallos = {"n": 0}
+    suelta = threading.Event()
+
+    def bbdd_con_lock():
+        fallos["n"] += 1
+        if fallos["n"] < 3:
+            raise OSError("locked")
+        return "ok"
+
+    def roto():
+        raise ValueError("x")
+
+    lote = desp.lanzar([
+        Sink("csv", "mt4", lambda: "fila"),
+        Sink("bbdd_basico", "bbdd", bbdd_con_lock, reintentos=2, espera=0.001),
+        Sink("bbdd_operativos", "bbdd", roto, depende=("bbdd_basico",)),
+        Sink("spans", "bbdd", lambda: None, depende=("bbdd_operativos",)),
+        Sink("telegram", "telegram", suelta.wait, esperar=False),
+    ])
+    res = lote.esperar(timeout=5)
+    assert res["csv"].ok and res["csv"].valor == "fila"
+    assert res["bbdd_basico"].ok and res["bbdd_basico"].intentos == 3
+    assert res["bbdd_operativos"].estado == "error"
+    assert res["spans"].estado == "omitido"
+    assert "telegram" not in res            # no se espera
+
+    fin = threading.Event()
+    lote.al_terminar(lambda _l: fin.set())
+    suelta.set()
+    assert fin.wait(5) and lote.resultados["telegram"].ok
+    desp.cerrar()
+
+
+def test_profundidad_del_carril():
+    desp = Despachador(("telegram",))
+    suelta = threading.Event()
+    futuros = [desp.enviar("telegram", suelta.wait, 5) for _ in range(3)]
+    assert desp.pendientes("telegram") == 3              # uno en curso + dos en cola
+    suelta.set()
+    for f in futuros:
+        f.result(5)
+    desp.cerrar()
+    assert desp.pendientes("telegram") == 0
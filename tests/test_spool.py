@@ -0,0 +1,55 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "services" / "src" / "listener"))
+
+from comun.formato_stream import decodificar
+
+
+def test_redis_caido_spool_y_drenado_en_orden(monkeypatch, tmp_path):
+    pytest.importorskip("telethon")
+    pytest.importorskip("lupa")
+    fakeredis = pytest.importorskip("fakeredis")
+    from fakeredis import aioredis
+    monkeypatch.setenv("LOG_DIR", "")
+    monkeypatch.setenv("LOG_CONSOLE", "0")
+    import listener as ls
+    import fake_telegram as ft
+    from spool import Spool
+    from publicacion import publicar
+
+    canal, = ft.canales_falsos(1)
+    monkeypatch.setattr(ls, "CHANNEL_IDS", {canal.id})
+    monkeypatch.setattr(ls, "CANALES_META", {canal.id: ls.meta_canal(canal)})
+    monkeypatch.setattr(ls, "SPOOL", Spool(str(tmp_path / "spool.db")))
+    monkeypatch.setattr(ls, "_ULTIMO_NORMAL", {})
+
+    async def _prueba():
+        server = fakeredis.FakeServer()
+        r = aioredis.FakeRedis(server=server, decode_responses=True)
+        publicador = ls.iniciar_publicador(r)
+        server.connected = False
+        await ls.on_new(ft.EventoFalso(ft.MensajeFalso(1, "BUY XAUUSD 2000 SL 1990 TP 2010"), canal))
+        await ls.on_edit(ft.EventoFalso(ft.MensajeFalso(1, "BUY XAUUSD 2000 SL 1985 TP 2010",
+                                                        edit_date=ft.datetime.now(ft.timezone.utc)), canal))
+        await ls.vaciar_cola()
+        server.connected = True
+        # Redis ya responde pero el spool no está vacío: lo nuevo va detrás, en orden
+        await ls.on_new(ft.EventoFalso(ft.MensajeFalso(2, "Close all XAUUSD now"), canal))
+        await ls.vaciar_cola()
+        publicador.cancel()
+        assert len(ls.SPOOL) == 3 and await r.xlen(ls.PARSE_STREAM) == 0
+
+        # Una fila ya publicada antes del corte (idem existente) no se repite
+        id_, tipo, ch, msg, stream, idem, fields = ls.SPOOL.primeras(1)[0]
+        await publicar(r, stream, tipo, ch, msg, fields, 1000, 60, idem=idem)
+        assert await ls.drenar(r) == 3
+        return (await r.xrange(ls.PARSE_STREAM), await r.xrange(ls.PRIO_STREAM))
+
+    normal, prio = asyncio.run(_prueba())
+    assert [(d["type"], d["revision"]) for d in (decodificar(i, f) for i, f in normal)] == [("new", "1"), ("edit", "2")]
+    assert len(prio) == 1 and prio[0][1]["dep_id"] == normal[-1][0]
+    assert len(ls.SPOOL) == 0 and not ls.SPOOL.activo()
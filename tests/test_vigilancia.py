@@ -0,0 +1,77 @@
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "services" / "src" / "listener"))
+
+import vigilancia
+
+
+@pytest.mark.parametrize("inotify", [True, False])
+def test_cambio_por_reemplazo_atomico(tmp_path, inotify):
+    ruta = tmp_path / "channels.json"
+    ruta.write_text("{}")
+
+    async def _prueba():
+        gen = vigilancia.cambios(str(ruta), sondeo=0.05, rebote=0.05, inotify=inotify)
+        siguiente = asyncio.ensure_future(gen.__anext__())
+        await asyncio.sleep(0.1)
+        assert not siguiente.done()
+        tmp = tmp_path / "channels.json.tmp"
+        tmp.write_text('{"channels": []}')
+        os.replace(tmp, ruta)
+        (tmp_path / "otro.json").write_text("{}")      # otro archivo del directorio: no cuenta
+        assert await asyncio.wait_for(siguiente, 2) == str(ruta)
+        await gen.aclose()
+
+    asyncio.run(_prueba())
+
+
+def test_validacion_incremental_y_sustitucion(monkeypatch, tmp_path):
+    pytest.importorskip("telethon")
+    monkeypatch.setenv("LOG_DIR", "")
+    monkeypatch.setenv("LOG_CONSOLE", "0")
+    import listener as ls
+    import fake_telegram as ft
+    from comun.entidades import CacheEntidades
+
+    canales = {c.id: c for c in ft.canales_falsos(4)}
+    a, b, c, d = canales
+    consultas = []
+
+    class ClienteFalso:
+        async def get_entity(self, peer):
+            peers = peer if isinstance(peer, list) else [peer]
+            consultas.append([p.channel_id for p in peers])
+            return [canales[p.channel_id] for p in peers] if isinstance(peer, list) else canales[peer.channel_id]
+
+        async def iter_dialogs(self):
+            raise AssertionError("iter_dialogs() con todo resuelto por id")
+            yield
+
+    ruta = tmp_path / "channels.json"
+    monkeypatch.setattr(ls, "CONFIG_FILE", str(ruta))
+    monkeypatch.setattr(ls, "client", ClienteFalso())
+    monkeypatch.setattr(ls, "_VALIDADOS", {})
+    monkeypatch.setattr(ls, "CANALES_META", {})
+    monkeypatch.setattr(ls, "CACHE_ENT", CacheEntidades(str(tmp_path / "entidades.db")))
+
+    def escribir(ids, titulo_b="B"):
+        ruta.write_text(json.dumps({"channels": [{"id": i, "title": titulo_b if i == b else str(i)} for i in ids]}))
+        return ls.load_channels_from_file()
+
+    asyncio.run(ls.validate_and_enrich_channels(escribir([a, b, c])))
+    assert consultas == [[a, b, c]] and ls.CHANNEL_IDS == {a, b, c}
+    assert set(ls.CANALES_META) == {a, b, c}
+
+    # Añade d, cambia b, quita c: se revalidan b y d, pero b ya está en la caché de entidades
+    asyncio.run(ls.validate_and_enrich_channels(escribir([a, b, d], titulo_b="B2")))
+    assert consultas[-1] == [d] and ls.CHANNEL_IDS == {a, b, d}
+    assert ls.CHANNEL_CONFIG[b]["title"] == "B2" and c not in ls.CANALES_META
+
+    asyncio.run(ls.validate_and_enrich_channels(escribir([a, b, d], titulo_b="B2")))   # sin cambios
+    assert len(consultas) == 2